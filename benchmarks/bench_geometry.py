@@ -0,0 +1,75 @@
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import geometry
+
+
+def order_points_loop(point_list):
+    # 原来逐个四边形三次 sorted 的写法, 作为对照
+    result = []
+    for p in point_list:
+        p = sorted(p.tolist(), key=lambda x: x[0])
+        a1 = sorted(p[:2], key=lambda x: x[1])
+        a2 = sorted(p[2:], key=lambda x: x[1])
+        result.append([a1[0], a2[0], a2[1], a1[1]])
+    return np.array(result, np.int)
+
+
+def to_image_loop(point_list, scale, offset, size):
+    result = []
+    for p in point_list:
+        p = p.astype(np.float64)
+        p[:, 0] -= offset[0]
+        p[:, 1] -= offset[1]
+        p /= scale
+        p = np.round(p).astype(np.int)
+        p[:, 0] = np.clip(p[:, 0], 0, size[0] - 1)
+        p[:, 1] = np.clip(p[:, 1], 0, size[1] - 1)
+        result.append(p)
+    return result
+
+
+def bench(func, repeat):
+    number = max(1, repeat)
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='geometry 模块的微基准测试')
+    parser.add_argument('--sizes', default='1,10,100,1000,10000,100000', help='四边形个数, 逗号分隔')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    scale = 0.37
+    offset = (12.5, 30.25)
+    size = (4000, 3000)
+
+    print(f'{"N":>8} {"op":<22} {"loop ms":>10} {"vector ms":>10} {"speedup":>8}')
+    for n in [int(x) for x in args.sizes.split(',')]:
+        point_list = rng.randint(0, 4000, (n, 4, 2))
+        view_list = geometry.to_view(point_list, scale, offset)
+        repeat = max(1, 10000 // n)
+
+        case_list = [
+            ('order_points', lambda: order_points_loop(point_list), lambda: geometry.order_points(point_list)),
+            ('to_image', lambda: to_image_loop(view_list, scale, offset, size),
+             lambda: geometry.to_image(view_list, scale, offset, size)),
+            ('to_view', lambda: [geometry.to_view(p, scale, offset) for p in point_list],
+             lambda: geometry.to_view(point_list, scale, offset)),
+            ('quad_area', lambda: [geometry.quad_area(p) for p in point_list],
+             lambda: geometry.quad_area(point_list)),
+        ]
+        for name, loop_func, vector_func in case_list:
+            loop_time = bench(loop_func, repeat)
+            vector_time = bench(vector_func, repeat)
+            print(f'{n:>8} {name:<22} {loop_time * 1000:>10.3f} {vector_time * 1000:>10.3f} '
+                  f'{loop_time / vector_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
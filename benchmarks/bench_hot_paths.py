@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# 必须在导入 PySide2 之前设置, 不需要显示器
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PySide2.QtCore import QEvent
+from PySide2.QtCore import QEventLoop
+from PySide2.QtCore import QPointF
+from PySide2.QtCore import Qt
+from PySide2.QtGui import QColor
+from PySide2.QtGui import QImage
+from PySide2.QtGui import QMouseEvent
+from PySide2.QtGui import QPainter
+from PySide2.QtWidgets import QApplication
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import image_scanner
+import label_db
+import main as tool
+
+
+class Timer:
+    def __init__(self):
+        self.results = {}
+
+    def record(self, name, seconds):
+        self.results.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        summary = {}
+        for name, value_list in self.results.items():
+            value_list = sorted(value_list)
+            summary[name] = {
+                'count': len(value_list),
+                'mean': sum(value_list) / len(value_list),
+                'p50': value_list[len(value_list) // 2],
+                'p95': value_list[min(int(len(value_list) * 0.95), len(value_list) - 1)],
+                'max': value_list[-1],
+            }
+        return summary
+
+
+def random_quad(rng, width, height):
+    w = rng.randint(20, max(21, width // 4))
+    h = rng.randint(10, max(11, height // 20))
+    x = rng.randint(0, max(1, width - w))
+    y = rng.randint(0, max(1, height - h))
+    jitter = rng.randint(-3, 4, (4, 2))
+    point_list = np.array([(x, y), (x + w, y), (x + w, y + h), (x, y + h)]) + jitter
+    return np.clip(point_list, 0, (width - 1, height - 1))
+
+
+def generate_dataset(directory, image_count, width, height, box_count, nested, seed=0):
+    rng = np.random.RandomState(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    img_name_list = []
+    for i in range(image_count):
+        sub_dir = '/'.join(f'd{(i // 100) % 10}' for _ in range(nested))
+        img_name = f'{sub_dir}/{i:06d}.jpg' if sub_dir else f'{i:06d}.jpg'
+        img_path = directory.joinpath(img_name)
+        img_path.parent.mkdir(parents=True, exist_ok=True)
+
+        img = QImage(width, height, QImage.Format_RGB888)
+        img.fill(QColor(240, 240, 240))
+        painter = QPainter()
+        painter.begin(img)
+        for _ in range(min(box_count, 200)):
+            x, y = rng.randint(0, width), rng.randint(0, height)
+            painter.fillRect(x, y, rng.randint(10, 200), rng.randint(5, 40), QColor(*rng.randint(0, 200, 3).tolist()))
+        painter.end()
+        img.save(str(img_path), quality=90)
+        img_name_list.append(img_name)
+
+    db_label = label_db.DBLabelText(str(directory.joinpath('label.sqllite3')))
+    db_label.import_all_text(
+        ((img_name, [(random_quad(rng, width, height), '') for _ in range(box_count)]) for img_name in img_name_list),
+        replace=True
+    )
+    db_label.close()
+
+
+def wait_loaded(app, window, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while window.img_load_generation is not None and time.perf_counter() < deadline:
+        app.processEvents(QEventLoop.AllEvents, 10)
+
+
+def bench_scan(timer, directory):
+    manifest_file = Path(directory).joinpath(image_scanner.IMAGE_MANIFEST_FILE)
+    if manifest_file.exists():
+        manifest_file.unlink()
+
+    # 直接调用 run, 在当前线程里同步扫描
+    for name in ['get_all_img_file.cold', 'get_all_img_file.manifest']:
+        scanner = image_scanner.ImageScanner(directory)
+        with timer.measure(name):
+            scanner.run()
+    return list(image_scanner.ImageScanner(directory).scan({}, {}))
+
+
+def bench_db(timer, directory, img_name_list, repeat):
+    work_dir = tempfile.mkdtemp(prefix='bench_db_')
+    try:
+        db_file = os.path.join(work_dir, 'label.sqllite3')
+        shutil.copy(str(Path(directory).joinpath('label.sqllite3')), db_file)
+        db_label = label_db.DBLabelText(db_file)
+        rng = np.random.RandomState(1)
+
+        for img_name in img_name_list:
+            with timer.measure('db.get_all_text'):
+                db_label.get_all_text(img_name)
+            with timer.measure('db.get_all_text_array'):
+                db_label.get_all_text_array(img_name)
+
+        img_name = img_name_list[0]
+        id_list = []
+        for _ in range(repeat):
+            with timer.measure('db.add_text'):
+                id_list.append(db_label.add_text(img_name, random_quad(rng, 1000, 1000), ''))
+
+        for i in range(repeat):
+            with timer.measure('db.update_points'):
+                db_label.update_points(img_name, id_list[i % 10], random_quad(rng, 1000, 1000))
+            with timer.measure('db.update_text'):
+                db_label.update_text(img_name, id_list[i % 10], f'text {i}')
+            if i % 50 == 49:
+                with timer.measure('db.flush'):
+                    db_label.flush()
+
+        for id in id_list:
+            with timer.measure('db.del_text'):
+                db_label.del_text(img_name, id)
+
+        with timer.measure('db.iter_all_text'):
+            for _ in db_label.iter_all_text():
+                pass
+
+        with timer.measure('db.import_all_text'):
+            db_label.import_all_text(
+                ((f'import_{i}.jpg', [(random_quad(rng, 1000, 1000), '') for _ in range(100)]) for i in range(repeat)),
+            )
+        db_label.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def send_mouse(app, widget, event_type, global_pos, button, buttons):
+    local_pos = QPointF(widget.mapFromGlobal(global_pos.toPoint()))
+    app.sendEvent(widget, QMouseEvent(event_type, local_pos, global_pos, button, buttons, Qt.NoModifier))
+
+
+def bench_window(timer, app, directory, img_name_list, drag_steps):
+    window = tool.MainWindow()
+    window.show()
+    app.processEvents()
+
+    window.directory = str(directory)
+    window.read_label_file()
+    window.all_img_file = list(img_name_list)
+
+    for name in ['show_img.cold', 'show_img.cached']:
+        for i in range(len(img_name_list)):
+            window.all_img_file_index = i
+            with timer.measure(name):
+                window.show_img()
+                wait_loaded(app, window)
+                app.processEvents()
+
+    window.all_img_file_index = 0
+    window.show_img()
+    wait_loaded(app, window)
+    label_img = window.label_img
+    for _ in range(20):
+        label_img.layer_background = None
+        with timer.measure('paintEvent.full'):
+            label_img.repaint()
+        with timer.measure('paintEvent.cached'):
+            label_img.repaint()
+
+    # 选中第一个框, 按住左上角的拖动按钮移动 drag_steps 步
+    all_text = window.label_repo.get_all_text(img_name_list[0])
+    if not all_text:
+        return
+    window.show_img(all_text[0][0])
+    app.processEvents()
+
+    btn = label_img.btn_point1
+    start_pos = QPointF(btn.mapToGlobal(btn.rect().center()))
+    send_mouse(app, btn, QEvent.MouseButtonPress, start_pos, Qt.LeftButton, Qt.LeftButton)
+    for step in range(drag_steps):
+        offset = step % 40 - 20
+        pos = start_pos + QPointF(offset, offset / 2)
+        with timer.measure('drag.mouseMoveEvent'):
+            send_mouse(app, btn, QEvent.MouseMove, pos, Qt.NoButton, Qt.LeftButton)
+            app.processEvents()
+    with timer.measure('drag.release'):
+        send_mouse(app, btn, QEvent.MouseButtonRelease, pos, Qt.LeftButton, Qt.NoButton)
+        app.processEvents()
+
+    window.close()
+
+
+def compare(summary, baseline_file, threshold):
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+
+    regression = False
+    print(f'{"name":<28} {"baseline ms":>12} {"current ms":>12} {"ratio":>7}')
+    for name, result in sorted(summary.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]['p50']
+        new = result['p50']
+        ratio = new / old if old > 0 else 1
+        mark = ' <-- regression' if ratio > threshold else ''
+        regression = regression or bool(mark)
+        print(f'{name:<28} {old * 1000:>12.3f} {new * 1000:>12.3f} {ratio:>6.2f}x{mark}')
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description='标注工具热点路径的基准测试, 在 offscreen 平台下运行')
+    parser.add_argument('--dataset', default=None, help='数据集目录, 不存在时自动生成; 默认用临时目录')
+    parser.add_argument('--images', type=int, default=20, help='生成的图片数')
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--boxes', type=int, default=200, help='每张图片的框数')
+    parser.add_argument('--nested', type=int, default=0, help='子目录层数')
+    parser.add_argument('--repeat', type=int, default=200, help='数据库操作重复次数')
+    parser.add_argument('--drag-steps', type=int, default=200)
+    parser.add_argument('--output', default='bench_result.json')
+    parser.add_argument('--compare', default=None, help='与之前保存的结果比较, p50 变慢超过阈值则返回 1')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    random.seed(0)
+
+    directory = args.dataset
+    temp_dir = None
+    if directory is None:
+        temp_dir = tempfile.mkdtemp(prefix='bench_dataset_')
+        directory = temp_dir
+    try:
+        if not Path(directory).joinpath('label.sqllite3').exists():
+            print(f'generating dataset in {directory}')
+            generate_dataset(directory, args.images, args.width, args.height, args.boxes, args.nested)
+
+        timer = Timer()
+        img_name_list = bench_scan(timer, directory)
+        bench_db(timer, directory, img_name_list, args.repeat)
+        bench_window(timer, app, directory, img_name_list, args.drag_steps)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    summary = timer.summary()
+    print(f'{"name":<28} {"count":>6} {"mean ms":>10} {"p50 ms":>10} {"p95 ms":>10} {"max ms":>10}')
+    for name, result in sorted(summary.items()):
+        print(f'{name:<28} {result["count"]:>6} {result["mean"] * 1000:>10.3f} {result["p50"] * 1000:>10.3f} '
+              f'{result["p95"] * 1000:>10.3f} {result["max"] * 1000:>10.3f}')
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': sys.version,
+                'platform': platform.platform(),
+                'args': vars(args),
+            },
+            'results': summary,
+        }, f, indent=2, ensure_ascii=False)
+
+    if args.compare and compare(summary, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
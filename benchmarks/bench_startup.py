@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 子进程从解释器启动开始计时, 这里先记下时间再导入其他模块
+CHILD_START = time.time()
+
+# 必须在导入 PySide2 之前设置, 不需要显示器
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+PHASE_LIST = [
+    ('interpreter', '解释器启动'),
+    ('import_qt', '导入 PySide2 并创建 QApplication'),
+    ('import_main', '导入 main'),
+    ('construct_window', '创建 MainWindow'),
+    ('first_paint', '显示窗口并完成第一次绘制'),
+    ('open_directory', '打开目录(导入 numpy 和数据库层)'),
+    ('first_image', '第一张图片显示出来'),
+    ('total', '合计'),
+]
+
+# 生成数据集时 generate_dataset 用 QPainter 画图, 要先有 QApplication, 创建后一直留到退出
+dataset_app = None
+
+
+def run_child(directory, spawn_time, timeout):
+    # 在新进程里走一遍启动路径, 每一段的耗时以 json 打印到最后一行
+    result = {'interpreter': CHILD_START - spawn_time}
+
+    start = time.perf_counter()
+    from PySide2.QtCore import QEventLoop
+    from PySide2.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    result['import_qt'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sys.path.insert(0, str(ROOT_DIR))
+    import main as tool
+    result['import_main'] = time.perf_counter() - start
+    result['numpy_imported_at_startup'] = 'numpy' in sys.modules
+
+    start = time.perf_counter()
+    window = tool.MainWindow()
+    result['construct_window'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    window.show()
+    window.repaint()
+    app.processEvents()
+    result['first_paint'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    window.open_directory(str(directory))
+    result['open_directory'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        app.processEvents(QEventLoop.AllEvents, 10)
+        if window.all_img_file and window.img_load_generation is None and window.label_img.pyramid is not None:
+            break
+    result['first_image'] = time.perf_counter() - start
+    result['total'] = time.time() - spawn_time
+
+    window.close()
+    print(json.dumps(result))
+
+
+def run_once(directory, home_dir, timeout):
+    # 用单独的用户目录, 不影响真实的 state.json 和缩略图缓存
+    env = dict(os.environ, HOME=str(home_dir), USERPROFILE=str(home_dir))
+    spawn_time = time.time()
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--child', str(directory), '--spawn-time', repr(spawn_time), '--timeout', str(timeout)],
+        stderr=subprocess.DEVNULL,
+        env=env
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    global dataset_app
+    parser = argparse.ArgumentParser(description='标注工具启动耗时的基准测试, 每次在新进程里从启动走到第一张图片显示')
+    parser.add_argument('--dataset', default=None, help='数据集目录, 不存在时自动生成; 默认用临时目录')
+    parser.add_argument('--images', type=int, default=200, help='生成的图片数')
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--boxes', type=int, default=50, help='每张图片的框数')
+    parser.add_argument('--repeat', type=int, default=5, help='启动次数, 取中位数')
+    parser.add_argument('--timeout', type=float, default=30, help='等待第一张图片的最长时间, 秒')
+    parser.add_argument('--output', default='bench_startup.json')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--spawn-time', type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child, args.spawn_time, args.timeout)
+        return
+
+    directory = args.dataset
+    temp_dir = None
+    home_dir = tempfile.mkdtemp(prefix='bench_home_')
+    if directory is None:
+        temp_dir = tempfile.mkdtemp(prefix='bench_startup_')
+        directory = temp_dir
+    try:
+        if not Path(directory).joinpath('label.sqllite3').exists():
+            print(f'generating dataset in {directory}')
+            from PySide2.QtWidgets import QApplication
+            dataset_app = QApplication.instance() or QApplication([sys.argv[0]])
+            sys.path.insert(0, str(Path(__file__).resolve().parent))
+            from bench_hot_paths import generate_dataset
+            generate_dataset(directory, args.images, args.width, args.height, args.boxes, 0)
+
+        # 第一次启动会生成扫描清单和缩略图缓存, 不计入结果
+        run_once(directory, home_dir, args.timeout)
+        run_list = [run_once(directory, home_dir, args.timeout) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(home_dir, ignore_errors=True)
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    summary = {}
+    print(f'{"phase":<20} {"p50 ms":>10} {"max ms":>10}  说明')
+    for name, title in PHASE_LIST:
+        value_list = sorted(run[name] for run in run_list)
+        summary[name] = {'p50': value_list[len(value_list) // 2], 'max': value_list[-1]}
+        print(f'{name:<20} {summary[name]["p50"] * 1000:>10.1f} {summary[name]["max"] * 1000:>10.1f}  {title}')
+    numpy_imported = any(run['numpy_imported_at_startup'] for run in run_list)
+    print(f'numpy imported before opening a directory: {numpy_imported}')
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': sys.version,
+                'args': vars(args),
+                'numpy_imported_at_startup': numpy_imported,
+            },
+            'results': summary,
+            'runs': run_list,
+        }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from urllib.parse import quote
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+ACTION_LIST = ['images', 'boxes', 'write', 'image']
+
+
+class Client:
+    # 模拟一个标注人员: 一个保持连接的 HTTP 连接, 随机翻页, 读框, 改框, 取图片, 每个请求之间随机停顿
+    def __init__(self, host, port, img_name_list, args, seed):
+        self.host = host
+        self.port = port
+        self.img_name_list = img_name_list
+        self.args = args
+        self.rng = random.Random(seed)
+        self.weight_list = [args.mix[name] for name in ACTION_LIST]
+        self.conn = http.client.HTTPConnection(host, port, timeout=args.timeout)
+        # img_name -> 最近一次读到的 [{'id':..., 'tsp':...}, ...], 修改时带上 tsp
+        self.box_dict = {}
+        self.latency = {name: [] for name in ACTION_LIST}
+        self.error_count = 0
+        self.conflict_count = 0
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, path, body, headers)
+        response = self.conn.getresponse()
+        return response.status, response.read()
+
+    def do_images(self):
+        offset = self.rng.randrange(max(1, len(self.img_name_list) - self.args.page_size))
+        status, _ = self.request('GET', f'/api/images?offset={offset}&limit={self.args.page_size}')
+        return status == 200
+
+    def do_boxes(self):
+        img_name = self.rng.choice(self.img_name_list)
+        status, data = self.request('GET', f'/api/boxes?img_name={quote(img_name)}')
+        if status != 200:
+            return False
+        self.box_dict[img_name] = [{'id': box['id'], 'tsp': box['tsp']} for box in json.loads(data.decode('utf-8'))['boxes']]
+        return True
+
+    def do_write(self):
+        # 改一张读过的图片上的几个框的文本, 没读过框的时候加一个框
+        if self.box_dict:
+            img_name = self.rng.choice(list(self.box_dict))
+        else:
+            img_name = self.rng.choice(self.img_name_list)
+        box_list = self.box_dict.get(img_name)
+        if box_list:
+            box_list = self.rng.sample(box_list, min(self.args.batch, len(box_list)))
+            ops = [
+                {'op': 'update', 'img_name': img_name, 'id': box['id'], 'text': f'load {self.rng.randrange(10 ** 6)}', 'tsp': box['tsp']}
+                for box in box_list
+            ]
+        else:
+            x = self.rng.randrange(1000)
+            y = self.rng.randrange(1000)
+            ops = [{'op': 'add', 'img_name': img_name, 'points': [[x, y], [x + 50, y], [x + 50, y + 20], [x, y + 20]], 'text': 'load'}]
+
+        status, data = self.request('POST', '/api/boxes', {'ops': ops})
+        if status != 200:
+            return False
+        for op, result in zip(ops, json.loads(data.decode('utf-8'))['results']):
+            if not result['ok']:
+                self.conflict_count += 1
+            elif op['op'] == 'update':
+                for box in box_list:
+                    if box['id'] == result['id']:
+                        box['tsp'] = result['tsp']
+        if ops[0]['op'] == 'add':
+            self.box_dict.pop(img_name, None)
+        return True
+
+    def do_image(self):
+        img_name = self.rng.choice(self.img_name_list)
+        status, _ = self.request('GET', f'/api/image?img_name={quote(img_name)}&side={self.args.side}')
+        return status == 200
+
+    def run(self, measure_start, deadline):
+        while time.time() < deadline:
+            action = self.rng.choices(ACTION_LIST, self.weight_list)[0]
+            start = time.perf_counter()
+            try:
+                ok = getattr(self, 'do_' + action)()
+            except (OSError, http.client.HTTPException):
+                # 下一个请求会自动重新连接
+                self.conn.close()
+                ok = False
+            elapsed = time.perf_counter() - start
+            if time.time() >= measure_start:
+                self.latency[action].append(elapsed)
+                if not ok:
+                    self.error_count += 1
+            if self.args.think_ms > 0:
+                time.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+        self.conn.close()
+
+
+def run_process(job):
+    # 一个进程里跑一批客户端线程, 客户端分到多个进程, 压测程序自己的 GIL 不会成为瓶颈
+    host, port, img_name_list, args, client_count, seed, measure_start, deadline = job
+    client_list = [Client(host, port, img_name_list, args, seed * 100000 + i) for i in range(client_count)]
+    thread_list = [threading.Thread(target=client.run, args=(measure_start, deadline)) for client in client_list]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+
+    latency = {name: [] for name in ACTION_LIST}
+    for client in client_list:
+        for name in ACTION_LIST:
+            latency[name].extend(client.latency[name])
+    return {
+        'latency': latency,
+        'error_count': sum(client.error_count for client in client_list),
+        'conflict_count': sum(client.conflict_count for client in client_list),
+    }
+
+
+def get_json(host, port, path, timeout=10):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(f'GET {path} {response.status} {data[:200]}')
+        return json.loads(data.decode('utf-8'))
+    finally:
+        conn.close()
+
+
+def wait_server(host, port, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return get_json(host, port, '/api/stats')
+        except (OSError, http.client.HTTPException):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def load_img_names(host, port, max_images):
+    img_name_list = []
+    while len(img_name_list) < max_images:
+        page = get_json(host, port, f'/api/images?offset={len(img_name_list)}&limit=1000')
+        if not page['images']:
+            break
+        img_name_list.extend(image['img_name'] for image in page['images'])
+    return img_name_list[:max_images]
+
+
+def percentile_stats(value_list, duration):
+    value_list = sorted(value_list)
+    if not value_list:
+        return {'count': 0}
+    pick = lambda p: value_list[min(int(len(value_list) * p), len(value_list) - 1)]
+    return {
+        'count': len(value_list),
+        'rps': len(value_list) / duration,
+        'p50': pick(0.5),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': value_list[-1],
+    }
+
+
+def parse_mix(text):
+    mix = {name: 0 for name in ACTION_LIST}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        if name not in mix:
+            raise argparse.ArgumentTypeError(f'unknown action {name}, choose from {ACTION_LIST}')
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='标注服务器的压测程序, 模拟很多标注人员同时读写, 统计各接口延迟的 p50/p99')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', default=None, help='先在本机启动 label_server.py 服务这个目录, 压测完关闭')
+    parser.add_argument('--project', default=None, help='和 --serve 一起使用, 工程库路径')
+    parser.add_argument('--clients', type=int, default=200, help='同时在线的客户端数')
+    parser.add_argument('--processes', type=int, default=min(8, os.cpu_count() or 1), help='客户端分到几个进程里跑')
+    parser.add_argument('--duration', type=float, default=30, help='统计的时长, 秒')
+    parser.add_argument('--warmup', type=float, default=5, help='开始统计前的预热时长, 秒')
+    parser.add_argument('--think-ms', type=float, default=100, help='每个客户端两次请求之间的平均停顿, 0 表示不停顿')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('images=5,boxes=70,write=20,image=5'), help='各操作的比例')
+    parser.add_argument('--batch', type=int, default=3, help='每次写入修改的框数')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--side', type=int, default=1024, help='取图片时请求的长边')
+    parser.add_argument('--max-images', type=int, default=100000, help='最多在多少张图片里随机挑')
+    parser.add_argument('--timeout', type=float, default=30, help='单个请求的超时, 秒')
+    parser.add_argument('--target-p99-ms', type=float, default=50)
+    parser.add_argument('--output', default='loadgen.json')
+    args = parser.parse_args()
+
+    server = None
+    if args.serve is not None:
+        command = [sys.executable, str(ROOT_DIR.joinpath('label_server.py')), args.serve, '--host', args.host, '--port', str(args.port), '--perf']
+        if args.project:
+            command.extend(['--project', args.project])
+        server = subprocess.Popen(command)
+    try:
+        wait_server(args.host, args.port, 120 if server else 5)
+        img_name_list = load_img_names(args.host, args.port, args.max_images)
+        if not img_name_list:
+            print('server has no images')
+            return
+        print(f'{len(img_name_list)} images, {args.clients} clients in {args.processes} processes, think {args.think_ms} ms')
+
+        process_count = max(1, min(args.processes, args.clients))
+        measure_start = time.time() + args.warmup
+        deadline = measure_start + args.duration
+        job_list = [
+            (args.host, args.port, img_name_list, args, args.clients // process_count + (1 if i < args.clients % process_count else 0),
+             i, measure_start, deadline)
+            for i in range(process_count)
+        ]
+        with Pool(process_count) as pool:
+            result_list = pool.map(run_process, job_list)
+        server_stats = get_json(args.host, args.port, '/api/stats')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = {}
+    all_latency = []
+    print(f'{"action":<10} {"count":>8} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for name in ACTION_LIST + ['all']:
+        if name == 'all':
+            value_list = all_latency
+        else:
+            value_list = [value for result in result_list for value in result['latency'][name]]
+            all_latency.extend(value_list)
+        summary[name] = stats = percentile_stats(value_list, args.duration)
+        if stats['count']:
+            print(
+                f'{name:<10} {stats["count"]:>8} {stats["rps"]:>8.0f} {stats["p50"] * 1000:>8.1f} '
+                f'{stats["p95"] * 1000:>8.1f} {stats["p99"] * 1000:>8.1f} {stats["max"] * 1000:>8.1f}'
+            )
+    error_count = sum(result['error_count'] for result in result_list)
+    conflict_count = sum(result['conflict_count'] for result in result_list)
+    passed = summary['all']['count'] > 0 and summary['all']['p99'] * 1000 <= args.target_p99_ms and error_count == 0
+    print(f'errors {error_count}, write conflicts {conflict_count}, writer {server_stats["writer"]}')
+    print(f'p99 target {args.target_p99_ms} ms: {"PASS" if passed else "FAIL"}')
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': sys.version,
+                'args': {key: value for key, value in vars(args).items()},
+            },
+            'results': summary,
+            'error_count': error_count,
+            'conflict_count': conflict_count,
+            'passed': passed,
+            'server': server_stats,
+        }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from PySide2.QtGui import QGuiApplication
+from PySide2.QtGui import QImage
+from PySide2.QtGui import QImageReader
+from PySide2.QtGui import QPainter
+from PySide2.QtGui import QTransform
+
+import geometry
+from label_db import open_label_db
+
+
+def rectify_crop(img, point_list):
+    width, height = geometry.quad_size(point_list)
+    width, height = int(round(width)), int(round(height))
+    if width < 1 or height < 1:
+        return None
+
+    dst = np.array([(0, 0), (width, 0), (width, height), (0, height)], np.float64)
+    try:
+        m = geometry.perspective_transform(point_list.astype(np.float64), dst)
+    except np.linalg.LinAlgError:
+        return None
+
+    # QTransform 是行向量约定, 需要转置
+    transform = QTransform(*m.T.flatten().tolist())
+    crop = QImage(width, height, QImage.Format_RGB888)
+    crop.fill(0)
+    painter = QPainter()
+    painter.begin(crop)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    painter.setTransform(transform)
+    painter.drawImage(0, 0, img)
+    painter.end()
+    return crop
+
+
+def crop_file_name(img_name, idx):
+    path = Path(img_name)
+    return str(path.parent.joinpath(f'{path.stem}_{idx}.jpg').as_posix())
+
+
+def init_worker():
+    # 每个进程需要一个 QGuiApplication 才能用 QPainter, offscreen 平台不会创建窗口
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    global worker_app
+    worker_app = QGuiApplication.instance() or QGuiApplication([sys.argv[0]])
+
+
+def process_image(args):
+    directory, crop_dir, img_name, box_list = args
+    img_path = str(Path(directory).joinpath(img_name))
+
+    if crop_dir is None:
+        size = QImageReader(img_path).size()
+        return size.width(), size.height(), []
+
+    # 每张图片在进程里只解码一次, 所有框都从这份解码结果里裁
+    img = QImageReader(img_path).read()
+    if img.isNull():
+        return -1, -1, [None] * len(box_list)
+
+    crop_list = []
+    for idx, point_list in box_list:
+        crop = rectify_crop(img, np.array(point_list))
+        if crop is None:
+            crop_list.append(None)
+            continue
+
+        crop_name = crop_file_name(img_name, idx)
+        crop_path = Path(crop_dir).joinpath(crop_name)
+        crop_path.parent.mkdir(parents=True, exist_ok=True)
+        crop.save(str(crop_path))
+        crop_list.append(crop_name)
+    return img.width(), img.height(), crop_list
+
+
+class JsonlWriter:
+    def __init__(self, output):
+        self.f = open(output, 'w', encoding='utf-8')
+
+    def write(self, img_name, all_text, size, crop_list):
+        item = {
+            'img_name': img_name,
+            'boxes': [
+                {'id': idx, 'points': point_list.tolist(), 'text': img_text}
+                for idx, point_list, img_text in all_text
+            ]
+        }
+        if size is not None:
+            item['width'], item['height'] = size
+        for box, crop_name in zip(item['boxes'], crop_list):
+            box['crop'] = crop_name
+        self.f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.f.close()
+
+
+def icdar_txt_path(output, img_name):
+    # ICDAR2015 格式, 一张图片一个 gt_<图片名>.txt
+    path = Path(img_name)
+    return Path(output).joinpath(path.parent, f'gt_{path.stem}.txt')
+
+
+def check_icdar_names(output, img_name_list):
+    # 同一目录下只有扩展名不同的图片会导出到同一个 txt, 在写任何文件之前检查
+    txt_dict = {}
+    collision_list = []
+    for img_name in img_name_list:
+        txt_path = icdar_txt_path(output, img_name)
+        if txt_path in txt_dict:
+            collision_list.append(f'{txt_dict[txt_path]} and {img_name} both export to {txt_path}')
+        else:
+            txt_dict[txt_path] = img_name
+    if collision_list:
+        raise ValueError(f'{len(collision_list)} name collisions, rename the images first: ' + '; '.join(collision_list[:10]))
+
+
+class IcdarWriter:
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, img_name, all_text, size, crop_list):
+        # 空文本记为 ### (不参与识别)
+        txt_path = icdar_txt_path(self.output, img_name)
+        txt_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(txt_path), 'w', encoding='utf-8') as f:
+            for idx, point_list, img_text in all_text:
+                f.write(','.join(str(x) for x in point_list.flatten().tolist()) + ',' + (img_text or '###') + '\n')
+
+    def close(self):
+        pass
+
+
+class CocoWriter:
+    def __init__(self, output):
+        # images 和 annotations 两个数组分开流式写, 最后再拼成一个文件, 内存占用和数据量无关
+        self.output = output
+        self.f = open(output, 'w', encoding='utf-8')
+        self.f.write('{"categories":[{"id":1,"name":"text"}],"images":[')
+        self.f_annotation = open(output + '.annotations.tmp', 'w+', encoding='utf-8')
+        self.img_id = 0
+        self.annotation_count = 0
+
+    def write(self, img_name, all_text, size, crop_list):
+        self.img_id += 1
+        width, height = size
+        if self.img_id > 1:
+            self.f.write(',')
+        self.f.write(json.dumps(
+            {'id': self.img_id, 'file_name': img_name, 'width': width, 'height': height},
+            ensure_ascii=False
+        ))
+
+        if not all_text:
+            return
+
+        point_array = np.array([point_list for _, point_list, _ in all_text])
+        rect_list = geometry.bounding_rect(point_array).tolist()
+        area_list = geometry.quad_area(point_array).tolist()
+        for (idx, point_list, img_text), crop_name, (x0, y0, x1, y1), area in zip(
+                all_text, crop_list, rect_list, area_list):
+            annotation = {
+                'id': idx,
+                'image_id': self.img_id,
+                'category_id': 1,
+                'segmentation': [point_list.flatten().tolist()],
+                'bbox': [x0, y0, x1 - x0, y1 - y0],
+                'area': area,
+                'iscrowd': 0,
+                'text': img_text,
+            }
+            if crop_name is not None:
+                annotation['crop'] = crop_name
+            if self.annotation_count > 0:
+                self.f_annotation.write(',')
+            self.f_annotation.write(json.dumps(annotation, ensure_ascii=False))
+            self.annotation_count += 1
+
+    def close(self):
+        self.f.write('],"annotations":[')
+        self.f_annotation.seek(0)
+        while True:
+            data = self.f_annotation.read(1024 * 1024)
+            if not data:
+                break
+            self.f.write(data)
+        self.f.write(']}')
+        self.f.close()
+        self.f_annotation.close()
+        os.remove(self.output + '.annotations.tmp')
+
+
+WRITER_DICT = {
+    'jsonl': JsonlWriter,
+    'icdar': IcdarWriter,
+    'coco': CocoWriter,
+}
+
+
+def batched(iterable, batch_size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def export(directory, output, output_format, crop_dir=None, workers=None, batch_size=64, project_file=None):
+    db_label = open_label_db(directory, project_file)
+    if output_format == 'icdar':
+        try:
+            check_icdar_names(output, [
+                img_name for img_name, (box_count, _) in db_label.get_all_progress().items() if box_count > 0
+            ])
+        except:
+            db_label.close()
+            raise
+    writer = WRITER_DICT[output_format](output)
+    crop_label_file = None
+    if crop_dir is not None:
+        Path(crop_dir).mkdir(parents=True, exist_ok=True)
+        crop_label_file = open(str(Path(crop_dir).joinpath('labels.txt')), 'w', encoding='utf-8')
+
+    # 需要读图片(裁剪或者 coco 需要宽高)时才启动进程池
+    pool = None
+    if crop_dir is not None or output_format == 'coco':
+        pool = Pool(workers, initializer=init_worker)
+
+    start = time.perf_counter()
+    img_count = 0
+    box_count = 0
+    skip_count = 0
+    try:
+        for batch in batched(db_label.iter_all_text(), batch_size):
+            if pool is not None:
+                result_list = pool.map(process_image, [
+                    (directory, crop_dir, img_name, [(idx, point_list.tolist()) for idx, point_list, _ in all_text])
+                    for img_name, all_text in batch
+                ], chunksize=1)
+            else:
+                result_list = [(None, None, [None] * len(all_text)) for _, all_text in batch]
+
+            for (img_name, all_text), (width, height, crop_list) in zip(batch, result_list):
+                if width is not None and (width <= 0 or height <= 0):
+                    # 图片不存在或者读不出来, 没有宽高也裁不出图, 整张跳过
+                    logging.warning(f'{img_name} unreadable, skipped')
+                    skip_count += 1
+                    continue
+                size = (width, height) if width is not None else None
+                writer.write(img_name, all_text, size, crop_list)
+                if crop_label_file is not None:
+                    for (_, _, img_text), crop_name in zip(all_text, crop_list):
+                        if crop_name is not None:
+                            crop_label_file.write(f'{crop_name}\t{img_text}\n')
+                img_count += 1
+                box_count += len(all_text)
+            logging.info(f'exported {img_count} images, {box_count} boxes')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+        if crop_label_file is not None:
+            crop_label_file.close()
+        db_label.close()
+
+    logging.info(
+        f'export {img_count} images, {box_count} boxes in {time.perf_counter() - start:.1f} s, '
+        f'{skip_count} unreadable images skipped'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出标注数据')
+    parser.add_argument('directory', help='被标注的目录, 下面有 label.sqllite3')
+    parser.add_argument('output', help='jsonl/coco 为输出文件, icdar 为输出目录')
+    parser.add_argument('--format', dest='output_format', choices=sorted(WRITER_DICT), default='jsonl')
+    parser.add_argument('--crops', dest='crop_dir', default=None, help='把每个框透视矫正后裁剪保存到这个目录')
+    parser.add_argument('--workers', type=int, default=None, help='进程数, 默认等于 CPU 核数')
+    parser.add_argument('--batch-size', type=int, default=64, help='每批处理的图片数')
+    parser.add_argument('--project', default=None, help='工程库路径, 导出工程库里这个目录的标注')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    export(args.directory, args.output, args.output_format, args.crop_dir, args.workers, args.batch_size, args.project)
+
+
+if __name__ == '__main__':
+    main()
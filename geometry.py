@@ -0,0 +1,121 @@
+import numpy as np
+
+
+def order_points(point_list):
+    # 四边形四个点排成 左上, 右上, 右下, 左下; 支持单个 (4,2) 或者批量 (N,4,2)
+    point_list = np.asarray(point_list)
+    if point_list.ndim == 2:
+        # 单个四边形(拖动时每次移动鼠标都要排)直接用 Python 排序, 比数组运算的固定开销小得多
+        sorted_list = sorted(point_list.tolist(), key=lambda p: p[0])
+        left = sorted_list[:2] if sorted_list[0][1] <= sorted_list[1][1] else sorted_list[1::-1]
+        right = sorted_list[2:] if sorted_list[2][1] <= sorted_list[3][1] else sorted_list[:1:-1]
+        return np.array([left[0], right[0], right[1], left[1]], dtype=np.int)
+
+    point_list = point_list.reshape((-1, 4, 2))
+    n = len(point_list)
+    rows = np.arange(n)[:, None]
+
+    # 先按 x 稳定排序, 左边两个点和右边两个点再各自按 y 排序, 与原来三次 sorted 的结果一致
+    point_list = point_list[rows, np.argsort(point_list[:, :, 0], axis=1, kind='mergesort')]
+    left = point_list[:, :2]
+    right = point_list[:, 2:]
+    left_swap = (left[:, 0, 1] > left[:, 1, 1]).astype(np.intp)
+    right_swap = (right[:, 0, 1] > right[:, 1, 1]).astype(np.intp)
+
+    result = np.empty((n, 4, 2), dtype=np.int)
+    rows = np.arange(n)
+    result[:, 0] = left[rows, left_swap]
+    result[:, 1] = right[rows, right_swap]
+    result[:, 2] = right[rows, 1 - right_swap]
+    result[:, 3] = left[rows, 1 - left_swap]
+    return result
+
+
+def to_view(point_list, scale, offset):
+    # 原图坐标 -> 显示坐标: view = img * scale + offset
+    return np.asarray(point_list, dtype=np.float64) * scale + np.asarray(offset, dtype=np.float64)
+
+
+def to_image(point_list, scale, offset, size=None):
+    # 显示坐标 -> 原图坐标, 四舍五入到整数像素, 给了图片大小 (width, height) 时限制在图片范围内
+    point_list = np.rint((np.asarray(point_list, dtype=np.float64) - np.asarray(offset, dtype=np.float64)) / scale)
+    point_list = point_list.astype(np.int)
+    if size is not None:
+        point_list = clamp(point_list, (0, 0), (size[0] - 1, size[1] - 1))
+    return point_list
+
+
+def clamp(point_list, low, high):
+    return np.clip(point_list, np.asarray(low), np.asarray(high))
+
+
+def bounding_rect(point_list):
+    # 返回 (..., 4): x0, y0, x1, y1
+    point_list = np.asarray(point_list)
+    return np.concatenate([point_list.min(axis=-2), point_list.max(axis=-2)], axis=-1)
+
+
+def quad_area(point_list):
+    # 鞋带公式, 批量计算
+    point_list = np.asarray(point_list, dtype=np.float64)
+    xs = point_list[..., 0]
+    ys = point_list[..., 1]
+    return np.abs(np.sum(xs * np.roll(ys, -1, axis=-1) - np.roll(xs, -1, axis=-1) * ys, axis=-1)) / 2
+
+
+def point_in_quad(x, y, point_list):
+    # 射线法, 对凹四边形和自相交四边形同样成立; 批量 (N,4,2) 时返回 (N,) 的 bool 数组
+    point_list = np.asarray(point_list, dtype=np.float64)
+    x1 = point_list[..., 0]
+    y1 = point_list[..., 1]
+    x2 = np.roll(x1, 1, axis=-1)
+    y2 = np.roll(y1, 1, axis=-1)
+    cross = (y1 > y) != (y2 > y)
+    # 水平边不会和射线相交, 除零的结果被 cross 过滤掉
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = (x2 - x1) * (y - y1) / (y2 - y1) + x1
+    return np.count_nonzero(cross & (x < cross_x), axis=-1) % 2 == 1
+
+
+def quad_size(point_list):
+    # 透视矫正后的宽高, 取对边中较长的一条
+    point_list = np.asarray(point_list, dtype=np.float64)
+    edge = np.linalg.norm(np.roll(point_list, -1, axis=-2) - point_list, axis=-1)
+    width = np.maximum(edge[..., 0], edge[..., 2])
+    height = np.maximum(edge[..., 1], edge[..., 3])
+    return width, height
+
+
+def perspective_transform(src, dst):
+    # 求把 src 四个点映射到 dst 四个点的 3x3 透视矩阵
+    a = np.zeros((8, 8), np.float64)
+    b = np.zeros(8, np.float64)
+    for i, ((x, y), (u, v)) in enumerate(zip(src, dst)):
+        a[i * 2] = [x, y, 1, 0, 0, 0, -u * x, -u * y]
+        a[i * 2 + 1] = [0, 0, 0, x, y, 1, -v * x, -v * y]
+        b[i * 2] = u
+        b[i * 2 + 1] = v
+    return np.append(np.linalg.solve(a, b), 1).reshape((3, 3))
+
+
+def estimate_translation(prev, cur):
+    # 相位相关估计 cur 相对 prev 的整体平移, prev/cur 为同样大小的灰度图
+    # 返回 (dx, dy, score), score 是峰值和相关图标准差的比值, 不相关的两张图一般在 7 以下
+    prev = np.asarray(prev, dtype=np.float64)
+    cur = np.asarray(cur, dtype=np.float64)
+    height, width = prev.shape
+    # 加窗去掉图片边缘的突变, 否则峰值总是落在 (0, 0)
+    window = np.outer(np.hanning(height), np.hanning(width))
+    prev_fft = np.fft.rfft2((prev - prev.mean()) * window)
+    cur_fft = np.fft.rfft2((cur - cur.mean()) * window)
+    cross = cur_fft * np.conj(prev_fft)
+    cross /= np.abs(cross) + 1e-9
+    corr = np.fft.irfft2(cross, s=(height, width))
+
+    dy, dx = np.unravel_index(int(np.argmax(corr)), corr.shape)
+    score = float(corr[dy, dx] / (corr.std() + 1e-12))
+    if dy > height // 2:
+        dy -= height
+    if dx > width // 2:
+        dx -= width
+    return int(dx), int(dy), score
@@ -0,0 +1,123 @@
+import logging
+import sys
+
+import numpy as np
+from PySide2.QtCore import QCoreApplication
+from PySide2.QtCore import QSize
+from PySide2.QtGui import QImage
+from PySide2.QtGui import QImageReader
+
+
+PHASH_SIZE = 32
+PHASH_LOW_SIZE = 8
+PHASH_MAX_DISTANCE = 4
+
+
+def dct_matrix(n):
+    # DCT-II 正交矩阵, dct(x) = m @ x
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+DCT_MATRIX = dct_matrix(PHASH_SIZE)
+
+
+def phash_from_gray(gray):
+    # 32x32 灰度图做二维 DCT, 取左上角 8x8 低频系数和中值比较得到 64 位哈希(去掉直流分量算中值)
+    coeff = DCT_MATRIX @ np.asarray(gray, dtype=np.float64) @ DCT_MATRIX.T
+    low = coeff[:PHASH_LOW_SIZE, :PHASH_LOW_SIZE].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def compute_phash(img_path):
+    # 解码时直接缩小到 32x32, 不管宽高比; 读不出来返回 None
+    reader = QImageReader(str(img_path))
+    reader.setScaledSize(QSize(PHASH_SIZE, PHASH_SIZE))
+    img = reader.read()
+    if img.isNull():
+        return None
+    if img.width() != PHASH_SIZE or img.height() != PHASH_SIZE:
+        img = img.scaled(PHASH_SIZE, PHASH_SIZE)
+
+    img = img.convertToFormat(QImage.Format_Grayscale8)
+    stride = img.bytesPerLine()
+    gray = np.frombuffer(img.constBits(), dtype=np.uint8, count=stride * PHASH_SIZE).reshape((PHASH_SIZE, stride))
+    return phash_from_gray(gray[:, :PHASH_SIZE])
+
+
+def init_worker():
+    # QImageReader 需要 QCoreApplication 才能找到图片格式插件
+    global worker_app
+    worker_app = QCoreApplication.instance() or QCoreApplication([sys.argv[0]])
+
+
+def phash_worker(img_path):
+    try:
+        return compute_phash(img_path)
+    except:
+        logging.exception(f'phash {img_path} exception')
+        return None
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MultiIndexHash:
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, bits=64):
+        # 64 位哈希切成 max_distance + 1 段, 距离不超过 max_distance 的两个哈希至少有一段完全相同
+        # 每段一个 段值 -> [key, ...] 的字典, 查询只比较至少有一段相同的候选, 不需要遍历全部
+        self.max_distance = max_distance
+        block_count = max_distance + 1
+        self.block_list = []
+        start = 0
+        for i in range(block_count):
+            width = bits // block_count + (1 if i < bits % block_count else 0)
+            self.block_list.append((start, (1 << width) - 1))
+            start += width
+        self.table_list = [{} for _ in self.block_list]
+        self.hash_dict = {}
+
+    def __len__(self):
+        return len(self.hash_dict)
+
+    def add(self, key, phash):
+        self.hash_dict[key] = phash
+        for (shift, mask), table in zip(self.block_list, self.table_list):
+            table.setdefault((phash >> shift) & mask, []).append(key)
+
+    def query(self, phash):
+        # 返回 [(distance, key), ...], 按距离和 key 升序
+        result = []
+        seen = set()
+        for (shift, mask), table in zip(self.block_list, self.table_list):
+            for key in table.get((phash >> shift) & mask, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = hamming(phash, self.hash_dict[key])
+                if distance <= self.max_distance:
+                    result.append((distance, key))
+        result.sort()
+        return result
+
+
+def find_duplicates(phash_list, max_distance=PHASH_MAX_DISTANCE):
+    # 按顺序处理, 和前面某张代表图片足够接近的记为它的重复, 否则自己成为新的代表图片
+    # 只和代表图片比较, 不会出现 A 像 B, B 像 C 就把差别很大的 A 和 C 连到一起
+    # 返回 {序号: 代表图片序号}, phash 为 None 的图片不参与
+    index = MultiIndexHash(max_distance)
+    duplicate_of = {}
+    for pos, phash in enumerate(phash_list):
+        if phash is None:
+            continue
+        match_list = index.query(phash)
+        if match_list:
+            duplicate_of[pos] = match_list[0][1]
+        else:
+            index.add(pos, phash)
+    return duplicate_of
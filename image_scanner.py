@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import time
+
+from PySide2.QtCore import QThread
+from PySide2.QtCore import Signal
+
+
+IMAGE_SUFFIX_LIST = ['.JPG', '.JPEG', '.BMP', '.PNG']
+IMAGE_MANIFEST_FILE = 'label.manifest.json'
+IMAGE_MANIFEST_VERSION = 3
+IMAGE_SCAN_BATCH_TIME = 0.2
+
+
+class ImageScanner(QThread):
+    # 新找到的 [img_name, ...] 和对应的 [(size, mtime_ns), ...]
+    found = Signal(list, list)
+
+    def __init__(self, directory, parent=None):
+        super(ImageScanner, self).__init__(parent)
+        self.directory = str(directory)
+        self.manifest_file = os.path.join(self.directory, IMAGE_MANIFEST_FILE)
+        self.stop_flag = False
+        # img_name -> (size, mtime_ns), 扫描时顺便记下, 需要大小和修改时间的地方不用再 stat
+        self.file_stat = {}
+        self.stat_dir_count = 0
+        self.stat_scandir_count = 0
+        self.stat_changed_count = 0
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            # 版本不同的清单格式不一样, 直接丢掉重新扫描一次
+            if manifest.get('version') != IMAGE_MANIFEST_VERSION:
+                return {}
+            return manifest['dirs']
+        except FileNotFoundError:
+            return {}
+        except:
+            logging.exception('load_manifest exception')
+            return {}
+
+    def save_manifest(self, manifest):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': IMAGE_MANIFEST_VERSION, 'dirs': manifest}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.manifest_file)
+
+    def scan_dir(self, rel_dir):
+        # 清单里每个文件记 [文件名, 大小, 修改时间]
+        files = []
+        dirs = []
+        with os.scandir(os.path.join(self.directory, rel_dir)) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith('.'):
+                            dirs.append(entry.name)
+                    elif os.path.splitext(entry.name)[1].upper() in IMAGE_SUFFIX_LIST and entry.is_file():
+                        st = entry.stat()
+                        files.append([entry.name, st.st_size, st.st_mtime_ns])
+                except OSError:
+                    logging.exception('scan_dir exception')
+        return sorted(files), sorted(dirs)
+
+    def refresh_files(self, rel_dir, files):
+        # 原地修改文件不会改变目录的修改时间, 目录没变时也逐个 stat, 只替换大小或修改时间变了的项
+        dir_path = os.path.join(self.directory, rel_dir)
+        new_files = []
+        for item in files:
+            try:
+                st = os.stat(os.path.join(dir_path, item[0]))
+            except OSError:
+                continue
+            if st.st_size != item[1] or st.st_mtime_ns != item[2]:
+                self.stat_changed_count += 1
+                item = [item[0], st.st_size, st.st_mtime_ns]
+            new_files.append(item)
+        return new_files
+
+    def scan(self, old_manifest, new_manifest, rel_dir=''):
+        # 深度优先, 同一目录下先列文件再进子目录, 平铺目录的顺序和原来的 sorted 一致
+        try:
+            dir_mtime = os.stat(os.path.join(self.directory, rel_dir)).st_mtime_ns
+        except OSError:
+            return
+
+        self.stat_dir_count += 1
+        entry = old_manifest.get(rel_dir)
+        if entry is None or entry['mtime'] != dir_mtime:
+            # 目录的修改时间只在增删改名时变化, 没变的目录直接用清单里的内容
+            self.stat_scandir_count += 1
+            try:
+                files, dirs = self.scan_dir(rel_dir)
+            except OSError:
+                logging.exception('scan exception')
+                return
+            entry = {'mtime': dir_mtime, 'files': files, 'dirs': dirs}
+        else:
+            entry = {'mtime': dir_mtime, 'files': self.refresh_files(rel_dir, entry['files']), 'dirs': entry['dirs']}
+        new_manifest[rel_dir] = entry
+
+        prefix = rel_dir + '/' if rel_dir else ''
+        for name, size, mtime in entry['files']:
+            img_name = prefix + name
+            self.file_stat[img_name] = (size, mtime)
+            yield img_name
+
+        for name in entry['dirs']:
+            if self.stop_flag:
+                return
+            yield from self.scan(old_manifest, new_manifest, prefix + name)
+
+    def run(self):
+        start = time.perf_counter()
+        new_manifest = {}
+        batch = []
+        batch_time = time.perf_counter()
+        count = 0
+        for img_name in self.scan(self.load_manifest(), new_manifest):
+            if self.stop_flag:
+                return
+
+            batch.append(img_name)
+            # 第一张马上送出去显示, 之后按时间分批
+            if count == 0 or time.perf_counter() - batch_time > IMAGE_SCAN_BATCH_TIME:
+                count += len(batch)
+                self.found.emit(batch, [self.file_stat[img_name] for img_name in batch])
+                batch = []
+                batch_time = time.perf_counter()
+
+        if batch:
+            count += len(batch)
+            self.found.emit(batch, [self.file_stat[img_name] for img_name in batch])
+
+        try:
+            self.save_manifest(new_manifest)
+        except:
+            logging.exception('save_manifest exception')
+
+        logging.info(
+            f'scan {count} images in {time.perf_counter() - start:.2f} s, '
+            f'{self.stat_scandir_count}/{self.stat_dir_count} directories re-listed, '
+            f'{self.stat_changed_count} files changed in place'
+        )
+
+    def stop(self):
+        self.stop_flag = True
+        self.wait()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import logging
+import math
+from collections import OrderedDict
+from pathlib import Path
+
+from image_scanner import ImageScanner
+from label_db import open_label_db
+
+POINT_VALUE_LIMIT = 2 ** 31
+
+
+def parse_points(points):
+    # 四个点 [[x1,y1],...,[x4,y4]] 或者展开的 [x1,y1,...,x4,y4], 返回 8 个 int; 个数或者类型不对时返回 None
+    if not isinstance(points, list):
+        return None
+    if len(points) == 4 and all(isinstance(point, list) and len(point) == 2 for point in points):
+        points = [value for point in points for value in point]
+    if len(points) != 8:
+        return None
+    for value in points:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if not math.isfinite(value) or abs(value) >= POINT_VALUE_LIMIT:
+            return None
+    return [int(value) for value in points]
+
+
+def read_jsonl(input_file):
+    # 每行一张图片 {"img_name":..., "boxes":[{"points":..., "text":...}]} (和 export_label.py 导出的格式一样),
+    # 或者每行一个框 {"img_name":..., "points":..., "text":...}
+    # 同一张图片的框不连续时合并到一起, 所以整个文件读完才开始导入
+    img_box_dict = OrderedDict()
+    with open(input_file, 'r', encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                item = json.loads(line)
+                img_name = item['img_name']
+                boxes = item['boxes'] if 'boxes' in item else [item]
+                boxes = [(box['points'], box.get('text') or '') for box in boxes]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logging.warning(f'{input_file}:{line_number} invalid line')
+                continue
+            if not isinstance(img_name, str):
+                logging.warning(f'{input_file}:{line_number} invalid img_name')
+                continue
+
+            box_list = []
+            for points, img_text in boxes:
+                point_list = parse_points(points)
+                if point_list is None:
+                    logging.warning(f'{input_file}:{line_number} invalid points {points}')
+                    continue
+                box_list.append((point_list, str(img_text)))
+            # 一行里的框全都不合法时不算这张图片, 免得 replace 把它原有的框删掉
+            if boxes and not box_list:
+                continue
+            img_box_dict.setdefault(img_name, []).extend(box_list)
+
+    yield from img_box_dict.items()
+
+
+def read_icdar(input_dir, img_dir):
+    # ICDAR2015 格式, 每张图片一个 gt_<图片名>.txt 或 <图片名>.txt, 每行 x1,y1,x2,y2,x3,y3,x4,y4,文本
+    scanner = ImageScanner(img_dir)
+    img_name_dict = {}
+    for img_name in scanner.scan({}, {}):
+        path = Path(img_name)
+        img_name_dict[path.parent.joinpath(path.stem).as_posix()] = img_name
+
+    for txt_path in sorted(Path(input_dir).glob('**/*.txt')):
+        rel_path = txt_path.relative_to(input_dir)
+        stem = rel_path.stem[3:] if rel_path.stem.startswith('gt_') else rel_path.stem
+        img_name = img_name_dict.get(rel_path.parent.joinpath(stem).as_posix())
+        if img_name is None:
+            logging.warning(f'{txt_path} no matching image')
+            continue
+
+        box_list = []
+        with open(str(txt_path), 'r', encoding='utf-8-sig') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.rstrip('\r\n')
+                if not line:
+                    continue
+
+                fields = line.split(',', 8)
+                try:
+                    point_list = parse_points([float(x) for x in fields[:8]])
+                except ValueError:
+                    point_list = None
+                if point_list is None:
+                    logging.warning(f'{txt_path}:{line_number} invalid points')
+                    continue
+
+                img_text = fields[8] if len(fields) > 8 else ''
+                box_list.append((point_list, '' if img_text == '###' else img_text))
+        yield img_name, box_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入预标注数据(比如文字检测模型的输出)')
+    parser.add_argument('directory', help='被标注的目录, 下面有 label.sqllite3')
+    parser.add_argument('input', help='jsonl 文件或者 ICDAR txt 所在目录')
+    parser.add_argument('--format', dest='input_format', choices=['jsonl', 'icdar'], default='jsonl')
+    parser.add_argument('--replace', action='store_true', help='删除图片已有的框后重新导入, 默认跳过已导入过的图片')
+    parser.add_argument('--batch-size', type=int, default=50000, help='每个事务写入的框数')
+    parser.add_argument('--keep-index', action='store_true', help='大批量导入时不删除重建 img_name 索引')
+    parser.add_argument('--project', default=None, help='工程库路径, 导入到工程库而不是目录下的 label.sqllite3')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.input_format == 'jsonl':
+        img_text_iter = read_jsonl(args.input)
+    else:
+        img_text_iter = read_icdar(args.input, args.directory)
+
+    db_label = open_label_db(args.directory, args.project)
+    try:
+        stat = db_label.import_all_text(
+            img_text_iter,
+            replace=args.replace,
+            batch_size=args.batch_size,
+            drop_index=not args.keep_index
+        )
+    finally:
+        db_label.close()
+
+    logging.info(
+        f'import {stat["img_count"]} images, {stat["box_count"]} boxes in {stat["time"]:.1f} s, '
+        f'{stat["skip_count"]} images already imported'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1051 @@
+import functools
+import getpass
+import logging
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+from geometry import order_points
+from perf_monitor import perf
+
+
+IMPORT_BATCH_SIZE = 50000
+DB_BUSY_TIMEOUT = 2.0
+DB_RETRY_COUNT = 5
+DB_RETRY_DELAY = 0.05
+DB_LEASE_SECONDS = 120
+SEARCH_CHUNK_SIZE = 500
+SEARCH_TOKENIZER_LIST = ['trigram', 'unicode61']
+
+
+def retry_locked(func):
+    # 多人共用一个库时, 忙等超时后还拿不到锁就退避重试几次
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        delay = DB_RETRY_DELAY
+        for retry in range(DB_RETRY_COUNT):
+            try:
+                return func(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not self.concurrent or retry == DB_RETRY_COUNT - 1 or ('locked' not in str(e) and 'busy' not in str(e)):
+                    raise
+                logging.warning(f'{func.__name__} retry {retry + 1}: {e}')
+                # 这次的事务已经回滚, 重试前丢掉回滚前缓存下来的数据
+                self.discard_uncommitted()
+                time.sleep(delay)
+                delay *= 2
+    return wrapper
+
+
+def lease_owner():
+    return f'{getpass.getuser()}@{socket.gethostname()}({os.getpid()})'
+
+
+class DBLabelText:
+    # 每个目录一个库, 框直接用 img_name 关联图片
+    LABEL_TABLE = 'label_text'
+    IMAGE_COLUMN = 'img_name'
+    IMAGE_COLUMN_TYPE = 'TEXT'
+    IMAGE_INDEX = 'idx_label_text_img_name'
+    IMAGE_INDEX_COLUMNS = '`img_name` ASC'
+
+    def __init__(self, lable_data_path, concurrent=False, check_same_thread=True):
+        # check_same_thread=False 时连接可以在线程间传递(服务器模式的连接池), 同一时刻只能有一个线程使用
+        self.conn = sqlite3.connect(lable_data_path, timeout=DB_BUSY_TIMEOUT, check_same_thread=check_same_thread)
+        self.cursor = self.conn.cursor()
+        # 多人模式: WAL 让读写互不阻塞, 写入时用 tsp 做乐观并发检查, 通过 image_lease 表提示别人正在标注的图片
+        self.concurrent = concurrent
+        if concurrent:
+            journal_mode = self.cursor.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if journal_mode.lower() != 'wal':
+                logging.warning(f'{lable_data_path} journal_mode is {journal_mode}, WAL not supported')
+            self.cursor.execute('PRAGMA synchronous=NORMAL')
+        self.create_table()
+        self.create_progress_table()
+        self.create_search_table()
+        self.create_phash_table()
+        if concurrent:
+            self.create_lease_table()
+        self.owner = lease_owner()
+        # id -> 读出来时的 tsp, 写入时 tsp 不一致说明别人改过
+        self.row_tsp = {}
+        self.conflict_list = []
+        self.data_version = None
+        self.lease_held = False
+
+        # 延迟写入: (img_name, id) -> {'points': ..., 'text': ...}, 同一行的多次修改在内存中合并
+        self.pending_write = {}
+        self.stat_write_count = 0
+        self.stat_merge_count = 0
+        self.stat_flush_count = 0
+        self.stat_flush_time = 0.0
+        self.stat_last_flush_time = 0.0
+
+    def create_table(self):
+        self.cursor.execute(r'''
+        CREATE TABLE IF NOT EXISTS label_text (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            img_name TEXT NOT NULL, --图片文件名
+            x1 INTEGER NOT NULL, --左上角x坐标
+            y1 INTEGER NOT NULL, --左上角y坐标
+            x2 INTEGER NOT NULL, --右上角x坐标
+            y2 INTEGER NOT NULL, --右上角y坐标
+            x3 INTEGER NOT NULL, --右下角x坐标
+            y3 INTEGER NOT NULL, --右下角y坐标
+            x4 INTEGER NOT NULL, --左下角x坐标
+            y4 INTEGER NOT NULL, --左下角y坐标
+            img_text TEXT NOT NULL, -- 文本内容
+            tsp INTEGER NOT NULL --最后一次修改的时间戳
+        );
+    ''')
+        self.create_index()
+
+    def create_index(self):
+        self.cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS `{self.IMAGE_INDEX}` ON `{self.LABEL_TABLE}` ({self.IMAGE_INDEX_COLUMNS});
+        ''')
+
+    def create_progress_table(self):
+        # 每张图片的框数, 空文本框数和最后修改时间, 由触发器随 label 表一起更新
+        exists = self.cursor.execute(r'''
+        SELECT 1 FROM sqlite_master WHERE type='table' AND name='label_progress'
+        ''').fetchone()
+        self.cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS label_progress (
+            {self.IMAGE_COLUMN} {self.IMAGE_COLUMN_TYPE} NOT NULL PRIMARY KEY, --图片
+            box_count INTEGER NOT NULL, --框数
+            empty_count INTEGER NOT NULL, --文本为空的框数
+            last_tsp INTEGER NOT NULL --最后一次修改的时间戳
+        );
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS `{self.LABEL_TABLE}_progress_insert` AFTER INSERT ON `{self.LABEL_TABLE}`
+        BEGIN
+            INSERT OR IGNORE INTO label_progress ({self.IMAGE_COLUMN},box_count,empty_count,last_tsp)
+            VALUES (NEW.{self.IMAGE_COLUMN},0,0,0);
+            UPDATE label_progress SET
+                box_count = box_count + 1,
+                empty_count = empty_count + (TRIM(NEW.img_text) = ''),
+                last_tsp = MAX(last_tsp, NEW.tsp)
+            WHERE {self.IMAGE_COLUMN} = NEW.{self.IMAGE_COLUMN};
+        END;
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS `{self.LABEL_TABLE}_progress_delete` AFTER DELETE ON `{self.LABEL_TABLE}`
+        BEGIN
+            UPDATE label_progress SET
+                box_count = box_count - 1,
+                empty_count = empty_count - (TRIM(OLD.img_text) = ''),
+                last_tsp = MAX(last_tsp, CAST(strftime('%s', 'now') AS INTEGER))
+            WHERE {self.IMAGE_COLUMN} = OLD.{self.IMAGE_COLUMN};
+        END;
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS `{self.LABEL_TABLE}_progress_update` AFTER UPDATE OF img_text, tsp ON `{self.LABEL_TABLE}`
+        BEGIN
+            UPDATE label_progress SET
+                empty_count = empty_count - (TRIM(OLD.img_text) = '') + (TRIM(NEW.img_text) = ''),
+                last_tsp = MAX(last_tsp, NEW.tsp)
+            WHERE {self.IMAGE_COLUMN} = NEW.{self.IMAGE_COLUMN};
+        END;
+        ''')
+        if not exists:
+            # 老库第一次打开时从已有的框统计一遍
+            with self.conn:
+                self.cursor.execute(f'''
+                INSERT OR IGNORE INTO label_progress ({self.IMAGE_COLUMN},box_count,empty_count,last_tsp)
+                SELECT {self.IMAGE_COLUMN}, COUNT(*), SUM(TRIM(img_text) = ''), MAX(tsp)
+                FROM {self.LABEL_TABLE}
+                GROUP BY {self.IMAGE_COLUMN}
+                ''')
+        self.conn.commit()
+
+    def get_all_progress(self):
+        # img_name -> (box_count, empty_count), 只返回有框的图片
+        return {
+            img_name: (box_count, empty_count)
+            for img_name, box_count, empty_count in self.query_progress(self.conn.cursor())
+        }
+
+    def query_progress(self, cursor):
+        return cursor.execute(r'''
+        SELECT img_name, box_count, empty_count FROM label_progress WHERE box_count > 0
+        ''')
+
+    def get_progress(self, img_name_list, chunk_size=SEARCH_CHUNK_SIZE):
+        # 只查给出的图片, 服务器分页列图片时用; 没有框的图片为 (0, 0)
+        key_dict = {}
+        for img_name in img_name_list:
+            image_key = self.image_key(img_name)
+            if image_key is not None:
+                key_dict[image_key] = img_name
+
+        progress_dict = {img_name: (0, 0) for img_name in img_name_list}
+        key_list = list(key_dict)
+        for start in range(0, len(key_list), chunk_size):
+            chunk = key_list[start:start + chunk_size]
+            for image_key, box_count, empty_count in self.cursor.execute(f'''
+            SELECT {self.IMAGE_COLUMN}, box_count, empty_count FROM label_progress
+            WHERE {self.IMAGE_COLUMN} IN ({','.join('?' * len(chunk))})
+            ''', chunk):
+                progress_dict[key_dict[image_key]] = (box_count, empty_count)
+        return progress_dict
+
+    def create_search_table(self):
+        # FTS5 外部内容表, 只存索引不存文本, 由触发器和 label 表同步
+        # 优先用 trigram 分词支持任意子串搜索, 老版本 sqlite 退回 unicode61 按词搜索, 没有 FTS5 时用 LIKE 全表扫描
+        self.search_table = f'{self.LABEL_TABLE}_fts'
+        row = self.cursor.execute(r'''
+        SELECT sql FROM sqlite_master WHERE type='table' AND name=?
+        ''', (self.search_table,)).fetchone()
+        if row:
+            self.search_mode = 'trigram' if 'trigram' in row[0] else 'unicode61'
+            return
+
+        self.search_mode = 'like'
+        for tokenizer in SEARCH_TOKENIZER_LIST:
+            try:
+                self.cursor.execute(f'''
+                CREATE VIRTUAL TABLE `{self.search_table}` USING fts5(
+                    img_text, content='{self.LABEL_TABLE}', content_rowid='id', tokenize='{tokenizer}'
+                );
+                ''')
+            except sqlite3.OperationalError as e:
+                logging.warning(f'fts5 tokenizer {tokenizer} not supported: {e}')
+                continue
+            self.search_mode = tokenizer
+            break
+        else:
+            return
+
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS `{self.LABEL_TABLE}_fts_insert` AFTER INSERT ON `{self.LABEL_TABLE}`
+        BEGIN
+            INSERT INTO `{self.search_table}` (rowid, img_text) VALUES (NEW.id, NEW.img_text);
+        END;
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS `{self.LABEL_TABLE}_fts_delete` AFTER DELETE ON `{self.LABEL_TABLE}`
+        BEGIN
+            INSERT INTO `{self.search_table}` (`{self.search_table}`, rowid, img_text) VALUES ('delete', OLD.id, OLD.img_text);
+        END;
+        ''')
+        self.cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS `{self.LABEL_TABLE}_fts_update` AFTER UPDATE OF img_text ON `{self.LABEL_TABLE}`
+        BEGIN
+            INSERT INTO `{self.search_table}` (`{self.search_table}`, rowid, img_text) VALUES ('delete', OLD.id, OLD.img_text);
+            INSERT INTO `{self.search_table}` (rowid, img_text) VALUES (NEW.id, NEW.img_text);
+        END;
+        ''')
+        # 已有的框一次性建索引
+        start = time.perf_counter()
+        with self.conn:
+            self.cursor.execute(f'''
+            INSERT INTO `{self.search_table}` (`{self.search_table}`) VALUES ('rebuild')
+            ''')
+        logging.info(f'build {tokenizer} search index in {time.perf_counter() - start:.1f} s')
+
+    def search_condition(self, text):
+        # trigram 至少要 3 个字符才能用索引, 更短的和没有 FTS5 时退回 LIKE
+        if self.search_mode == 'like' or (self.search_mode == 'trigram' and len(text) < 3):
+            pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            return False, "img_text LIKE ? ESCAPE '\\'", f'%{pattern}%'
+        return True, f'`{self.search_table}` MATCH ?', '"' + text.replace('"', '""') + '"'
+
+    def query_search(self, cursor, from_sql, where_sql, param):
+        return cursor.execute(f'''
+        SELECT t.img_name, t.id, t.img_text FROM {from_sql} WHERE {where_sql}
+        ''', (param,))
+
+    def search_text(self, text, chunk_size=SEARCH_CHUNK_SIZE):
+        # 按块流式返回 [(img_name, id, img_text), ...], 不排序, 第一块结果马上就能显示
+        if not text:
+            return
+        self.flush()
+        use_fts, where_sql, param = self.search_condition(text)
+        if use_fts:
+            from_sql = f'`{self.search_table}` JOIN {self.LABEL_TABLE} AS t ON t.id = `{self.search_table}`.rowid'
+        else:
+            from_sql = f'{self.LABEL_TABLE} AS t'
+        cursor = self.query_search(self.conn.cursor(), from_sql, where_sql, param)
+        while True:
+            row_list = cursor.fetchmany(chunk_size)
+            if not row_list:
+                return
+            yield row_list
+
+    def root_condition(self):
+        return '', ()
+
+    @retry_locked
+    def replace_text(self, old_text, new_text):
+        # 一个事务里替换所有包含 old_text 的框, 触发器同步更新搜索索引和进度; 返回修改的框数
+        if not old_text:
+            return 0
+        self.flush()
+        use_fts, where_sql, param = self.search_condition(old_text)
+        if use_fts:
+            where_sql = f'id IN (SELECT rowid FROM `{self.search_table}` WHERE {where_sql})'
+        root_sql, root_params = self.root_condition()
+        with self.conn:
+            self.cursor.execute(f'''
+            UPDATE {self.LABEL_TABLE} SET img_text = REPLACE(img_text, ?, ?), tsp = MAX(tsp + 1, ?)
+            WHERE {where_sql} AND INSTR(img_text, ?) > 0{root_sql}
+            ''', (old_text, new_text, int(time.time()), param, old_text, *root_params))
+            count = self.cursor.rowcount
+        # 改过的框 tsp 都变了, 重新读一遍记下来的 tsp, 之后的修改还能通过检查
+        self.refresh_row_tsp()
+        return count
+
+    def create_lease_table(self):
+        self.cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS image_lease (
+            {self.IMAGE_COLUMN} {self.IMAGE_COLUMN_TYPE} NOT NULL PRIMARY KEY, --图片
+            owner TEXT NOT NULL, --正在标注的人
+            expire INTEGER NOT NULL --过期时间戳
+        );
+        ''')
+        self.conn.commit()
+
+    def create_phash_table(self):
+        # 每张图片的感知哈希, 文件修改时间变了才重新计算; sqlite 的整数是有符号的, 64 位哈希存成有符号数
+        self.cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS image_phash (
+            {self.IMAGE_COLUMN} {self.IMAGE_COLUMN_TYPE} NOT NULL PRIMARY KEY, --图片
+            mtime INTEGER NOT NULL, --计算哈希时文件的修改时间, 纳秒
+            phash INTEGER --64 位感知哈希, 图片读不出来时为 NULL
+        );
+        ''')
+        self.conn.commit()
+
+    def get_all_phash(self):
+        # img_name -> (mtime, phash), phash 为无符号整数或 None
+        return {
+            img_name: (mtime, phash & 0xFFFFFFFFFFFFFFFF if phash is not None else None)
+            for img_name, mtime, phash in self.query_phash(self.conn.cursor())
+        }
+
+    def query_phash(self, cursor):
+        return cursor.execute(r'''
+        SELECT img_name, mtime, phash FROM image_phash
+        ''')
+
+    @retry_locked
+    def save_phash(self, phash_rows):
+        # phash_rows: [(img_name, mtime, phash), ...]
+        with self.conn:
+            self.cursor.executemany(f'''
+            INSERT OR REPLACE INTO image_phash ({self.IMAGE_COLUMN},mtime,phash) VALUES (?,?,?)
+            ''', [
+                (self.image_key(img_name, create=True), mtime, phash - (1 << 64) if phash is not None and phash >= 1 << 63 else phash)
+                for img_name, mtime, phash in phash_rows
+            ])
+
+    def image_key(self, img_name, create=False):
+        # 返回库里关联图片用的值, 图片不在库里且 create=False 时返回 None
+        return img_name
+
+    @perf.timed('db.get_all_text')
+    def get_all_text(self, img_name):
+        result_list = self.cursor.execute(f'''
+        SELECT id,x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp
+        FROM {self.LABEL_TABLE}
+        WHERE {self.IMAGE_COLUMN} = ?
+        ORDER BY id
+        ''', (self.image_key(img_name),)).fetchall()
+        result = []
+        if result_list:
+            for id,x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp in result_list:
+                self.row_tsp[id] = tsp
+                point_list = np.array([(x1,y1), (x2,y2), (x3,y3), (x4,y4)], dtype=np.int).reshape((4,2))
+                pending = self.pending_write.get((img_name, id))
+                if pending:
+                    point_list = pending.get('points', point_list).copy()
+                    img_text = pending.get('text', img_text)
+                result.append([id, point_list, img_text])
+        return result
+
+    @perf.timed('db.get_text_rows')
+    def get_text_rows(self, img_name):
+        # [(id, x1, y1, ..., y4, img_text, tsp), ...], 不经过 row_tsp 和延迟写入, 给服务器模式的共享连接用
+        return self.cursor.execute(f'''
+        SELECT id,x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp
+        FROM {self.LABEL_TABLE}
+        WHERE {self.IMAGE_COLUMN} = ?
+        ORDER BY id
+        ''', (self.image_key(img_name),)).fetchall()
+
+    @perf.timed('db.get_all_text_array')
+    def get_all_text_array(self, img_name):
+        result_list = self.cursor.execute(f'''
+        SELECT id,x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp
+        FROM {self.LABEL_TABLE}
+        WHERE {self.IMAGE_COLUMN} = ?
+        ORDER BY id
+        ''', (self.image_key(img_name),)).fetchall()
+
+        ids = np.array([row[0] for row in result_list], dtype=np.int64)
+        points = np.array([row[1:9] for row in result_list], dtype=np.int32).reshape((-1, 4, 2))
+        texts = [row[9] for row in result_list]
+        self.row_tsp.update((row[0], row[10]) for row in result_list)
+        for row, id in enumerate(ids.tolist()):
+            pending = self.pending_write.get((img_name, id))
+            if pending:
+                if 'points' in pending:
+                    points[row] = pending['points']
+                texts[row] = pending.get('text', texts[row])
+        return ids, points, texts
+
+    def iter_all_text(self):
+        # 按 img_name 分组流式读取整张表, 走 img_name 索引不需要额外排序
+        self.flush()
+        cursor = self.query_all_text(self.conn.cursor())
+
+        img_name = None
+        all_text = []
+        for row in cursor:
+            if row[0] != img_name:
+                if all_text:
+                    yield img_name, all_text
+                img_name = row[0]
+                all_text = []
+            all_text.append([row[1], np.array(row[2:10], dtype=np.int).reshape((4,2)), row[10]])
+
+        if all_text:
+            yield img_name, all_text
+
+    def iter_text_columns(self, chunk_size=IMPORT_BATCH_SIZE):
+        # 按块读取整张表, 每块返回 (img_names, ids, points, texts), ids/points 为 numpy 数组, 给批量检查用
+        self.flush()
+        cursor = self.query_all_text(self.conn.cursor())
+        while True:
+            row_list = cursor.fetchmany(chunk_size)
+            if not row_list:
+                return
+            img_names = [row[0] for row in row_list]
+            ids = np.array([row[1] for row in row_list], dtype=np.int64)
+            points = np.array([row[2:10] for row in row_list], dtype=np.int32).reshape((-1, 4, 2))
+            texts = [row[10] for row in row_list]
+            yield img_names, ids, points, texts
+
+    @retry_locked
+    def apply_fixes(self, delete_ids, point_rows):
+        # 一个事务里删除 delete_ids, 并把 point_rows [(id, (4,2) 坐标), ...] 写回
+        self.flush()
+        now = int(time.time())
+        with self.conn:
+            self.cursor.executemany(f'''
+            DELETE FROM {self.LABEL_TABLE} WHERE id=?
+            ''', [(id,) for id in delete_ids])
+            self.cursor.executemany(f'''
+            UPDATE {self.LABEL_TABLE} SET x1=?, y1=?, x2=?, y2=?, x3=?, y3=?, x4=?, y4=?, tsp=MAX(tsp + 1, ?)
+            WHERE id=?
+            ''', [(*np.asarray(point_list).flatten().tolist(), now, id) for id, point_list in point_rows])
+        self.refresh_row_tsp()
+
+    @perf.timed('db.apply_batch')
+    @retry_locked
+    def apply_batch(self, op_list):
+        # 服务器模式: 多个客户端的写入在一个事务里提交
+        # op_list: [(op, img_name, id, point_list, img_text, tsp), ...], op 为 'add'/'update'/'delete', 用不到的字段为 None
+        # tsp 不为 None 时只在框的 tsp 还是这个值时才修改, 否则说明别人改过或已删除, 放弃这个操作
+        # 返回每个操作的 (是否成功, id, 新 tsp), 删除的新 tsp 为 None
+        self.flush()
+        now = int(time.time())
+        result_list = []
+        with self.conn:
+            for op, img_name, id, point_list, img_text, tsp in op_list:
+                if op == 'add':
+                    self.cursor.execute(f'''
+                    INSERT INTO {self.LABEL_TABLE} ({self.IMAGE_COLUMN},x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+                    ''', (self.image_key(img_name, create=True), *point_list.flatten().tolist(), img_text, now))
+                    result_list.append((True, self.cursor.lastrowid, now))
+                    continue
+
+                image_key = self.image_key(img_name)
+                if op == 'delete':
+                    self.cursor.execute(f'''
+                    DELETE FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=? AND id=? AND (? IS NULL OR tsp=?)
+                    ''', (image_key, id, tsp, tsp))
+                    result_list.append((self.cursor.rowcount > 0, id, None))
+                    continue
+
+                old_tsp = tsp
+                if old_tsp is None:
+                    row = self.cursor.execute(f'''
+                    SELECT tsp FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=? AND id=?
+                    ''', (image_key, id)).fetchone()
+                    if row is None:
+                        result_list.append((False, id, None))
+                        continue
+                    old_tsp = row[0]
+
+                set_list = []
+                values = []
+                if point_list is not None:
+                    set_list.append('x1=?, y1=?, x2=?, y2=?, x3=?, y3=?, x4=?, y4=?')
+                    values.extend(point_list.flatten().tolist())
+                if img_text is not None:
+                    set_list.append('img_text=?')
+                    values.append(img_text)
+                new_tsp = max(now, old_tsp + 1)
+                self.cursor.execute(f'''
+                UPDATE {self.LABEL_TABLE} SET {', '.join(set_list + ['tsp=?'])}
+                WHERE {self.IMAGE_COLUMN}=? AND id=? AND tsp=?
+                ''', (*values, new_tsp, image_key, id, old_tsp))
+                if self.cursor.rowcount > 0:
+                    result_list.append((True, id, new_tsp))
+                else:
+                    result_list.append((False, id, None))
+        return result_list
+
+    def query_all_text(self, cursor):
+        return cursor.execute(r'''
+        SELECT img_name,id,x1,y1,x2,y2,x3,y3,x4,y4,img_text
+        FROM label_text
+        ORDER BY img_name, id
+        ''')
+
+    @perf.timed('db.add_text')
+    @retry_locked
+    def add_text(self, img_name, point_list, img_text):
+        # 提交失败时整个事务回滚, retry_locked 重试不会插入两次
+        tsp = int(time.time())
+        with self.conn:
+            image_key = self.image_key(img_name, create=True)
+            self.cursor.execute(f'''
+            INSERT INTO {self.LABEL_TABLE} ({self.IMAGE_COLUMN},x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp) 
+            VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            ''', (image_key, *point_list.flatten().tolist(), img_text, tsp))
+            id = self.cursor.lastrowid
+        self.row_tsp[id] = tsp
+        return id
+
+    def copy_text(self, src_img_name, dst_list, replace=False):
+        # 把 src 图片的框复制到 dst_list [(img_name, (scale_x, scale_y, dx, dy), (width, height) 或 None), ...]
+        # 坐标变换为 x * scale_x + dx, y * scale_y + dy
+        return self.copy_text_groups([(src_img_name, dst_list)], replace)
+
+    @perf.timed('db.copy_text')
+    @retry_locked
+    def copy_text_groups(self, group_list, replace=False):
+        # 一个事务里完成所有复制, group_list: [(src_img_name, dst_list), ...], dst_list 同 copy_text
+        # 坐标变换后限制在图片内, 整个移出图片的框不复制; replace=False 时跳过已经有框的图片
+        # 返回框有变化的图片 img_name -> (box_count, empty_count), 和 get_all_progress 一样
+        self.flush()
+        tsp = int(time.time())
+        copied_dict = {}
+        with self.conn:
+            for src_img_name, dst_list in group_list:
+                src_key = self.image_key(src_img_name)
+                if src_key is not None:
+                    self.copy_rows(src_key, dst_list, replace, tsp, copied_dict)
+        return copied_dict
+
+    def copy_rows(self, src_key, dst_list, replace, tsp, copied_dict):
+        for img_name, (scale_x, scale_y, dx, dy), size in dst_list:
+            high_x, high_y = (size[0] - 1, size[1] - 1) if size else (2 ** 31 - 1, 2 ** 31 - 1)
+            dst_key = self.image_key(img_name, create=True)
+            # 复制到自己: replace 时会先把源图片的框删掉, 不复制时也没有意义
+            if dst_key == src_key:
+                continue
+            delete_count = 0
+            if replace:
+                self.cursor.execute(f'''
+                DELETE FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=?
+                ''', (dst_key,))
+                delete_count = self.cursor.rowcount
+            self.cursor.execute(f'''
+            INSERT INTO {self.LABEL_TABLE} ({self.IMAGE_COLUMN},x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp)
+            SELECT :dst,
+                MAX(0, MIN(:hx, CAST(ROUND(x1 * :sx + :dx) AS INTEGER))), MAX(0, MIN(:hy, CAST(ROUND(y1 * :sy + :dy) AS INTEGER))),
+                MAX(0, MIN(:hx, CAST(ROUND(x2 * :sx + :dx) AS INTEGER))), MAX(0, MIN(:hy, CAST(ROUND(y2 * :sy + :dy) AS INTEGER))),
+                MAX(0, MIN(:hx, CAST(ROUND(x3 * :sx + :dx) AS INTEGER))), MAX(0, MIN(:hy, CAST(ROUND(y3 * :sy + :dy) AS INTEGER))),
+                MAX(0, MIN(:hx, CAST(ROUND(x4 * :sx + :dx) AS INTEGER))), MAX(0, MIN(:hy, CAST(ROUND(y4 * :sy + :dy) AS INTEGER))),
+                img_text, :tsp
+            FROM {self.LABEL_TABLE}
+            WHERE {self.IMAGE_COLUMN} = :src
+                AND MAX(x1, x2, x3, x4) * :sx + :dx >= 0 AND MIN(x1, x2, x3, x4) * :sx + :dx <= :hx
+                AND MAX(y1, y2, y3, y4) * :sy + :dy >= 0 AND MIN(y1, y2, y3, y4) * :sy + :dy <= :hy
+                AND NOT EXISTS (SELECT 1 FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN} = :dst)
+            ORDER BY id
+            ''', {
+                'dst': dst_key, 'src': src_key, 'sx': scale_x, 'sy': scale_y, 'dx': dx, 'dy': dy,
+                'hx': high_x, 'hy': high_y, 'tsp': tsp
+            })
+            if self.cursor.rowcount > 0 or delete_count > 0:
+                copied_dict[img_name] = self.cursor.execute(f'''
+                SELECT box_count, empty_count FROM label_progress WHERE {self.IMAGE_COLUMN}=?
+                ''', (dst_key,)).fetchone() or (0, 0)
+
+    def create_import_table(self):
+        self.cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS label_import (
+            {self.IMAGE_COLUMN} {self.IMAGE_COLUMN_TYPE} NOT NULL PRIMARY KEY, --图片
+            box_count INTEGER NOT NULL, --导入的框数
+            tsp INTEGER NOT NULL --导入的时间戳
+        );
+        ''')
+        self.conn.commit()
+
+    @perf.timed('db.import_all_text')
+    def import_all_text(self, img_text_iter, replace=False, batch_size=IMPORT_BATCH_SIZE, drop_index=True):
+        # img_text_iter 按图片分组: (img_name, [(point_list, img_text), ...])
+        # 每张图片导入后记到 label_import 表里, 重新运行时跳过已导入的图片; replace 时先删掉图片原有的框再导入
+        self.flush()
+        self.create_import_table()
+
+        stat = {'img_count': 0, 'box_count': 0, 'skip_count': 0}
+        index_dropped = False
+        imported_keys = set()
+        insert_rows = []
+        point_rows = []
+        import_rows = []
+        delete_rows = []
+
+        def commit_batch():
+            # 整批一起排序四个角
+            point_list = order_points(np.array(point_rows, dtype=np.int).reshape((-1, 4, 2))).reshape((-1, 8))
+            insert_rows[:] = [
+                (image_key, *points, img_text, tsp)
+                for (image_key, img_text, tsp), points in zip(insert_rows, point_list.tolist())
+            ]
+            with self.conn:
+                self.cursor.executemany(f'''
+                DELETE FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=?
+                ''', delete_rows)
+                self.cursor.executemany(f'''
+                INSERT INTO {self.LABEL_TABLE} ({self.IMAGE_COLUMN},x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?)
+                ''', insert_rows)
+                self.cursor.executemany(f'''
+                INSERT OR REPLACE INTO label_import ({self.IMAGE_COLUMN},box_count,tsp) VALUES (?,?,?)
+                ''', import_rows)
+            stat['img_count'] += len(import_rows)
+            stat['box_count'] += len(insert_rows)
+            logging.info(f'imported {stat["img_count"]} images, {stat["box_count"]} boxes')
+            del insert_rows[:], point_rows[:], import_rows[:], delete_rows[:]
+
+        start = time.perf_counter()
+        try:
+            for img_name, box_list in img_text_iter:
+                if not replace and self.cursor.execute(f'''
+                SELECT 1 FROM label_import WHERE {self.IMAGE_COLUMN}=?
+                ''', (self.image_key(img_name),)).fetchone():
+                    stat['skip_count'] += 1
+                    continue
+
+                tsp = int(time.time())
+                image_key = self.image_key(img_name, create=True)
+                # 同一张图片出现两次时, 第一次的框可能还没提交, replace 也删不掉, 只导入第一次的
+                if image_key in imported_keys:
+                    logging.warning(f'{img_name} appears more than once in the input, skipped')
+                    stat['skip_count'] += 1
+                    continue
+                imported_keys.add(image_key)
+
+                if replace:
+                    delete_rows.append((image_key,))
+                box_count = 0
+                for point_list, img_text in box_list:
+                    # 坐标个数或者类型不对的框跳过, 不让它中断整个导入
+                    try:
+                        points = np.array(point_list, dtype=np.int).reshape(8)
+                    except (ValueError, TypeError, OverflowError):
+                        logging.warning(f'{img_name} invalid points {point_list}')
+                        continue
+                    point_rows.append(points)
+                    insert_rows.append((image_key, img_text, tsp))
+                    box_count += 1
+                import_rows.append((image_key, box_count, tsp))
+
+                if len(insert_rows) >= batch_size:
+                    # 数据量大时先删掉索引, 全部导入后再重建; replace 的删除要用索引所以保留
+                    if drop_index and not replace and not index_dropped:
+                        self.cursor.execute(f'DROP INDEX IF EXISTS `{self.IMAGE_INDEX}`')
+                        index_dropped = True
+                    commit_batch()
+
+            if import_rows:
+                commit_batch()
+        finally:
+            if index_dropped:
+                self.create_index()
+                self.conn.commit()
+
+        stat['time'] = time.perf_counter() - start
+        return stat
+
+    @perf.timed('db.del_text')
+    @retry_locked
+    def del_text(self, img_name, id):
+        # 提交失败时整个事务回滚, 重试时 tsp 还是原来的值, 不会误报冲突
+        self.pending_write.pop((img_name, id), None)
+        conflict = False
+        with self.conn:
+            if self.concurrent:
+                self.cursor.execute(f'''
+                DELETE FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=? AND id=? AND tsp=?;
+                ''', (self.image_key(img_name), id, self.known_tsp(id)))
+                conflict = self.cursor.rowcount == 0
+            else:
+                self.cursor.execute(f'''
+                DELETE FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=? AND id=?;
+                ''', (self.image_key(img_name), id))
+        if conflict:
+            self.conflict_list.append((img_name, id))
+        self.row_tsp.pop(id, None)
+
+    @perf.timed('db.update_text')
+    def update_text(self, img_name, id, img_text):
+        self.add_pending(img_name, id, 'text', img_text)
+
+    @perf.timed('db.update_points')
+    def update_points(self, img_name, id, point_list):
+        self.add_pending(img_name, id, 'points', np.array(point_list, dtype=np.int).reshape((4, 2)))
+
+    def add_pending(self, img_name, id, field, value):
+        self.stat_write_count += 1
+        pending = self.pending_write.setdefault((img_name, id), {})
+        if field in pending:
+            self.stat_merge_count += 1
+        pending[field] = value
+
+    @perf.timed('db.flush')
+    @retry_locked
+    def flush(self):
+        if not self.pending_write:
+            return 0
+
+        start = time.perf_counter()
+        pending_write, self.pending_write = self.pending_write, {}
+
+        points_rows = []
+        text_rows = []
+        for (img_name, id), pending in pending_write.items():
+            image_key = self.image_key(img_name)
+            if 'points' in pending:
+                points_rows.append((*pending['points'].flatten().tolist(), image_key, id))
+            if 'text' in pending:
+                text_rows.append((pending['text'], image_key, id))
+
+        try:
+            with self.conn:
+                if self.concurrent:
+                    row_tsp, conflict_list = self.flush_checked(pending_write)
+                else:
+                    self.cursor.executemany(f'''
+                    UPDATE {self.LABEL_TABLE} SET x1=?, y1=?, x2=?, y2=?, x3=?, y3=?, x4=?, y4=?
+                    WHERE {self.IMAGE_COLUMN}=? AND id=?
+                    ''', points_rows)
+                    self.cursor.executemany(f'''
+                    UPDATE {self.LABEL_TABLE} SET img_text=? WHERE {self.IMAGE_COLUMN}=? AND id=?
+                    ''', text_rows)
+        except:
+            # 写入失败时放回队列, 保留在此期间产生的更新的修改
+            for key, pending in pending_write.items():
+                pending.update(self.pending_write.get(key, {}))
+                self.pending_write[key] = pending
+            raise
+
+        if self.concurrent:
+            self.row_tsp.update(row_tsp)
+            self.conflict_list.extend(conflict_list)
+            if conflict_list:
+                logging.warning(f'flush {len(conflict_list)} rows modified by others, changes dropped')
+
+        self.stat_last_flush_time = time.perf_counter() - start
+        self.stat_flush_time += self.stat_last_flush_time
+        self.stat_flush_count += 1
+        logging.info(
+            f'flush {len(pending_write)} rows in {self.stat_last_flush_time * 1000:.1f} ms, '
+            f'{self.stat_merge_count}/{self.stat_write_count} writes merged so far'
+        )
+        return len(pending_write)
+
+    def flush_checked(self, pending_write):
+        # 乐观并发: 只有 tsp 还是读出来时的值才写入并把 tsp 加一, 否则说明别人改过, 放弃这一行的修改
+        now = int(time.time())
+        row_tsp = {}
+        conflict_list = []
+        for (img_name, id), pending in pending_write.items():
+            set_list = []
+            values = []
+            if 'points' in pending:
+                set_list.append('x1=?, y1=?, x2=?, y2=?, x3=?, y3=?, x4=?, y4=?')
+                values.extend(pending['points'].flatten().tolist())
+            if 'text' in pending:
+                set_list.append('img_text=?')
+                values.append(pending['text'])
+
+            old_tsp = self.known_tsp(id)
+            new_tsp = max(now, old_tsp + 1) if old_tsp is not None else now
+            self.cursor.execute(f'''
+            UPDATE {self.LABEL_TABLE} SET {', '.join(set_list)}, tsp=?
+            WHERE {self.IMAGE_COLUMN}=? AND id=? AND tsp=?
+            ''', (*values, new_tsp, self.image_key(img_name), id, old_tsp))
+            if self.cursor.rowcount == 0:
+                conflict_list.append((img_name, id))
+            else:
+                row_tsp[id] = new_tsp
+        return row_tsp, conflict_list
+
+    def known_tsp(self, id):
+        # 没记过 tsp 的框当作缓存未命中, 从库里读当前值; 框已经不在了返回 None
+        tsp = self.row_tsp.get(id)
+        if tsp is None:
+            row = self.cursor.execute(f'''
+            SELECT tsp FROM {self.LABEL_TABLE} WHERE id=?
+            ''', (id,)).fetchone()
+            if row is not None:
+                tsp = self.row_tsp[id] = row[0]
+        return tsp
+
+    def refresh_row_tsp(self, chunk_size=SEARCH_CHUNK_SIZE):
+        # 批量修改后重新读记下来的框的 tsp, 已经删掉的框去掉
+        id_list = list(self.row_tsp)
+        row_tsp = {}
+        for start in range(0, len(id_list), chunk_size):
+            chunk = id_list[start:start + chunk_size]
+            row_tsp.update(self.cursor.execute(f'''
+            SELECT id, tsp FROM {self.LABEL_TABLE} WHERE id IN ({','.join('?' * len(chunk))})
+            ''', chunk).fetchall())
+        self.row_tsp = row_tsp
+
+    def pop_conflicts(self):
+        conflict_list, self.conflict_list = self.conflict_list, []
+        return conflict_list
+
+    def data_changed(self):
+        # data_version 只在其他连接提交后变化, 自己的提交不影响
+        data_version = self.cursor.execute('PRAGMA data_version').fetchone()[0]
+        changed = self.data_version is not None and data_version != self.data_version
+        self.data_version = data_version
+        return changed
+
+    def image_changed(self, img_name, ids):
+        # 数据库里的框数, id 之和, 最大 tsp 和内存里的不一致就说明这张图片被别人改过
+        count, total_id, max_tsp = self.cursor.execute(f'''
+        SELECT COUNT(*), TOTAL(id), MAX(tsp) FROM {self.LABEL_TABLE} WHERE {self.IMAGE_COLUMN}=?
+        ''', (self.image_key(img_name),)).fetchone()
+        tsp_list = [self.row_tsp[id] for id in ids if id in self.row_tsp]
+        return count != len(ids) or total_id != sum(ids) or max_tsp != max(tsp_list, default=None)
+
+    @retry_locked
+    def acquire_lease(self, img_name):
+        # 占用或续期图片的租约; 别人的租约还没过期时不占用, 返回对方的名字
+        now = int(time.time())
+        image_key = self.image_key(img_name, create=True)
+        with self.conn:
+            self.cursor.execute(f'''
+            INSERT OR REPLACE INTO image_lease ({self.IMAGE_COLUMN},owner,expire)
+            SELECT ?, ?, ? WHERE NOT EXISTS (
+                SELECT 1 FROM image_lease WHERE {self.IMAGE_COLUMN}=? AND owner<>? AND expire>?
+            )
+            ''', (image_key, self.owner, now + DB_LEASE_SECONDS, image_key, self.owner, now))
+            if self.cursor.rowcount > 0:
+                self.lease_held = True
+                return None
+            row = self.cursor.execute(f'''
+            SELECT owner FROM image_lease WHERE {self.IMAGE_COLUMN}=?
+            ''', (image_key,)).fetchone()
+        return row[0] if row else None
+
+    @retry_locked
+    def release_lease(self, img_name=None):
+        # img_name 为 None 时释放自己的所有租约
+        with self.conn:
+            if img_name is None:
+                self.cursor.execute('DELETE FROM image_lease WHERE owner=?', (self.owner,))
+                self.lease_held = False
+            else:
+                self.cursor.execute(f'''
+                DELETE FROM image_lease WHERE {self.IMAGE_COLUMN}=? AND owner=?
+                ''', (self.image_key(img_name), self.owner))
+
+    def stats(self):
+        return {
+            'write_count': self.stat_write_count,
+            'merge_count': self.stat_merge_count,
+            'flush_count': self.stat_flush_count,
+            'flush_time': self.stat_flush_time,
+            'last_flush_time': self.stat_last_flush_time,
+            'pending_count': len(self.pending_write),
+        }
+
+    def discard_uncommitted(self):
+        # 事务回滚后调用, 子类丢掉回滚前缓存下来的数据
+        pass
+
+    def close(self):
+        try:
+            self.flush()
+            if self.lease_held:
+                self.release_lease()
+        finally:
+            self.conn.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            logging.exception('DBLabelText close exception')
+
+
+def project_root(directory):
+    # 工程库里的根目录统一成绝对路径, 分隔符用 /
+    return Path(directory).resolve().as_posix()
+
+
+class DBProjectLabelText(DBLabelText):
+    # 工程模式: 一个库管理多个图片根目录, 图片登记在 images 表里, 框用整数 image_id 关联
+    LABEL_TABLE = 'label_box'
+    IMAGE_COLUMN = 'image_id'
+    IMAGE_COLUMN_TYPE = 'INTEGER'
+    IMAGE_INDEX = 'idx_label_box_image_id'
+    IMAGE_INDEX_COLUMNS = '`image_id` ASC, `id` ASC'
+
+    def __init__(self, project_path, root=None, concurrent=False, check_same_thread=True):
+        self.root = project_root(root) if root is not None else None
+        self.image_id_cache = {}
+        super(DBProjectLabelText, self).__init__(project_path, concurrent, check_same_thread)
+
+    def create_table(self):
+        self.cursor.execute('PRAGMA foreign_keys = ON')
+        self.cursor.execute(r'''
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            root TEXT NOT NULL, --图片根目录
+            rel_path TEXT NOT NULL, --相对根目录的路径
+            size INTEGER NOT NULL, --文件大小
+            mtime INTEGER NOT NULL, --修改时间, 纳秒
+            UNIQUE (root, rel_path)
+        );
+        ''')
+        self.cursor.execute(r'''
+        CREATE TABLE IF NOT EXISTS label_box (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            image_id INTEGER NOT NULL REFERENCES images (id), --图片
+            x1 INTEGER NOT NULL, --左上角x坐标
+            y1 INTEGER NOT NULL, --左上角y坐标
+            x2 INTEGER NOT NULL, --右上角x坐标
+            y2 INTEGER NOT NULL, --右上角y坐标
+            x3 INTEGER NOT NULL, --右下角x坐标
+            y3 INTEGER NOT NULL, --右下角y坐标
+            x4 INTEGER NOT NULL, --左下角x坐标
+            y4 INTEGER NOT NULL, --左下角y坐标
+            img_text TEXT NOT NULL, -- 文本内容
+            tsp INTEGER NOT NULL --最后一次修改的时间戳
+        );
+        ''')
+        self.create_index()
+
+    def discard_uncommitted(self):
+        # 回滚后缓存里可能有没写进去的 image_id
+        self.image_id_cache.clear()
+
+    def image_key(self, img_name, create=False):
+        image_id = self.image_id_cache.get(img_name)
+        if image_id is not None:
+            return image_id
+
+        row = self.cursor.execute(r'''
+        SELECT id FROM images WHERE root=? AND rel_path=?
+        ''', (self.root, img_name)).fetchone()
+        if row:
+            image_id = row[0]
+        elif create:
+            try:
+                st = os.stat(os.path.join(self.root, img_name))
+                size, mtime = st.st_size, st.st_mtime_ns
+            except OSError:
+                size, mtime = 0, 0
+            # 不单独提交, 和后面写入的框在同一个事务里
+            self.cursor.execute(r'''
+            INSERT INTO images (root,rel_path,size,mtime) VALUES (?,?,?,?)
+            ''', (self.root, img_name, size, mtime))
+            image_id = self.cursor.lastrowid
+        else:
+            return None
+        self.image_id_cache[img_name] = image_id
+        return image_id
+
+    def query_all_text(self, cursor):
+        # 按 (root, rel_path) 唯一索引顺序遍历图片, 每张图片的框走 (image_id, id) 索引, 不需要额外排序
+        return cursor.execute(r'''
+        SELECT images.rel_path,b.id,b.x1,b.y1,b.x2,b.y2,b.x3,b.y3,b.x4,b.y4,b.img_text
+        FROM images JOIN label_box AS b ON b.image_id = images.id
+        WHERE images.root = ?
+        ORDER BY images.rel_path, b.id
+        ''', (self.root,))
+
+    def query_search(self, cursor, from_sql, where_sql, param):
+        return cursor.execute(f'''
+        SELECT images.rel_path, t.id, t.img_text
+        FROM {from_sql} JOIN images ON images.id = t.image_id
+        WHERE images.root = ? AND {where_sql}
+        ''', (self.root, param))
+
+    def root_condition(self):
+        return ' AND image_id IN (SELECT id FROM images WHERE root=?)', (self.root,)
+
+    def query_phash(self, cursor):
+        return cursor.execute(r'''
+        SELECT images.rel_path, h.mtime, h.phash
+        FROM images JOIN image_phash AS h ON h.image_id = images.id
+        WHERE images.root = ?
+        ''', (self.root,))
+
+    def query_progress(self, cursor):
+        return cursor.execute(r'''
+        SELECT images.rel_path, p.box_count, p.empty_count
+        FROM images JOIN label_progress AS p ON p.image_id = images.id
+        WHERE images.root = ? AND p.box_count > 0
+        ''', (self.root,))
+
+    def add_text(self, img_name, point_list, img_text):
+        try:
+            return super(DBProjectLabelText, self).add_text(img_name, point_list, img_text)
+        except:
+            self.image_id_cache.clear()
+            raise
+
+    def copy_text_groups(self, group_list, replace=False):
+        try:
+            return super(DBProjectLabelText, self).copy_text_groups(group_list, replace)
+        except:
+            self.image_id_cache.clear()
+            raise
+
+    def apply_batch(self, op_list):
+        try:
+            return super(DBProjectLabelText, self).apply_batch(op_list)
+        except:
+            self.image_id_cache.clear()
+            raise
+
+    def save_phash(self, phash_rows):
+        try:
+            return super(DBProjectLabelText, self).save_phash(phash_rows)
+        except:
+            self.image_id_cache.clear()
+            raise
+
+    def import_all_text(self, img_text_iter, *args, **kwargs):
+        try:
+            return super(DBProjectLabelText, self).import_all_text(img_text_iter, *args, **kwargs)
+        except:
+            # 事务回滚后缓存里可能有没写进去的 image_id
+            self.image_id_cache.clear()
+            raise
+
+
+def open_label_db(directory, project_file=None, concurrent=False, check_same_thread=True):
+    if project_file:
+        return DBProjectLabelText(str(project_file), directory, concurrent, check_same_thread)
+    return DBLabelText(str(Path(directory).joinpath('label.sqllite3')), concurrent, check_same_thread)
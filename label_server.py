@@ -0,0 +1,535 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+import numpy as np
+from PySide2.QtCore import QBuffer
+from PySide2.QtCore import QCoreApplication
+from PySide2.QtCore import QIODevice
+from PySide2.QtCore import QSize
+from PySide2.QtCore import Qt
+from PySide2.QtGui import QImageReader
+
+from geometry import order_points
+from image_scanner import ImageScanner
+from label_db import open_label_db
+from perf_monitor import perf
+
+
+SERVER_POOL_SIZE = 8
+SERVER_LISTEN_BACKLOG = 1024
+SERVER_WRITE_BUFFER_BYTES = 64 * 1024
+SERVER_PAGE_SIZE = 100
+SERVER_MAX_PAGE_SIZE = 1000
+SERVER_MAX_BODY_BYTES = 16 * 1024 * 1024
+SERVER_MAX_REQUEST_OPS = 1000
+SERVER_WRITE_BATCH_OPS = 5000
+SERVER_WRITE_TIMEOUT = 30
+SERVER_IMAGE_CACHE_BYTES = 512 * 1024 * 1024
+SERVER_IMAGE_SIDE_LIST = [256, 1024, 2048]
+SERVER_IMAGE_QUALITY = 85
+SERVER_CONTENT_TYPE_DICT = {'.JPG': 'image/jpeg', '.JPEG': 'image/jpeg', '.PNG': 'image/png', '.BMP': 'image/bmp'}
+WRITE_OP_LIST = ['add', 'update', 'delete']
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super(RequestError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ConnectionPool:
+    def __init__(self, directory, project_file=None, size=SERVER_POOL_SIZE):
+        # 只读连接池, WAL 模式下读连接之间, 读和唯一的写连接之间互不阻塞
+        # 后进先出, 请求少的时候总是用最近用过的几个连接, 页缓存是热的
+        self.size = size
+        self.db_list = [
+            open_label_db(directory, project_file, concurrent=True, check_same_thread=False)
+            for _ in range(size)
+        ]
+        self.idle = queue.LifoQueue()
+        for db_label in self.db_list:
+            self.idle.put(db_label)
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        db_label = self.idle.get()
+        if perf.enabled:
+            perf.record('pool.wait', time.perf_counter() - start)
+        try:
+            yield db_label
+        finally:
+            self.idle.put(db_label)
+
+    def stats(self):
+        return {'size': self.size, 'idle': self.idle.qsize()}
+
+    def close(self):
+        for db_label in self.db_list:
+            db_label.close()
+
+
+class BatchWriter(threading.Thread):
+    def __init__(self, directory, project_file=None):
+        super(BatchWriter, self).__init__(name='BatchWriter', daemon=True)
+        # 所有写入都交给这一个线程和连接, 排队期间到达的请求合并成一个事务提交, 不会互相抢写锁
+        self.db_label = open_label_db(directory, project_file, concurrent=True, check_same_thread=False)
+        self.queue = queue.Queue()
+        self.stat_request_count = 0
+        self.stat_op_count = 0
+        self.stat_batch_count = 0
+        self.stat_max_batch = 0
+
+    def submit(self, op_list):
+        future = Future()
+        self.queue.put((op_list, future))
+        try:
+            return future.result(SERVER_WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            # 还在排队就取消掉, 这样一定没有写入, 客户端可以放心重试
+            if future.cancel():
+                raise RequestError(503, 'write queue timeout, nothing was applied, retry later')
+        # 写线程已经在提交这一批了, 等它的真实结果, 不能让客户端以为没写入而重试写两次
+        return future.result()
+
+    def run(self):
+        try:
+            stop = False
+            while not stop:
+                item = self.queue.get()
+                if item is None:
+                    break
+
+                batch = [item]
+                op_count = len(item[0])
+                while op_count < SERVER_WRITE_BATCH_OPS:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                    op_count += len(item[0])
+                # 跳过等待超时已经被取消的请求
+                batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+                if batch:
+                    self.write(batch)
+        finally:
+            self.db_label.close()
+
+    def write(self, batch):
+        try:
+            result_list = self.db_label.apply_batch([op for op_list, _ in batch for op in op_list])
+        except Exception as e:
+            if len(batch) == 1:
+                logging.exception('apply_batch exception')
+                batch[0][1].set_exception(e)
+                return
+            # 合并的一批失败时逐个请求重试, 只让出错的那个请求失败
+            for item in batch:
+                self.write([item])
+            return
+
+        self.stat_request_count += len(batch)
+        self.stat_op_count += len(result_list)
+        self.stat_batch_count += 1
+        self.stat_max_batch = max(self.stat_max_batch, len(batch))
+        pos = 0
+        for op_list, future in batch:
+            future.set_result(result_list[pos:pos + len(op_list)])
+            pos += len(op_list)
+
+    def stats(self):
+        return {
+            'request_count': self.stat_request_count,
+            'op_count': self.stat_op_count,
+            'batch_count': self.stat_batch_count,
+            'max_batch': self.stat_max_batch,
+            'queue': self.queue.qsize(),
+        }
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+
+def image_side(side):
+    # 请求的边长向上取到固定的几档, 不同客户端的请求能共用缓存; 0 或超过最大一档返回原图
+    for value in SERVER_IMAGE_SIDE_LIST:
+        if 0 < side <= value:
+            return value
+    return 0
+
+
+def encode_image(img_path, side):
+    # 长边超过 side 时解码时直接缩小再编码成 jpg, 否则原样返回文件内容
+    # 返回 (数据, Content-Type, 原图宽, 原图高)
+    reader = QImageReader(img_path)
+    size = reader.size()
+    if not size.isValid():
+        raise RequestError(422, f'{img_path} unreadable')
+
+    if side and (size.width() > side or size.height() > side):
+        scaled_size = QSize(size)
+        scaled_size.scale(side, side, Qt.KeepAspectRatio)
+        reader.setScaledSize(scaled_size)
+        img = reader.read()
+        if img.isNull():
+            raise RequestError(422, f'{img_path} unreadable')
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        img.save(buffer, 'JPG', SERVER_IMAGE_QUALITY)
+        return bytes(buffer.data()), 'image/jpeg', size.width(), size.height()
+
+    with open(img_path, 'rb') as f:
+        data = f.read()
+    content_type = SERVER_CONTENT_TYPE_DICT.get(os.path.splitext(img_path)[1].upper(), 'application/octet-stream')
+    return data, content_type, size.width(), size.height()
+
+
+class ServerImageCache:
+    def __init__(self, max_bytes=SERVER_IMAGE_CACHE_BYTES):
+        # (img_name, 边长, 修改时间) -> encode_image 的结果, 按字节数 LRU 淘汰
+        # 同一张图片同时被多个客户端请求时只解码一次, 其他请求等第一个的结果
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.loading = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stat_hit_count = 0
+        self.stat_miss_count = 0
+
+    @perf.timed('image_cache.get')
+    def get(self, img_path, img_name, side):
+        try:
+            mtime = os.stat(img_path).st_mtime_ns
+        except OSError:
+            raise RequestError(404, f'{img_name} not found')
+
+        key = (img_name, side, mtime)
+        with self.lock:
+            value = self.cache.get(key)
+            if value is not None:
+                self.cache.move_to_end(key)
+                self.stat_hit_count += 1
+                return value
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = self.loading[key] = Future()
+                self.stat_miss_count += 1
+            else:
+                self.stat_hit_count += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = encode_image(img_path, side)
+        except Exception as e:
+            with self.lock:
+                self.loading.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.loading.pop(key, None)
+            self.cache[key] = value
+            self.total_bytes += len(value[0])
+            while self.total_bytes > self.max_bytes and len(self.cache) > 1:
+                _, old_value = self.cache.popitem(last=False)
+                self.total_bytes -= len(old_value[0])
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                'count': len(self.cache),
+                'bytes': self.total_bytes,
+                'hit_count': self.stat_hit_count,
+                'miss_count': self.stat_miss_count,
+            }
+
+
+class LabelHTTPServer(ThreadingMixIn, HTTPServer):
+    # 每个客户端连接一个线程, 数据库操作都很短, 瓶颈在连接池和写线程
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = SERVER_LISTEN_BACKLOG
+
+    def __init__(self, address, directory, project_file=None, pool_size=SERVER_POOL_SIZE,
+                 image_cache_bytes=SERVER_IMAGE_CACHE_BYTES):
+        super(LabelHTTPServer, self).__init__(address, LabelRequestHandler)
+        # 解码图片的 QImageReader 要靠 QCoreApplication 加载格式插件, 跟着服务器一起存在
+        self.qt_app = QCoreApplication.instance() or QCoreApplication([sys.argv[0]])
+        self.directory = str(directory)
+        self.img_name_list = self.scan_images()
+        self.img_name_set = set(self.img_name_list)
+        self.pool = ConnectionPool(self.directory, project_file, pool_size)
+        self.writer = BatchWriter(self.directory, project_file)
+        self.writer.start()
+        self.image_cache = ServerImageCache(image_cache_bytes)
+
+    def scan_images(self):
+        # 启动时扫描一次, 和界面一样用目录清单跳过没变的目录
+        start = time.perf_counter()
+        scanner = ImageScanner(self.directory)
+        new_manifest = {}
+        img_name_list = list(scanner.scan(scanner.load_manifest(), new_manifest))
+        try:
+            scanner.save_manifest(new_manifest)
+        except:
+            logging.exception('save_manifest exception')
+        logging.info(f'scan {len(img_name_list)} images in {time.perf_counter() - start:.2f} s')
+        return img_name_list
+
+    def parse_op(self, item):
+        # 客户端的一个写操作 -> apply_batch 的 (op, img_name, id, point_list, img_text, tsp)
+        if not isinstance(item, dict) or item.get('op') not in WRITE_OP_LIST:
+            raise RequestError(400, f'invalid op {item}')
+        op = item['op']
+        img_name = item.get('img_name')
+        id = item.get('id')
+        point_list = item.get('points')
+        img_text = item.get('text')
+        tsp = item.get('tsp')
+        if not isinstance(img_name, str):
+            raise RequestError(400, f'invalid img_name {img_name}')
+        if img_text is not None and not isinstance(img_text, str):
+            raise RequestError(400, f'invalid text {img_text}')
+        if point_list is not None:
+            try:
+                point_list = order_points(np.array(point_list, dtype=np.int).reshape((4, 2)))
+            except (ValueError, TypeError):
+                raise RequestError(400, f'invalid points {point_list}')
+
+        if op == 'add':
+            if img_name not in self.img_name_set:
+                raise RequestError(404, f'{img_name} not found')
+            if point_list is None:
+                raise RequestError(400, 'add needs points')
+            return ('add', img_name, None, point_list, img_text or '', None)
+
+        if not isinstance(id, int) or (tsp is not None and not isinstance(tsp, int)):
+            raise RequestError(400, f'invalid id {id} or tsp {tsp}')
+        if op == 'delete':
+            return ('delete', img_name, id, None, None, tsp)
+        if point_list is None and img_text is None:
+            raise RequestError(400, 'update needs points or text')
+        return ('update', img_name, id, point_list, img_text, tsp)
+
+    def stats(self):
+        return {
+            'image_count': len(self.img_name_list),
+            'pool': self.pool.stats(),
+            'writer': self.writer.stats(),
+            'image_cache': self.image_cache.stats(),
+            'perf': perf.summary(),
+        }
+
+    def server_close(self):
+        super(LabelHTTPServer, self).server_close()
+        self.writer.stop()
+        self.pool.close()
+
+
+class LabelRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 保持连接, 客户端不用每个请求重新建 TCP 连接
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TextLabelServer/1.0'
+    disable_nagle_algorithm = True
+    # 响应头和不大的响应体缓冲起来一次发出去, 默认不缓冲时每个响应至少两次 send
+    wbufsize = SERVER_WRITE_BUFFER_BYTES
+
+    ROUTE_DICT = {
+        ('GET', '/api/images'): 'get_images',
+        ('GET', '/api/boxes'): 'get_boxes',
+        ('POST', '/api/boxes'): 'post_boxes',
+        ('GET', '/api/image'): 'get_image',
+        ('GET', '/api/stats'): 'get_stats',
+    }
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        start = time.perf_counter()
+        split = urlsplit(self.path)
+        name = self.ROUTE_DICT.get((method, split.path))
+        try:
+            # 先读完请求体, 出错返回时连接还能继续用
+            self.body = self.read_body()
+            if name is None:
+                raise RequestError(404, f'{method} {split.path} not found')
+            self.query = parse_qs(split.query)
+            getattr(self, name)()
+        except RequestError as e:
+            self.send_json({'error': e.message}, e.status)
+        except ConnectionError:
+            self.close_connection = True
+        except:
+            logging.exception(f'{method} {self.path} exception')
+            self.send_json({'error': 'internal error'}, 500)
+        if perf.enabled:
+            perf.record(f'http.{name}', time.perf_counter() - start)
+
+    def read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            raise RequestError(400, 'invalid Content-Length')
+        if length > SERVER_MAX_BODY_BYTES:
+            self.close_connection = True
+            raise RequestError(413, f'body larger than {SERVER_MAX_BODY_BYTES} bytes')
+        return self.rfile.read(length) if length else b''
+
+    def param(self, name, default=None):
+        value_list = self.query.get(name)
+        if not value_list:
+            if default is None:
+                raise RequestError(400, f'missing {name}')
+            return default
+        return value_list[0]
+
+    def int_param(self, name, default=None):
+        try:
+            return int(self.param(name, default))
+        except ValueError:
+            raise RequestError(400, f'invalid {name}')
+
+    def send_bytes(self, body, content_type, status=200, header_list=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in header_list:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_bytes(body, 'application/json; charset=utf-8', status)
+
+    def log_message(self, format, *args):
+        # 默认每个请求往 stderr 写一行, 几百个客户端时很慢
+        pass
+
+    def get_images(self):
+        offset = max(0, self.int_param('offset', 0))
+        limit = min(max(0, self.int_param('limit', SERVER_PAGE_SIZE)), SERVER_MAX_PAGE_SIZE)
+        img_name_list = self.server.img_name_list[offset:offset + limit]
+        with self.server.pool.connection() as db_label:
+            progress_dict = db_label.get_progress(img_name_list)
+        self.send_json({
+            'total': len(self.server.img_name_list),
+            'offset': offset,
+            'images': [
+                {'img_name': img_name, 'box_count': progress_dict[img_name][0], 'empty_count': progress_dict[img_name][1]}
+                for img_name in img_name_list
+            ],
+        })
+
+    def get_boxes(self):
+        img_name = self.param('img_name')
+        with self.server.pool.connection() as db_label:
+            row_list = db_label.get_text_rows(img_name)
+        self.send_json({
+            'img_name': img_name,
+            'boxes': [
+                {'id': row[0], 'points': [row[1:3], row[3:5], row[5:7], row[7:9]], 'text': row[9], 'tsp': row[10]}
+                for row in row_list
+            ],
+        })
+
+    def post_boxes(self):
+        # {"ops": [{"op": "add", "img_name":..., "points":..., "text":...},
+        #          {"op": "update", "img_name":..., "id":..., "points" 和/或 "text":..., "tsp":...},
+        #          {"op": "delete", "img_name":..., "id":..., "tsp":...}]}
+        # 一个请求里的操作在同一个事务里, 带 tsp 的操作在框被别人改过时不生效, 返回 ok=false
+        try:
+            request = json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise RequestError(400, 'invalid json')
+        item_list = request.get('ops') if isinstance(request, dict) else None
+        if not isinstance(item_list, list) or not item_list:
+            raise RequestError(400, 'missing ops')
+        if len(item_list) > SERVER_MAX_REQUEST_OPS:
+            raise RequestError(413, f'more than {SERVER_MAX_REQUEST_OPS} ops')
+
+        op_list = [self.server.parse_op(item) for item in item_list]
+        result_list = self.server.writer.submit(op_list)
+        self.send_json({'results': [{'ok': ok, 'id': id, 'tsp': tsp} for ok, id, tsp in result_list]})
+
+    def get_image(self):
+        img_name = self.param('img_name')
+        if img_name not in self.server.img_name_set:
+            raise RequestError(404, f'{img_name} not found')
+        img_path = os.path.join(self.server.directory, img_name)
+        data, content_type, width, height = self.server.image_cache.get(
+            img_path, img_name, image_side(self.int_param('side', 0))
+        )
+        # 框的坐标是原图像素, 客户端按原图宽高换算
+        self.send_bytes(data, content_type, header_list=[
+            ('X-Image-Width', str(width)),
+            ('X-Image-Height', str(height)),
+            ('Cache-Control', 'private, max-age=60'),
+        ])
+
+    def get_stats(self):
+        self.send_json(self.server.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='标注服务器, 通过 HTTP/JSON 接口读写一个目录(或工程库里一个目录)的标注')
+    parser.add_argument('directory', help='被标注的目录')
+    parser.add_argument('--project', default=None, help='工程库路径, 读写工程库里这个目录的标注')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址, 局域网访问用 0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pool-size', type=int, default=SERVER_POOL_SIZE, help='只读数据库连接数')
+    parser.add_argument('--image-cache-mb', type=int, default=SERVER_IMAGE_CACHE_BYTES // (1024 * 1024), help='缩小图片的内存缓存大小')
+    parser.add_argument('--perf', action='store_true', help='统计各接口耗时, /api/stats 里可以看到, 退出时写入日志')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.perf:
+        perf.enable()
+
+    server = LabelHTTPServer(
+        (args.host, args.port), args.directory, args.project, args.pool_size, args.image_cache_mb * 1024 * 1024
+    )
+    logging.info(f'serving {len(server.img_name_list)} images on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if perf.enabled:
+            perf.dump()
+
+
+if __name__ == '__main__':
+    main()
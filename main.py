@@ -1,117 +1,1018 @@
+import json
+import hashlib
 import logging
-import sqlite3
+import math
+import multiprocessing
+import os
 import sys
+import threading
 import time
-from copy import deepcopy
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+from collections import OrderedDict
+from collections import deque
 from pathlib import Path
 
-
-import numpy as np
-if sys.platform == 'win32':
-    import numpy.core._dtype_ctypes #don't remove this line, pyinstaller need this
 from PySide2 import QtWidgets
 from PySide2 import QtCore
+from PySide2.QtCore import QObject
 from PySide2.QtCore import QPoint
-from PySide2.QtCore import QSortFilterProxyModel
+from PySide2.QtCore import QPointF
+from PySide2.QtCore import QAbstractListModel
+from PySide2.QtCore import QAbstractTableModel
 from PySide2.QtCore import QItemSelectionModel
+from PySide2.QtCore import QModelIndex
 from PySide2.QtCore import QRect
+from PySide2.QtCore import QRectF
+from PySide2.QtCore import QRunnable
 from PySide2.QtCore import QSize
+from PySide2.QtCore import QTimer
 from PySide2.QtCore import Qt
+from PySide2.QtCore import QThread
+from PySide2.QtCore import QThreadPool
+from PySide2.QtCore import Signal
 from PySide2.QtGui import QColor, QIntValidator, QBrush, QFont
-from PySide2.QtGui import QStandardItemModel
-from PySide2.QtGui import QStandardItem
+from PySide2.QtGui import QImage
+from PySide2.QtGui import QImageReader
 from PySide2.QtGui import QPixmap
 from PySide2.QtGui import QRegion
 from PySide2.QtGui import QKeySequence
 from PySide2.QtGui import QPainter
+from PySide2.QtGui import QPainterPath
 from PySide2.QtGui import QPen
+from PySide2.QtGui import QPolygon
+from PySide2.QtGui import QPolygonF
+from PySide2.QtGui import QTransform
 from PySide2.QtWidgets import QTableView, QLineEdit
 from PySide2.QtWidgets import QToolButton
+from PySide2.QtWidgets import QCheckBox
+from PySide2.QtWidgets import QSpinBox
 from PySide2.QtWidgets import QWidget
 from PySide2.QtWidgets import QApplication
 from PySide2.QtWidgets import QDesktopWidget
 from PySide2.QtWidgets import QFileDialog
 from PySide2.QtWidgets import QHBoxLayout
 from PySide2.QtWidgets import QLabel
+from PySide2.QtWidgets import QListView
 from PySide2.QtWidgets import QMessageBox
 from PySide2.QtWidgets import QPushButton
 from PySide2.QtWidgets import QShortcut
+from PySide2.QtWidgets import QStyle
+from PySide2.QtWidgets import QStyledItemDelegate
 from PySide2.QtWidgets import QVBoxLayout
 
+from image_scanner import ImageScanner
+from perf_monitor import PERF_SLOW_THRESHOLD
+from perf_monitor import perf
+
+# numpy 和数据库层在第一次打开目录时才导入, 启动时窗口先显示出来
+np = None
+geometry = None
+image_hash = None
+label_db = None
+order_points = None
+
+
+def import_heavy_modules():
+    global np, geometry, image_hash, label_db, order_points
+    if label_db is not None:
+        return
+
+    start = time.perf_counter()
+    import numpy as np
+    if sys.platform == 'win32':
+        import numpy.core._dtype_ctypes #don't remove this line, pyinstaller need this
+    import geometry
+    import image_hash
+    import label_db
+    from geometry import order_points
+    logging.info(f'import numpy and database modules in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+
+QUAD_INDEX_CELL_SIZE = 128
+
+
+class QuadIndex:
+    def __init__(self, cell_size=QUAD_INDEX_CELL_SIZE):
+        self.cell_size = cell_size
+        # 均匀网格: (cx, cy) -> {id}, 每个框按外接矩形登记到覆盖的所有格子
+        self.grid = {}
+        self.quads = {}
+
+    @classmethod
+    def build(cls, all_text, cell_size=QUAD_INDEX_CELL_SIZE):
+        quad_index = cls(cell_size)
+        id_list = []
+        point_list = []
+        for idx, points, img_text in all_text:
+            id_list.append(idx)
+            point_list.append(points)
+        if id_list:
+            # 所有框的外接矩形一次算完
+            point_list = np.asarray(point_list).reshape((-1, 4, 2))
+            cell_rect_list = (geometry.bounding_rect(point_list) // cell_size).tolist()
+            for idx, points, cell_rect in zip(id_list, point_list, cell_rect_list):
+                quad_index.insert_cells(idx, points, cell_rect)
+        return quad_index
+
+    @staticmethod
+    def cells(cell_rect):
+        cx0, cy0, cx1, cy1 = cell_rect
+        return [(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)]
+
+    def insert(self, id, point_list):
+        point_list = np.asarray(point_list).reshape((4, 2))
+        self.insert_cells(id, point_list, (geometry.bounding_rect(point_list) // self.cell_size).tolist())
+
+    def insert_cells(self, id, point_list, cell_rect):
+        cells = self.cells(cell_rect)
+        self.quads[id] = (point_list, cells)
+        for cell in cells:
+            self.grid.setdefault(cell, set()).add(id)
+
+    def remove(self, id):
+        quad = self.quads.pop(id, None)
+        if quad is None:
+            return
+
+        for cell in quad[1]:
+            ids = self.grid[cell]
+            ids.discard(id)
+            if not ids:
+                del self.grid[cell]
 
-def order_points(point_list):
-    point_list = sorted(point_list, key=lambda x: x[0])
-    a1 = sorted([*point_list[:2]], key=lambda x: x[1])
-    a2 = sorted([*point_list[2:]], key=lambda x: x[1])
-    return np.array([a1[0], a2[0], a2[1], a1[1]], np.int)
-
-class DBLabelText:
-    def __init__(self, lable_data_path):
-        self.conn = sqlite3.connect(lable_data_path)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(r'''
-        CREATE TABLE IF NOT EXISTS label_text (
-            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
-            img_name TEXT NOT NULL, --图片文件名
-            x1 INTEGER NOT NULL, --左上角x坐标
-            y1 INTEGER NOT NULL, --左上角y坐标
-            x2 INTEGER NOT NULL, --右上角x坐标
-            y2 INTEGER NOT NULL, --右上角y坐标
-            x3 INTEGER NOT NULL, --右下角x坐标
-            y3 INTEGER NOT NULL, --右下角y坐标
-            x4 INTEGER NOT NULL, --左下角x坐标
-            y4 INTEGER NOT NULL, --左下角y坐标
-            img_text TEXT NOT NULL, -- 文本内容
-            tsp INTEGER NOT NULL --最后一次修改的时间戳
-        );
-    ''')
-
-        self.cursor.execute(f'''
-        CREATE INDEX IF NOT EXISTS `idx_label_text_img_name` ON `label_text` (`img_name` ASC);
-        ''')
+    def update(self, id, point_list):
+        self.remove(id)
+        self.insert(id, point_list)
+
+    def hit_test(self, x, y):
+        # 点落在多个框里时选面积最小的, 方便选中嵌套在大框里的小框
+        id_list = list(self.grid.get((int(x) // self.cell_size, int(y) // self.cell_size), ()))
+        if not id_list:
+            return None
+
+        point_list = np.array([self.quads[id][0] for id in id_list])
+        inside = geometry.point_in_quad(x, y, point_list)
+        if not inside.any():
+            return None
+        area = np.where(inside, geometry.quad_area(point_list), np.inf)
+        return id_list[int(np.argmin(area))]
+
+
+LABEL_REPOSITORY_MAX_IMAGES = 64
+LABEL_REPOSITORY_MAX_BOXES = 500000
+
+
+class ImageAnnotation:
+    def __init__(self, img_name, ids, points, texts):
+        # 列式存储: ids 升序的 int64 数组, points 为 (N,4,2) 的 int32 数组, texts 为字符串列表
+        self.img_name = img_name
+        self.ids = ids
+        self.points = points
+        self.texts = texts
+        self.quad_index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, id):
+        row = int(np.searchsorted(self.ids, id))
+        if row < len(self.ids) and self.ids[row] == id:
+            return row
+        return None
+
+    def all_text(self):
+        return [[id, point_list, img_text] for id, point_list, img_text in zip(self.ids.tolist(), self.points, self.texts)]
+
+    def get_quad_index(self):
+        if self.quad_index is None:
+            self.quad_index = QuadIndex.build(zip(self.ids.tolist(), self.points, self.texts))
+        return self.quad_index
+
+    def add(self, id, point_list, img_text):
+        row = int(np.searchsorted(self.ids, id))
+        self.ids = np.insert(self.ids, row, id)
+        self.points = np.insert(self.points, row, np.asarray(point_list, dtype=np.int32).reshape((4, 2)), axis=0)
+        self.texts.insert(row, img_text)
+        if self.quad_index is not None:
+            self.quad_index.insert(id, point_list)
+
+    def remove(self, id):
+        row = self.row_of(id)
+        if row is None:
+            return
+
+        self.ids = np.delete(self.ids, row)
+        self.points = np.delete(self.points, row, axis=0)
+        del self.texts[row]
+        if self.quad_index is not None:
+            self.quad_index.remove(id)
+
+    def set_points(self, id, point_list):
+        row = self.row_of(id)
+        if row is None:
+            return
+
+        self.points[row] = point_list
+        if self.quad_index is not None:
+            self.quad_index.update(id, point_list)
+
+    def set_text(self, id, img_text):
+        # 返回原来的文本, 框不存在时返回 None
+        row = self.row_of(id)
+        if row is None:
+            return None
+        old_text = self.texts[row]
+        self.texts[row] = img_text
+        return old_text
+
+
+class LabelRepository:
+    def __init__(self, db_label, max_images=LABEL_REPOSITORY_MAX_IMAGES, max_boxes=LABEL_REPOSITORY_MAX_BOXES):
+        # 每张图片的标注只从数据库读一次, 之后读操作都走内存, 写操作同时改内存和数据库(延迟写入)
+        self.db_label = db_label
+        self.max_images = max_images
+        self.max_boxes = max_boxes
+        self.cache = OrderedDict()
+        self.box_count = 0
+        self.stat_hit_count = 0
+        self.stat_miss_count = 0
+
+    def get(self, img_name):
+        annotation = self.cache.get(img_name)
+        if annotation is not None:
+            self.cache.move_to_end(img_name)
+            self.stat_hit_count += 1
+            return annotation
+
+        self.stat_miss_count += 1
+        annotation = ImageAnnotation(img_name, *self.db_label.get_all_text_array(img_name))
+        self.cache[img_name] = annotation
+        self.box_count += len(annotation)
+
+        # 按最近使用淘汰, 当前图片无论多大都保留
+        while len(self.cache) > 1 and (len(self.cache) > self.max_images or self.box_count > self.max_boxes):
+            _, old_annotation = self.cache.popitem(last=False)
+            self.box_count -= len(old_annotation)
+        return annotation
 
     def get_all_text(self, img_name):
-        result_list = self.cursor.execute(r'''
-        SELECT id,x1,y1,x2,y2,x3,y3,x4,y4,img_text
-        FROM label_text
-        WHERE img_name = ?
-        ORDER BY id
-        ''', (img_name,)).fetchall()
-        result = []
-        if result_list:
-            for id,x1,y1,x2,y2,x3,y3,x4,y4,img_text in result_list:
-                result.append([id, np.array([(x1,y1), (x2,y2), (x3,y3), (x4,y4)], dtype=np.int).reshape((4,2)), img_text])
-        return result
+        return self.get(img_name).all_text()
 
     def add_text(self, img_name, point_list, img_text):
-        self.cursor.execute(r'''
-        INSERT INTO label_text (img_name,x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp) 
-        VALUES (?,?,?,?,?,?,?,?,?,?,?)
-        ''', (img_name, *point_list.flatten().tolist(), img_text, int(time.time())))
-        self.conn.commit()
-        return self.cursor.lastrowid
+        id = self.db_label.add_text(img_name, point_list, img_text)
+        if img_name in self.cache:
+            self.cache[img_name].add(id, point_list, img_text)
+            self.box_count += 1
+        return id
+
+    def copy_text(self, src_img_name, dst_list, replace=False):
+        return self.copy_text_groups([(src_img_name, dst_list)], replace)
+
+    def copy_text_groups(self, group_list, replace=False):
+        copied_dict = self.db_label.copy_text_groups(group_list, replace)
+        for img_name in copied_dict:
+            self.invalidate(img_name)
+        return copied_dict
 
     def del_text(self, img_name, id):
-        self.cursor.execute(r'''
-        DELETE FROM label_text WHERE img_name=? AND id=?;
-        ''', (img_name, id))
-        self.conn.commit()
+        result = self.db_label.del_text(img_name, id)
+        if img_name in self.cache:
+            annotation = self.cache[img_name]
+            size = len(annotation)
+            annotation.remove(id)
+            self.box_count -= size - len(annotation)
+        return result
 
     def update_text(self, img_name, id, img_text):
-        self.cursor.execute(r'''
-        UPDATE label_text SET img_text=? WHERE img_name=? AND id=?
-        ''', (img_text, img_name, id))
-        self.conn.commit()
+        # 返回原来的文本, 图片不在缓存里时返回 None
+        self.db_label.update_text(img_name, id, img_text)
+        if img_name in self.cache:
+            return self.cache[img_name].set_text(id, img_text)
+        return None
 
     def update_points(self, img_name, id, point_list):
-        self.cursor.execute(r'''
-        UPDATE label_text SET x1=?, y1=?, x2=?, y2=?, x3=?, y3=?, x4=?, y4=?
-        WHERE img_name=? AND id=?
-        ''', (*point_list.flatten().tolist(), img_name, id))
-        self.conn.commit()
+        self.db_label.update_points(img_name, id, point_list)
+        if img_name in self.cache:
+            self.cache[img_name].set_points(id, point_list)
+
+    def hit_test(self, img_name, x, y):
+        return self.get(img_name).get_quad_index().hit_test(x, y)
+
+    def invalidate_except(self, img_name):
+        for key in list(self.cache):
+            if key != img_name:
+                self.invalidate(key)
+
+    def invalidate(self, img_name=None):
+        if img_name is None:
+            self.cache.clear()
+            self.box_count = 0
+            return
+
+        annotation = self.cache.pop(img_name, None)
+        if annotation is not None:
+            self.box_count -= len(annotation)
+
+    def flush(self):
+        return self.db_label.flush()
+
+    def sync(self, img_name):
+        # 别人提交修改后调用: 其他图片的缓存直接丢掉, 下次用到时重新读; 当前图片确实被改过才重新读, 返回是否重新读了
+        self.invalidate_except(img_name)
+        annotation = self.cache.get(img_name)
+        if annotation is None or not self.db_label.image_changed(img_name, annotation.ids.tolist()):
+            return False
+        self.invalidate(img_name)
+        return True
+
+    def stats(self):
+        return {
+            'hit_count': self.stat_hit_count,
+            'miss_count': self.stat_miss_count,
+            'image_count': len(self.cache),
+            'box_count': self.box_count,
+        }
+
+
+class LabelProgress:
+    def __init__(self, progress_dict):
+        # progress_dict: img_name -> (box_count, empty_count), 来自 label_progress 表
+        # 图片按扫描顺序编号, 没有框的和有空文本框的图片编号分别存成升序数组, 找下一张用二分查找
+        self.progress_dict = progress_dict
+        self.img_index = {}
+        self.img_count = 0
+        self.unlabeled = array('q')
+        self.empty_text = array('q')
+        self.labeled_count = 0
+        self.box_count = 0
+        self.empty_count = 0
+
+    def extend(self, img_name_list):
+        for img_name in img_name_list:
+            pos = self.img_count
+            self.img_count += 1
+            self.img_index[img_name] = pos
+            box_count, empty_count = self.progress_dict.get(img_name, (0, 0))
+            self.box_count += box_count
+            self.empty_count += empty_count
+            if box_count > 0:
+                self.labeled_count += 1
+            else:
+                self.unlabeled.append(pos)
+            if empty_count > 0:
+                self.empty_text.append(pos)
+
+    def update(self, img_name, box_count, empty_count):
+        old_box_count, old_empty_count = self.progress_dict.get(img_name, (0, 0))
+        self.progress_dict[img_name] = (box_count, empty_count)
+        pos = self.img_index.get(img_name)
+        if pos is None:
+            return
+
+        self.box_count += box_count - old_box_count
+        self.empty_count += empty_count - old_empty_count
+        if (old_box_count > 0) != (box_count > 0):
+            if box_count > 0:
+                self.unlabeled.pop(bisect_left(self.unlabeled, pos))
+                self.labeled_count += 1
+            else:
+                insort(self.unlabeled, pos)
+                self.labeled_count -= 1
+        if (old_empty_count > 0) != (empty_count > 0):
+            if empty_count > 0:
+                insort(self.empty_text, pos)
+            else:
+                self.empty_text.pop(bisect_left(self.empty_text, pos))
+
+    @staticmethod
+    def next_after(pos_list, pos):
+        # 从当前位置往后找, 到末尾后从头开始
+        if not pos_list:
+            return None
+        idx = bisect_right(pos_list, pos)
+        return pos_list[idx] if idx < len(pos_list) else pos_list[0]
+
+    def next_unlabeled(self, pos):
+        return self.next_after(self.unlabeled, pos)
+
+    def next_empty_text(self, pos):
+        return self.next_after(self.empty_text, pos)
+
+    def stats(self):
+        return {
+            'img_count': self.img_count,
+            'labeled_count': self.labeled_count,
+            'box_count': self.box_count,
+            'empty_count': self.empty_count,
+        }
+
+
+IMAGE_CACHE_BYTES = 1024 * 1024 * 1024
+IMAGE_PREFETCH_NEXT = 3
+IMAGE_PREFETCH_PREV = 1
+IMAGE_READ_THREAD_COUNT = 2
+IMAGE_TILE_SIZE = 512
+IMAGE_MAX_ZOOM = 16
+
+
+class ImageCache:
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.stat_hit_count = 0
+        self.stat_miss_count = 0
+
+    @staticmethod
+    def image_key(img_path):
+        return str(img_path), os.stat(str(img_path)).st_mtime_ns
+
+    @staticmethod
+    def image_bytes(img):
+        return img.width() * img.height() * img.depth() // 8
+
+    def get(self, key):
+        img = self.cache.get(key)
+        if img is None:
+            self.stat_miss_count += 1
+            return None
+
+        self.cache.move_to_end(key)
+        self.stat_hit_count += 1
+        return img
+
+    def put(self, key, img):
+        old_img = self.cache.pop(key, None)
+        if old_img is not None:
+            self.cache_bytes -= self.image_bytes(old_img)
+
+        self.cache[key] = img
+        self.cache_bytes += self.image_bytes(img)
+
+        # 至少保留刚放入的图片, 即使它本身就超过了预算
+        while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+            _, old_img = self.cache.popitem(last=False)
+            self.cache_bytes -= self.image_bytes(old_img)
+
+    def clear(self):
+        self.cache.clear()
+        self.cache_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def stats(self):
+        return {
+            'hit_count': self.stat_hit_count,
+            'miss_count': self.stat_miss_count,
+            'image_count': len(self.cache),
+            'cache_bytes': self.cache_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class TilePyramid:
+    def __init__(self, key, img_size, overview):
+        self.key = key
+        self.width = img_size.width()
+        self.height = img_size.height()
+        self.overview = overview
+        self.overview_level = max(0, int(round(math.log2(self.width / max(overview.width(), 1)))))
+
+    @staticmethod
+    def scaled_size(width, height, level):
+        return max(1, width >> level), max(1, height >> level)
+
+    @staticmethod
+    def fit_level(width, height, view_size):
+        # 让概览图不小于显示区域的最粗层级
+        scale = min(view_size.width() / width, view_size.height() / height)
+        if scale >= 1:
+            return 0
+        return int(math.floor(math.log2(1 / scale)))
+
+    def level_for_scale(self, scale):
+        if scale >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / scale))), self.overview_level)
+
+    def tile_rect(self, level, tx, ty):
+        level_width, level_height = self.scaled_size(self.width, self.height, level)
+        x = tx * IMAGE_TILE_SIZE
+        y = ty * IMAGE_TILE_SIZE
+        return QRect(x, y, min(IMAGE_TILE_SIZE, level_width - x), min(IMAGE_TILE_SIZE, level_height - y))
+
+    def visible_tiles(self, level, x0, y0, x1, y1):
+        level_width, level_height = self.scaled_size(self.width, self.height, level)
+        fx = self.width / level_width
+        fy = self.height / level_height
+
+        tx0 = max(int(x0 / fx) // IMAGE_TILE_SIZE, 0)
+        ty0 = max(int(y0 / fy) // IMAGE_TILE_SIZE, 0)
+        tx1 = min(int(x1 / fx) // IMAGE_TILE_SIZE, (level_width - 1) // IMAGE_TILE_SIZE)
+        ty1 = min(int(y1 / fy) // IMAGE_TILE_SIZE, (level_height - 1) // IMAGE_TILE_SIZE)
+
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                rect = self.tile_rect(level, tx, ty)
+                img_rect = QRectF(rect.x() * fx, rect.y() * fy, rect.width() * fx, rect.height() * fy)
+                yield self.key + (level, tx, ty), img_rect
+
+
+class ImageReadSignal(QObject):
+    finished = Signal(object, object, object)
+
+
+class ImageReadTask(QRunnable):
+    def __init__(self, key, loader):
+        super(ImageReadTask, self).__init__()
+        self.key = key
+        self.loader = loader
+
+    def run(self):
+        img = None
+        img_size = None
+        try:
+            # 开始解码前已经不需要这张图片(比如按住方向键快速翻页)就直接丢弃
+            if self.loader.is_wanted(self.key):
+                img, img_size = self.loader.read_image(self.key)
+        except:
+            logging.exception('ImageReadTask exception')
+            img = QImage()
+        self.loader.signal.finished.emit(self.key, img, img_size)
+
+
+class ImageLoader(QObject):
+    loaded = Signal(int, object)
+    tile_loaded = Signal(object)
+
+    def __init__(self, parent=None, view_size=QSize(900, 750), max_bytes=IMAGE_CACHE_BYTES,
+                 thread_count=IMAGE_READ_THREAD_COUNT):
+        super(ImageLoader, self).__init__(parent)
+
+        self.view_size = view_size
+        # (path, mtime) 对应概览图, (path, mtime, level, tx, ty) 对应瓦片
+        self.cache = ImageCache(max_bytes)
+        self.image_size = {}
+        self.loading = set()
+
+        # 每次请求的编号, 只有最新的请求会通过 loaded 信号返回
+        self.generation = 0
+        self.request_key = None
+        self.prefetch_keys = frozenset()
+        self.tile_keys = frozenset()
+
+        # QImageReader 可以在后台线程解码, QPixmap 只能在界面线程里创建
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(thread_count)
+        self.signal = ImageReadSignal(self)
+        self.signal.finished.connect(self.on_read_finished)
+
+    @perf.timed('image_decode')
+    def read_image(self, key):
+        reader = QImageReader(key[0])
+        img_size = reader.size()
+        if not img_size.isValid():
+            img = reader.read()
+            return img, img.size()
+
+        if len(key) == 2:
+            level = TilePyramid.fit_level(img_size.width(), img_size.height(), self.view_size)
+            if level > 0:
+                reader.setScaledSize(QSize(*TilePyramid.scaled_size(img_size.width(), img_size.height(), level)))
+        else:
+            level, tx, ty = key[2:]
+            rect = QRect(tx * IMAGE_TILE_SIZE, ty * IMAGE_TILE_SIZE, IMAGE_TILE_SIZE, IMAGE_TILE_SIZE)
+            if level > 0:
+                # 缩小的层级直接在解码时降采样, jpeg 只需解码部分 DCT 系数
+                reader.setScaledSize(QSize(*TilePyramid.scaled_size(img_size.width(), img_size.height(), level)))
+                reader.setScaledClipRect(rect.intersected(QRect(QPoint(0, 0), reader.scaledSize())))
+            else:
+                reader.setClipRect(rect.intersected(QRect(QPoint(0, 0), img_size)))
+        return reader.read(), img_size
+
+    def is_wanted(self, key):
+        return key == self.request_key or key in self.prefetch_keys or key in self.tile_keys
+
+    def get_pyramid(self, key):
+        overview = self.cache.get(key)
+        if overview is None or key not in self.image_size:
+            return None
+        return TilePyramid(key, self.image_size[key], overview)
+
+    def request(self, img_path):
+        self.generation += 1
+        self.request_key = None
+        self.tile_keys = frozenset()
+        try:
+            key = ImageCache.image_key(img_path)
+        except OSError:
+            return None
+
+        pyramid = self.get_pyramid(key)
+        if pyramid is not None:
+            return pyramid
+
+        self.request_key = key
+        self.start(key, priority=1)
+        return None
+
+    def prefetch(self, img_path_list):
+        key_list = []
+        for img_path in img_path_list:
+            try:
+                key_list.append(ImageCache.image_key(img_path))
+            except OSError:
+                continue
+
+        self.prefetch_keys = frozenset(key_list)
+        for key in key_list:
+            if key not in self.cache:
+                self.start(key)
+
+    def get_tile(self, key):
+        return self.cache.get(key)
+
+    def request_tiles(self, key_list):
+        self.tile_keys = frozenset(key_list)
+        for key in key_list:
+            self.start(key, priority=1)
+
+    def start(self, key, priority=0):
+        if key in self.loading:
+            return
+
+        self.loading.add(key)
+        self.pool.start(ImageReadTask(key, self), priority)
+
+    def on_read_finished(self, key, img, img_size):
+        self.loading.discard(key)
+
+        if img is None:
+            # 解码被跳过, 但在此期间又被请求了
+            if self.is_wanted(key):
+                self.start(key, priority=0 if key in self.prefetch_keys else 1)
+            return
+
+        img = QPixmap.fromImage(img)
+        if not img.isNull():
+            self.cache.put(key, img)
+            if img_size is not None and len(key) == 2:
+                self.image_size[key] = img_size
+
+        if len(key) > 2:
+            if not img.isNull():
+                self.tile_loaded.emit(key)
+        elif key == self.request_key:
+            self.request_key = None
+            self.loaded.emit(self.generation, self.get_pyramid(key))
+
+    def clear(self):
+        self.generation += 1
+        self.request_key = None
+        self.prefetch_keys = frozenset()
+        self.tile_keys = frozenset()
+        self.pool.clear()
+        self.loading.clear()
+        self.cache.clear()
+        self.image_size.clear()
+
+
+THUMB_SIZE = 96
+THUMB_CACHE_DIR = Path.home().joinpath('.text_label_tool', 'thumbs')
+THUMB_MEMORY_COUNT = 2000
+THUMB_THREAD_COUNT = 2
+THUMB_PREFETCH_ROWS = 20
+THUMB_KEY_BLOCK = 64 * 1024
+
+
+class ThumbnailSignal(QObject):
+    finished = Signal(int, int, object)
+
+
+class ThumbnailTask(QRunnable):
+    def __init__(self, generation, row, img_path, model):
+        super(ThumbnailTask, self).__init__()
+        self.generation = generation
+        self.row = row
+        self.img_path = img_path
+        self.model = model
+
+    def run(self):
+        img = None
+        try:
+            # 排队期间已经滚出可见范围就跳过, 再滚回来时会重新请求
+            if self.model.is_wanted(self.generation, self.row):
+                img = self.model.read_thumbnail(self.img_path)
+        except:
+            logging.exception('ThumbnailTask exception')
+            img = QImage()
+        self.model.signal.finished.emit(self.generation, self.row, img)
+
+
+class ThumbnailModel(QAbstractListModel):
+    def __init__(self, parent=None, cache_dir=THUMB_CACHE_DIR, thread_count=THUMB_THREAD_COUNT):
+        super(ThumbnailModel, self).__init__(parent)
+        self.cache_dir = Path(cache_dir)
+        self.directory = None
+        self.progress = None
+        self.img_names = []
+        # 内存里只留最近显示过的缩略图, 其余的在磁盘缓存里
+        self.cache = OrderedDict()
+        self.loading = set()
+        self.generation = 0
+        self.request_count = 0
+        self.visible_range = (0, -1)
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(thread_count)
+        self.signal = ThumbnailSignal(self)
+        self.signal.finished.connect(self.on_thumbnail_loaded)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.img_names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        img_name = self.img_names[row]
+        if role == Qt.DecorationRole:
+            pixmap = self.cache.get(img_name)
+            if pixmap is None:
+                self.request(row)
+            else:
+                self.cache.move_to_end(img_name)
+            return pixmap
+        if role == Qt.DisplayRole:
+            return str(row + 1)
+        if role == Qt.ToolTipRole:
+            return img_name
+        if role == Qt.UserRole:
+            if self.progress is None:
+                return (0, 0)
+            return self.progress.progress_dict.get(img_name, (0, 0))
+        return None
+
+    def reset(self, directory, progress):
+        self.beginResetModel()
+        self.directory = directory
+        self.progress = progress
+        self.img_names = []
+        self.cache.clear()
+        self.loading.clear()
+        self.generation += 1
+        self.pool.clear()
+        self.endResetModel()
+
+    def set_progress(self, progress):
+        self.progress = progress
+        if self.img_names:
+            self.dataChanged.emit(self.index(0), self.index(len(self.img_names) - 1), [Qt.UserRole])
+
+    def extend(self, img_name_list):
+        if not img_name_list:
+            return
+
+        row = len(self.img_names)
+        self.beginInsertRows(QModelIndex(), row, row + len(img_name_list) - 1)
+        self.img_names.extend(img_name_list)
+        self.endInsertRows()
+
+    def update_row(self, row):
+        if row is not None and row < len(self.img_names):
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.UserRole])
+
+    def is_wanted(self, generation, row):
+        first, last = self.visible_range
+        return generation == self.generation and first - THUMB_PREFETCH_ROWS <= row <= last + THUMB_PREFETCH_ROWS
+
+    def request(self, row):
+        if row in self.loading:
+            return
+
+        # 后请求的先做, 快速滚动时优先处理停下来时能看到的
+        self.loading.add(row)
+        self.request_count += 1
+        img_path = os.path.join(self.directory, self.img_names[row])
+        self.pool.start(ThumbnailTask(self.generation, row, img_path, self), self.request_count)
+
+    def cache_path(self, img_path):
+        # 按内容生成缓存文件名: 文件大小 + 开头和结尾各一块的哈希, 只读两块不用解码
+        # 只改了修改时间的图片不会失效, 改名或者复制的图片共用同一份缓存
+        with open(img_path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            digest = hashlib.sha1(f'{size}|'.encode('utf-8'))
+            f.seek(0)
+            digest.update(f.read(THUMB_KEY_BLOCK))
+            if size > THUMB_KEY_BLOCK:
+                f.seek(max(THUMB_KEY_BLOCK, size - THUMB_KEY_BLOCK))
+                digest.update(f.read(THUMB_KEY_BLOCK))
+        key = digest.hexdigest()
+        return self.cache_dir.joinpath(key[:2], key + '.jpg')
+
+    def read_thumbnail(self, img_path):
+        cache_path = self.cache_path(img_path)
+        if cache_path.exists():
+            img = QImage(str(cache_path))
+            if not img.isNull():
+                return img
+
+        reader = QImageReader(img_path)
+        size = reader.size()
+        if size.isValid() and (size.width() > THUMB_SIZE or size.height() > THUMB_SIZE):
+            size.scale(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio)
+            reader.setScaledSize(size)
+        img = reader.read()
+        if img.isNull():
+            return img
+        if img.width() > THUMB_SIZE or img.height() > THUMB_SIZE:
+            img = img.scaled(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{cache_path}.{threading.get_ident()}.tmp'
+        if img.save(tmp_path, 'JPG', 85):
+            os.replace(tmp_path, str(cache_path))
+        return img
+
+    def on_thumbnail_loaded(self, generation, row, img):
+        if generation != self.generation:
+            return
+
+        self.loading.discard(row)
+        if img is None:
+            return
+
+        # 读不出来的图片也放一个空图, 避免反复请求
+        self.cache[self.img_names[row]] = QPixmap.fromImage(img)
+        while len(self.cache) > THUMB_MEMORY_COUNT:
+            self.cache.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    def sizeHint(self, option, index):
+        return QSize(THUMB_SIZE + 8, THUMB_SIZE + 8)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(rect, option.palette.highlight())
+
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is not None and not pixmap.isNull():
+            x = rect.x() + (rect.width() - pixmap.width()) // 2
+            y = rect.y() + (rect.height() - pixmap.height()) // 2
+            painter.drawPixmap(x, y, pixmap)
+        else:
+            painter.fillRect(rect.adjusted(4, 4, -4, -4), QColor(220, 220, 220))
+
+        # 右上角显示框数: 没有框灰色, 有空文本橙色, 都填了绿色
+        box_count, empty_count = index.data(Qt.UserRole)
+        if box_count == 0:
+            color = QColor(128, 128, 128)
+        elif empty_count > 0:
+            color = QColor(255, 140, 0)
+        else:
+            color = QColor(0, 160, 0)
+        badge_rect = QRect(rect.right() - 34, rect.top() + 4, 30, 16)
+        painter.fillRect(badge_rect, color)
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(badge_rect, Qt.AlignCenter, str(box_count))
+
+        painter.setPen(QColor(0, 0, 0))
+        painter.drawText(rect.adjusted(6, 0, 0, -4), Qt.AlignLeft | Qt.AlignBottom, index.data(Qt.DisplayRole))
+        painter.restore()
+
+
+class FilmStripView(QListView):
+    def __init__(self, parent):
+        super(FilmStripView, self).__init__(parent)
+
+        self.model = ThumbnailModel(self)
+        self.setModel(self.model)
+        self.setItemDelegate(ThumbnailDelegate(self))
+        # 所有项一样大, 10 万张图片也不需要逐项计算布局, 只有可见的项会取数据和绘制
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.setSelectionMode(QListView.SingleSelection)
+        self.setFixedWidth(THUMB_SIZE + 30)
+
+        self.verticalScrollBar().valueChanged.connect(self.update_visible_range)
+        self.model.rowsInserted.connect(self.update_visible_range)
+        self.model.modelReset.connect(self.update_visible_range)
+        self.clicked.connect(self.on_click)
+
+        self.select_row_flag = False
+
+    def update_visible_range(self):
+        viewport = self.viewport().rect()
+        first = self.indexAt(viewport.topLeft()).row()
+        last = self.indexAt(viewport.bottomLeft()).row()
+        if first < 0:
+            first = 0
+        if last < 0:
+            last = first + viewport.height() // (THUMB_SIZE + 8) + 1
+        self.model.visible_range = (first, last)
+
+    def resizeEvent(self, event):
+        super(FilmStripView, self).resizeEvent(event)
+        self.update_visible_range()
+
+    def select_row(self, row):
+        index = self.model.index(row)
+        if index == self.currentIndex():
+            return
+
+        self.select_row_flag = True
+        try:
+            self.setCurrentIndex(index)
+            self.scrollTo(index)
+        finally:
+            self.select_row_flag = False
+
+    def on_click(self, index):
+        if not self.select_row_flag:
+            self.parent().on_filmstrip_click(index.row())
+
+
+PHASH_PROCESS_COUNT = max(1, min(4, (os.cpu_count() or 2) - 1))
+PHASH_BATCH_TIME = 0.5
+
+
+class PhashIndexer(QThread):
+    # 新算出来的 [(img_name, mtime, phash), ...] 和这次需要计算的总数
+    hashed = Signal(list, int)
+    # {序号: 代表图片序号}
+    indexed = Signal(object)
+
+    def __init__(self, directory, img_name_list, phash_dict, file_stat, parent=None):
+        super(PhashIndexer, self).__init__(parent)
+        self.directory = str(directory)
+        self.img_name_list = img_name_list
+        self.phash_dict = phash_dict
+        # img_name -> (size, mtime_ns), 扫描时已经 stat 过, 不用再逐个 stat
+        self.file_stat = file_stat
+        self.stop_flag = False
+
+    def run(self):
+        start = time.perf_counter()
+        # 修改时间没变的图片直接用库里的哈希, 其余的放到进程池里解码计算
+        phash_list = [None] * len(self.img_name_list)
+        todo_list = []
+        for pos, img_name in enumerate(self.img_name_list):
+            if self.stop_flag:
+                return
+            if img_name in self.file_stat:
+                mtime = self.file_stat[img_name][1]
+            else:
+                try:
+                    mtime = os.stat(os.path.join(self.directory, img_name)).st_mtime_ns
+                except OSError:
+                    continue
+            old = self.phash_dict.get(img_name)
+            if old is not None and old[0] == mtime:
+                phash_list[pos] = old[1]
+            else:
+                todo_list.append((pos, img_name, mtime))
+
+        if todo_list:
+            with multiprocessing.Pool(PHASH_PROCESS_COUNT, initializer=image_hash.init_worker) as pool:
+                batch = []
+                batch_time = time.perf_counter()
+                path_list = [os.path.join(self.directory, img_name) for _, img_name, _ in todo_list]
+                for (pos, img_name, mtime), phash in zip(todo_list, pool.imap(image_hash.phash_worker, path_list, 8)):
+                    if self.stop_flag:
+                        return
+                    phash_list[pos] = phash
+                    batch.append((img_name, mtime, phash))
+                    if time.perf_counter() - batch_time > PHASH_BATCH_TIME:
+                        self.hashed.emit(batch, len(todo_list))
+                        batch = []
+                        batch_time = time.perf_counter()
+                if batch:
+                    self.hashed.emit(batch, len(todo_list))
+
+        if self.stop_flag:
+            return
+        duplicate_of = image_hash.find_duplicates(phash_list)
+        self.indexed.emit(duplicate_of)
+        logging.info(
+            f'phash {len(self.img_name_list)} images in {time.perf_counter() - start:.1f} s, '
+            f'{len(todo_list)} computed, {len(duplicate_of)} duplicates'
+        )
+
+    def stop(self):
+        self.stop_flag = True
+        self.wait()
 
-    def __del__(self):
-        self.conn.close()
 
 class DragButton(QToolButton):
     def __init__(self, parent=None):
@@ -158,7 +1059,7 @@ class DragButton(QToolButton):
                 center_point[1] - self.height() / 2
             ))
             self.__mouseMovePos = globalPos
-            self.parent().update_points()
+            self.parent().update_points(self)
 
     def mouseReleaseEvent(self, event):
         if self.__mousePressPos is not None:
@@ -168,6 +1069,7 @@ class DragButton(QToolButton):
                     background-color: red;
                 ''')
                 event.ignore()
+        self.parent().on_points_release()
 
 
     def resizeEvent(self, event):
@@ -179,12 +1081,21 @@ class ImageLabel(QLabel):
         super(ImageLabel, self).__init__(parent)
 
         self.img_extra_border_size = (5, 5)
-        self.scaled_img = None
-        self.scaled_ratio = None
-        self.scaled_img_rect = None
+        self.pyramid = None
+        # 显示坐标 = 原图坐标 * view_scale + view_offset
+        self.view_scale = None
+        self.view_offset = None
+        self.view_pan_pos = None
         self.img_all_text = None
         self.img_all_text_dict = {}
+        self.img_all_text_index = {}
         self.img_activate_idx = None
+        self.img_activate_points = None
+
+        # 图片和非选中框缓存在背景层里, 拖动时只重绘选中框和橡皮筋矩形所在的区域
+        self.layer_background = None
+        self.layer_inactive_path = None
+        self.stat_frame_time = deque(maxlen=240)
 
         self.mouse_mark_flag = False
         self.mouse_start_pos = None
@@ -194,6 +1105,7 @@ class ImageLabel(QLabel):
         self.btn_point2 = DragButton(self)
         self.btn_point3 = DragButton(self)
         self.btn_point4 = DragButton(self)
+        self.btn_point_list = [self.btn_point1, self.btn_point2, self.btn_point3, self.btn_point4]
 
         self.lineedit_input = QLineEdit(self)
         self.lineedit_input.setFont(QFont('宋体',22))
@@ -207,25 +1119,135 @@ class ImageLabel(QLabel):
         self.btn_point4.setVisible(False)
         self.lineedit_input.setVisible(False)
 
+    def to_view(self, point_list):
+        return geometry.to_view(point_list, self.view_scale, self.view_offset)
+
+    def to_img(self, point_list):
+        return geometry.to_image(point_list, self.view_scale, self.view_offset, (self.pyramid.width, self.pyramid.height))
+
+    def img_view_rect(self):
+        return QRectF(
+            self.view_offset[0],
+            self.view_offset[1],
+            self.pyramid.width * self.view_scale,
+            self.pyramid.height * self.view_scale
+        )
+
+    def fit_view(self):
+        width = self.size().width() - self.img_extra_border_size[1] * 2
+        height = self.size().height() - self.img_extra_border_size[0] * 2
+        scale = min(width / self.pyramid.width, height / self.pyramid.height, 1.0)
+        self.view_scale = scale
+        self.view_offset = (
+            (self.size().width() - self.pyramid.width * scale) / 2,
+            (self.size().height() - self.pyramid.height * scale) / 2,
+        )
+
+    def zoom(self, factor, anchor):
+        fit_scale = min(self.size().width() / self.pyramid.width, self.size().height() / self.pyramid.height, 1.0)
+        scale = min(max(self.view_scale * factor, fit_scale / 2), IMAGE_MAX_ZOOM)
+        factor = scale / self.view_scale
+        self.view_scale = scale
+        self.view_offset = (
+            anchor.x() - (anchor.x() - self.view_offset[0]) * factor,
+            anchor.y() - (anchor.y() - self.view_offset[1]) * factor,
+        )
+        self.update_view()
+
+    def update_view(self):
+        if self.pyramid is None:
+            return
+
+        img_rect = self.img_view_rect()
+        border_range = (
+            (max(img_rect.left(), 0), min(img_rect.right(), self.size().width())),
+            (max(img_rect.top(), 0), min(img_rect.bottom(), self.size().height())),
+        )
+        for btn in self.btn_point_list:
+            btn.border_range = border_range
+
+        if self.img_activate_points is not None:
+            point_list = self.to_view(self.img_activate_points).astype(np.int)
+            for btn, p in zip(self.btn_point_list, point_list):
+                btn.move(QPoint(p[0] - btn.width() // 2, p[1] - btn.height() // 2))
+            self.move_lineedit()
+
+        self.layer_background = None
+        self.update()
+
+    def activate_view_rect(self):
+        if self.pyramid is None or self.img_activate_idx is None:
+            return QRect()
+
+        point_list = self.to_view(self.img_all_text[self.img_all_text_index[self.img_activate_idx]][1])
+        x0, y0, x1, y1 = geometry.bounding_rect(point_list).tolist()
+        return QRect(QPoint(int(x0), int(y0)), QPoint(int(x1) + 1, int(y1) + 1)).adjusted(-2, -2, 2, 2)
+
+    def mark_view_rect(self):
+        if not self.mouse_mark_flag:
+            return QRect()
+        return QRect(self.mouse_start_pos, self.mouse_end_pos).normalized().adjusted(-2, -2, 2, 2)
+
+    def move_lineedit(self):
+        point_list = self.img_all_text[self.img_all_text_index[self.img_activate_idx]][1]
+        x, y = self.to_view(point_list[3:4]).astype(np.int)[0]
+        x = min(max(x, 0), self.size().width() - self.lineedit_input.width())
+        y = min(max(y + 10, 0), self.size().height() - self.lineedit_input.height())
+        self.lineedit_input.move(x, y)
+
+    def wheelEvent(self, event):
+        if self.pyramid is None:
+            return
+
+        self.zoom(1.25 ** (event.angleDelta().y() / 120), event.pos())
+
+    def mouseDoubleClickEvent(self, event):
+        if self.pyramid is None:
+            return
+
+        if event.button() == QtCore.Qt.RightButton:
+            self.fit_view()
+            self.update_view()
+
     def mousePressEvent(self, event):
-        if self.scaled_img is None:
+        if self.pyramid is None:
             return
 
         if event.button() == QtCore.Qt.LeftButton:
             self.mouse_mark_flag = True
             self.mouse_start_pos = event.pos()
             self.mouse_end_pos = event.pos()
-            self.update()
+            self.update(self.mark_view_rect())
+        elif event.button() == QtCore.Qt.RightButton:
+            self.view_pan_pos = event.pos()
 
     def mouseMoveEvent(self, event):
-        if self.scaled_img is None or not self.mouse_mark_flag:
+        if self.pyramid is None:
+            return
+
+        if self.view_pan_pos is not None:
+            diff = event.pos() - self.view_pan_pos
+            self.view_pan_pos = event.pos()
+            self.view_offset = (self.view_offset[0] + diff.x(), self.view_offset[1] + diff.y())
+            self.update_view()
             return
 
+        if not self.mouse_mark_flag:
+            return
+
+        dirty_rect = self.mark_view_rect()
         self.mouse_end_pos = event.pos()
-        self.update()
+        self.update(dirty_rect.united(self.mark_view_rect()))
 
     def mouseReleaseEvent(self, event):
-        if self.scaled_img is None or not self.mouse_mark_flag:
+        if self.pyramid is None:
+            return
+
+        if event.button() == QtCore.Qt.RightButton:
+            self.view_pan_pos = None
+            return
+
+        if not self.mouse_mark_flag:
             return
 
         if event.button() == QtCore.Qt.LeftButton:
@@ -233,9 +1255,17 @@ class ImageLabel(QLabel):
 
             if abs(self.mouse_start_pos.x() - self.mouse_end_pos.x()) < 5 or \
                     abs(self.mouse_start_pos.y() - self.mouse_end_pos.y()) < 5:
+                dirty_rect = self.mark_view_rect()
                 self.mouse_mark_flag = False
                 self.mouse_start_pos = None
                 self.mouse_end_pos = None
+                self.update(dirty_rect)
+
+                # 没有拖出框的单击用来选中图片上已有的框
+                x, y = (np.array([event.pos().x(), event.pos().y()], np.float64) - self.view_offset) / self.view_scale
+                idx = self.parent().hit_test(x, y)
+                if idx is not None and idx != self.img_activate_idx:
+                    self.parent().on_imglabel_select(idx)
                 return
 
             p1 = [self.mouse_start_pos.x(), self.mouse_start_pos.y()]
@@ -244,18 +1274,12 @@ class ImageLabel(QLabel):
             p4 = [p2[0], p1[1]]
             point_list = np.array([p1,p2,p3,p4])
             point_list = order_points(point_list)
-
-            point_list[:, 0] -= self.img_extra_border_size[1]
-            point_list[:, 1] -= self.img_extra_border_size[0]
-            point_list = point_list.astype(np.float)
-            point_list /= self.scaled_ratio
-            point_list = point_list.astype(np.int)
-            point_list += 1
+            point_list = self.to_img(point_list)
 
             self.parent().add_text(point_list)
 
     def on_text_change(self):
-        if self.scaled_img is None:
+        if self.pyramid is None:
             return
 
         if self.img_activate_idx is None:
@@ -263,18 +1287,34 @@ class ImageLabel(QLabel):
 
         new_text = self.lineedit_input.text()
         if self.img_all_text_dict[self.img_activate_idx] != new_text:
+            self.update_text(self.img_activate_idx, new_text)
             self.parent().on_imglabel_text_change(self.img_activate_idx, new_text)
 
-    def show_activate_img(self, img, all_text, activate_idx):
-        self.scaled_img = None
-        self.scaled_ratio = None
-        self.scaled_img_rect = None
+    def update_text(self, idx, img_text):
+        if idx not in self.img_all_text_dict:
+            return
+
+        self.img_all_text_dict[idx] = img_text
+        self.img_all_text[self.img_all_text_index[idx]][2] = img_text
+        if idx == self.img_activate_idx and self.lineedit_input.text() != img_text:
+            self.lineedit_input.setText(img_text)
+
+    def show_activate_img(self, pyramid, all_text, activate_idx):
+        # 同一张图片只是切换选中框时保持当前的缩放和位置
+        keep_view = pyramid is not None and self.pyramid is not None and pyramid.key == self.pyramid.key
+
+        self.pyramid = None
         self.img_all_text = []
         self.img_all_text_dict = {}
+        self.img_all_text_index = {}
         self.img_activate_idx = None
+        self.img_activate_points = None
+        self.layer_background = None
+        self.layer_inactive_path = None
         self.mouse_mark_flag = False
         self.mouse_start_pos = None
         self.mouse_end_pos = None
+        self.view_pan_pos = None
 
         self.btn_point1.setVisible(False)
         self.btn_point2.setVisible(False)
@@ -283,154 +1323,161 @@ class ImageLabel(QLabel):
         self.lineedit_input.setVisible(False)
         self.lineedit_input.clear()
 
-        if img:
-            # scaled_size = QSize(
-            #     self.size().width()-self.img_extra_border_size[1]*2,
-            #     self.size().height()-self.img_extra_border_size[0]*2
-            # )
-            scaled_size = QSize(
-                img.width(),
-                img.height()
-            )
-
-            self.scaled_img = img.scaled(scaled_size, Qt.KeepAspectRatio)
-
-            self.scaled_ratio = self.scaled_img.width() / img.width()
-
-            self.scaled_img_rect = QRect(
-                self.img_extra_border_size[0],
-                self.img_extra_border_size[1],
-                self.scaled_img.width(),
-                self.scaled_img.height()
-            )
-
-            self.mouse_border_range = (
-                (self.scaled_img_rect.x(), self.scaled_img_rect.x()+self.scaled_img_rect.width()),
-                (self.scaled_img_rect.y(), self.scaled_img_rect.y()+self.scaled_img_rect.height()),
-            )
+        if pyramid:
+            self.pyramid = pyramid
+            if not keep_view:
+                self.fit_view()
 
-            self.img_activate_idx = activate_idx
             for idx, point_list, img_text in all_text:
-                point_list = point_list.astype(np.float)
-                point_list *= self.scaled_ratio
-                point_list = point_list.astype(np.int)
-
-                point_list -= self.btn_point1.width() // 2
-                point_list[:, 0] += self.img_extra_border_size[1]
-                point_list[:, 1] += self.img_extra_border_size[0]
-                for p in point_list:
-                    if p[0] < 10:
-                        p[0] = 10
-                    elif p[0] > self.size().width()-10:
-                        p[0] = self.size().width()-10
-
-                    if p[1] < 10:
-                        p[1] = 10
-                    elif p[1] > self.size().height()-10:
-                        p[1] = self.size().height()-10
-
+                self.img_all_text_index[idx] = len(self.img_all_text)
                 self.img_all_text.append([idx, point_list, img_text])
                 self.img_all_text_dict[idx] = img_text
 
                 if activate_idx == idx:
-                    self.btn_point1.move(QPoint(point_list[0, 0], point_list[0, 1]))
-                    self.btn_point2.move(QPoint(point_list[1, 0], point_list[1, 1]))
-                    self.btn_point3.move(QPoint(point_list[2, 0], point_list[2, 1]))
-                    self.btn_point4.move(QPoint(point_list[3, 0], point_list[3, 1]))
+                    self.img_activate_idx = idx
+                    # 拖动按钮各自对应的原图坐标, 拖动一个角时其它角保持原值
+                    self.img_activate_points = point_list.copy()
 
                     self.btn_point1.setVisible(True)
                     self.btn_point2.setVisible(True)
                     self.btn_point3.setVisible(True)
                     self.btn_point4.setVisible(True)
 
-                    self.btn_point1.border_range = (
-                        (self.scaled_img_rect.x(), self.scaled_img_rect.x()+self.scaled_img_rect.width()),
-                        (self.scaled_img_rect.y(), self.scaled_img_rect.y()+self.scaled_img_rect.height()),
-                    )
-                    self.btn_point2.border_range = self.btn_point1.border_range
-                    self.btn_point3.border_range = self.btn_point1.border_range
-                    self.btn_point4.border_range = self.btn_point1.border_range
-
                     self.lineedit_input.setVisible(True)
                     self.lineedit_input.setFocus()
-                    self.lineedit_input.move(self.btn_point4.pos().x(), self.btn_point4.pos().y()+10)
                     self.lineedit_input.setText(img_text)
 
-        self.repaint()
+            self.update_view()
+
+        self.update()
 
-    def update_points(self):
-        if self.img_activate_idx is None or self.scaled_img is None:
+    def update_points(self, btn=None):
+        if self.img_activate_idx is None or self.pyramid is None:
             return
 
-        pos1 = self.btn_point1.pos()
-        pos2 = self.btn_point2.pos()
-        pos3 = self.btn_point3.pos()
-        pos4 = self.btn_point4.pos()
-        point_list = np.array([(pos1.x(), pos1.y()),
-                               (pos2.x(), pos2.y()),
-                               (pos3.x(), pos3.y()),
-                               (pos4.x(), pos4.y())])
-        point_list = order_points(point_list)
+        dirty_rect = self.activate_view_rect()
+        if btn is not None:
+            pos = btn.pos()
+            center = np.array([(pos.x() + btn.width() // 2, pos.y() + btn.height() // 2)])
+            self.img_activate_points[self.btn_point_list.index(btn)] = self.to_img(center)[0]
+
+        point_list = order_points(self.img_activate_points)
+        self.img_all_text[self.img_all_text_index[self.img_activate_idx]][1] = point_list
+        self.move_lineedit()
+
+        self.parent().update_points(self.img_activate_idx, point_list.copy())
+        self.update(dirty_rect.united(self.activate_view_rect()))
 
-        self.lineedit_input.move(point_list[3][0], point_list[3][1]+10)
+    def on_points_release(self):
+        self.parent().flush_label()
 
-        for idx, (id, _, _) in enumerate(self.img_all_text):
-            if id != self.img_activate_idx:
+        stats = self.frame_stats()
+        if stats:
+            logging.info(
+                f'paint frame time avg {stats["avg"] * 1000:.2f} ms, p95 {stats["p95"] * 1000:.2f} ms, '
+                f'max {stats["max"] * 1000:.2f} ms over last {stats["count"]} frames'
+            )
+
+    def on_tile_loaded(self, key):
+        if self.pyramid is not None and key[:2] == self.pyramid.key:
+            self.layer_background = None
+            self.update()
+
+    def frame_stats(self):
+        frame_time = sorted(self.stat_frame_time)
+        if not frame_time:
+            return {}
+
+        return {
+            'count': len(frame_time),
+            'avg': sum(frame_time) / len(frame_time),
+            'p95': frame_time[int(len(frame_time) * 0.95)],
+            'max': frame_time[-1],
+        }
+
+    def draw_img(self, painter):
+        pyramid = self.pyramid
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.view_scale < 1)
+        painter.drawPixmap(self.img_view_rect(), pyramid.overview, QRectF(pyramid.overview.rect()))
+
+        level = pyramid.level_for_scale(self.view_scale)
+        if level >= pyramid.overview_level:
+            return
+
+        # 放大后概览图不够清晰, 只解码和绘制可见区域的瓦片, 没解码完的先用概览图顶替
+        x0 = -self.view_offset[0] / self.view_scale
+        y0 = -self.view_offset[1] / self.view_scale
+        x1 = x0 + self.size().width() / self.view_scale
+        y1 = y0 + self.size().height() / self.view_scale
+
+        image_loader = self.parent().image_loader
+        missing_key_list = []
+        for key, img_rect in pyramid.visible_tiles(level, x0, y0, x1, y1):
+            tile = image_loader.get_tile(key)
+            if tile is None:
+                missing_key_list.append(key)
                 continue
-            self.img_all_text[idx][1] = point_list
-            break
 
-        point_list = deepcopy(point_list)
-        point_list[:, 0] -= self.img_extra_border_size[1]
-        point_list[:, 1] -= self.img_extra_border_size[0]
-        point_list += self.btn_point1.width() // 2
-        point_list = point_list.astype(np.float)
-        point_list /= self.scaled_ratio
-        point_list = point_list.astype(np.int)
-        point_list += 1
+            view_rect = QRectF(
+                img_rect.x() * self.view_scale + self.view_offset[0],
+                img_rect.y() * self.view_scale + self.view_offset[1],
+                img_rect.width() * self.view_scale,
+                img_rect.height() * self.view_scale
+            )
+            painter.drawPixmap(view_rect, tile, QRectF(tile.rect()))
+        image_loader.request_tiles(missing_key_list)
+
+    def build_inactive_path(self):
+        path = QPainterPath()
+        for idx, point_list, img_text in self.img_all_text:
+            if idx == self.img_activate_idx:
+                continue
+            path.addPolygon(QPolygonF([QPointF(x, y) for x, y in point_list.tolist()]))
+            path.closeSubpath()
+        return path
+
+    def build_background(self):
+        background = QPixmap(self.size())
+        background.fill(QColor(190, 190, 190, 255))
+
+        if self.pyramid:
+            painter = QPainter()
+            painter.begin(background)
+            self.draw_img(painter)
+
+            # 非选中框按原图坐标合成一条路径, 缩放平移只需改变换矩阵
+            if self.layer_inactive_path is None:
+                self.layer_inactive_path = self.build_inactive_path()
+            pen = QPen(Qt.green, 1)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.setTransform(QTransform(
+                self.view_scale, 0, 0, self.view_scale, self.view_offset[0], self.view_offset[1]
+            ))
+            painter.drawPath(self.layer_inactive_path)
+            painter.end()
+
+        return background
 
-        self.parent().update_points(self.img_activate_idx, point_list)
-        self.repaint()
+    def resizeEvent(self, event):
+        self.layer_background = None
+        super(ImageLabel, self).resizeEvent(event)
 
+    @perf.timed('paintEvent')
     def paintEvent(self, event):
+        start = time.perf_counter()
+
+        if self.layer_background is None:
+            self.layer_background = self.build_background()
+
         painter = QPainter()
         painter.begin(self)
-        painter.setPen(Qt.NoPen)
-        painter.fillRect(self.rect(), QColor(190, 190, 190, 255))
+        painter.drawPixmap(event.rect(), self.layer_background, event.rect())
 
-        if self.scaled_img:
-            painter.drawPixmap(self.scaled_img_rect, self.scaled_img)
-
-            for idx, point_list, img_text in self.img_all_text:
-                point_list = point_list + self.btn_point1.width() // 2
-                if idx == self.img_activate_idx:
-                    painter.setPen(QPen(Qt.red, 1))
-                else:
-                    painter.setPen(QPen(Qt.green, 1))
-                painter.drawLine(
-                    point_list[0, 0],
-                    point_list[0, 1],
-                    point_list[1, 0],
-                    point_list[1, 1]
-                )
-                painter.drawLine(
-                    point_list[1, 0],
-                    point_list[1, 1],
-                    point_list[2, 0],
-                    point_list[2, 1]
-                )
-                painter.drawLine(
-                    point_list[2, 0],
-                    point_list[2, 1],
-                    point_list[3, 0],
-                    point_list[3, 1]
-                )
-                painter.drawLine(
-                    point_list[3, 0],
-                    point_list[3, 1],
-                    point_list[0, 0],
-                    point_list[0, 1]
-                )
+        if self.pyramid and self.img_activate_idx is not None:
+            point_list = self.to_view(self.img_all_text[self.img_all_text_index[self.img_activate_idx]][1])
+            painter.setPen(QPen(Qt.red, 1))
+            painter.drawPolygon(QPolygon([QPoint(x, y) for x, y in point_list.astype(np.int).tolist()]))
 
         if self.mouse_mark_flag:
             painter.setPen(QPen(Qt.red, 1))
@@ -438,50 +1485,144 @@ class ImageLabel(QLabel):
 
         painter.end()
 
+        self.stat_frame_time.append(time.perf_counter() - start)
+
+
+class TextTableModel(QAbstractTableModel):
+    text_edited = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super(TextTableModel, self).__init__(parent)
+
+        # 按 id 升序排列, 新加的框 id 最大, 一般追加在末尾
+        self.ids = array('q')
+        self.texts = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return ['文本', '编号'][section]
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == 0:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+
+        if index.column() == 0:
+            return self.texts[index.row()]
+        return str(self.ids[index.row()])
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or index.column() != 0 or role != Qt.EditRole:
+            return False
+
+        row = index.row()
+        if self.texts[row] != value:
+            self.texts[row] = value
+            self.dataChanged.emit(index, index)
+            self.text_edited.emit(self.ids[row], value)
+        return True
+
+    def row_of(self, idx):
+        row = bisect_left(self.ids, idx)
+        if row < len(self.ids) and self.ids[row] == idx:
+            return row
+        return None
+
+    def set_all_text(self, all_text):
+        self.beginResetModel()
+        self.ids = array('q', [idx for idx, _, _ in all_text])
+        self.texts = [img_text for _, _, img_text in all_text]
+        self.endResetModel()
+
+    def insert_text(self, idx, img_text):
+        row = bisect_left(self.ids, idx)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.ids.insert(row, idx)
+        self.texts.insert(row, img_text)
+        self.endInsertRows()
+
+    def remove_text(self, idx):
+        row = self.row_of(idx)
+        if row is None:
+            return
+
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.ids[row]
+        del self.texts[row]
+        self.endRemoveRows()
+
+    def set_text(self, idx, img_text):
+        row = self.row_of(idx)
+        if row is None or self.texts[row] == img_text:
+            return
+
+        self.texts[row] = img_text
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index)
+
 
 class TextTableView(QTableView):
     def __init__(self, parent):
         super(TextTableView, self).__init__(parent)
 
-        self.model = QStandardItemModel(self)
-        self.proxy = QSortFilterProxyModel()
-        self.proxy.setSourceModel(self.model)
-        self.setModel(self.proxy)
+        self.model = TextTableModel(self)
+        self.setModel(self.model)
 
-        self.selectionModel().selectionChanged.connect(self.on_select_change)
-        self.model.dataChanged.connect(self.on_text_change)
+        self.setAutoScroll(True)
+        self.setColumnWidth(0, 300)
+        self.setColumnWidth(1, 0)
+        self.setSelectionMode(QTableView.SingleSelection)
 
-        self.all_text_dict = {}
+        self.selectionModel().selectionChanged.connect(self.on_select_change)
+        self.model.text_edited.connect(self.on_text_change)
 
         self.show_activate_img_flag = False
 
+    @perf.timed('table_refresh')
     def show_activate_img(self, all_text, activate_idx):
         self.show_activate_img_flag = True
         try:
-            self.all_text_dict = {}
-            self.model.clear()
-            self.model.setHorizontalHeaderLabels(['文本', '编号'])
-
-            self.setAutoScroll(True)
+            self.model.set_all_text(all_text)
             self.setColumnWidth(0, 300)
             self.setColumnWidth(1, 0)
-            self.setSelectionMode(QTableView.SingleSelection)
-            for col_id, (idx, point_list, img_text) in enumerate(all_text):
-                self.all_text_dict[idx] = img_text
+        finally:
+            self.show_activate_img_flag = False
 
-                it1 = QStandardItem(img_text)
-                it1.setEditable(True)
-                self.model.setItem(col_id, 0, it1)
+        self.select_text(activate_idx)
 
-                it2 = QStandardItem(str(idx))
-                it2.setEditable(False)
-                self.model.setItem(col_id, 1, it2)
+    def select_text(self, idx):
+        row = self.model.row_of(idx) if idx is not None else None
 
-                if activate_idx == idx:
-                    self.selectionModel().select(
-                        self.model.index(col_id, 0),
-                        QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows
-                    )
+        self.show_activate_img_flag = True
+        try:
+            if row is None:
+                self.selectionModel().clearSelection()
+                return
+
+            self.selectionModel().select(
+                self.model.index(row, 0),
+                QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows
+            )
+            self.scrollTo(self.model.index(row, 0))
+        finally:
+            self.show_activate_img_flag = False
+
+    def insert_text(self, idx, img_text):
+        self.show_activate_img_flag = True
+        try:
+            self.model.insert_text(idx, img_text)
         finally:
             self.show_activate_img_flag = False
 
@@ -493,40 +1634,128 @@ class TextTableView(QTableView):
         if not select_row_indexs:
             return
 
-        row_index = select_row_indexs[0]
-        row = row_index.row()
-        activate_idx = row_index.sibling(row, 1).data()
-        self.parent().on_activate_idx_change(int(activate_idx))
+        row = select_row_indexs[0].row()
+        self.parent().on_activate_idx_change(self.model.ids[row])
 
     def remove_selected_row(self):
         select_row_indexs = self.selectionModel().selectedIndexes()
         if not select_row_indexs:
             return None
 
-        row_index = select_row_indexs[0]
-        row = row_index.row()
-        img_idx = row_index.sibling(row, 1).data()
-        self.model.removeRow(row)
-        return int(img_idx)
-
-    def on_text_change(self, idx1, idx2):
-        row = idx1.row()
-        new_text = idx1.sibling(row, 0).data()
-        activate_idx = idx1.sibling(row, 1).data()
-        if activate_idx is not None:
-            activate_idx = int(activate_idx)
-            if self.all_text_dict[activate_idx] != new_text:
-                self.parent().on_tableview_text_change(activate_idx, new_text)
+        img_idx = self.model.ids[select_row_indexs[0].row()]
+        self.show_activate_img_flag = True
+        try:
+            self.model.remove_text(img_idx)
+        finally:
+            self.show_activate_img_flag = False
+        return img_idx
+
+    def update_text(self, idx, img_text):
+        self.model.set_text(idx, img_text)
 
-class MainWindow(QWidget):
+    def on_text_change(self, activate_idx, new_text):
+        self.parent().on_tableview_text_change(activate_idx, new_text)
+
+class SearchResultModel(QAbstractTableModel):
     def __init__(self, parent=None):
+        super(SearchResultModel, self).__init__(parent)
+        self.img_names = []
+        self.ids = array('q')
+        self.texts = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return ['文本', '图片'][section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+
+        if index.column() == 0:
+            return self.texts[index.row()]
+        return self.img_names[index.row()]
+
+    def clear(self):
+        self.beginResetModel()
+        self.img_names = []
+        self.ids = array('q')
+        self.texts = []
+        self.endResetModel()
+
+    def append_rows(self, row_list):
+        row = len(self.ids)
+        self.beginInsertRows(QModelIndex(), row, row + len(row_list) - 1)
+        for img_name, idx, img_text in row_list:
+            self.img_names.append(img_name)
+            self.ids.append(idx)
+            self.texts.append(img_text)
+        self.endInsertRows()
+
+
+DB_SYNC_INTERVAL = 1000
+SEARCH_CHUNK_INTERVAL = 0
+COPY_NEXT_COUNT = 10
+COPY_SHIFT_SIDE = 256
+COPY_SHIFT_MIN_SCORE = 10
+STATE_FILE = Path.home().joinpath('.text_label_tool', 'state.json')
+
+
+def load_state():
+    try:
+        with open(str(STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except:
+        logging.exception('load_state exception')
+        return {}
+
+
+def save_state(state):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = f'{STATE_FILE}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_file, str(STATE_FILE))
+
+
+def read_small_gray(img_path, side=COPY_SHIFT_SIDE):
+    # 解码时直接缩小到长边 side 的灰度图, 估计平移用; 返回 (灰度图, 原图大小), 读不出来返回 (None, None)
+    reader = QImageReader(str(img_path))
+    size = reader.size()
+    if not size.isValid():
+        return None, None
+    img_size = (size.width(), size.height())
+    scale = min(1, side / max(img_size))
+    reader.setScaledSize(QSize(max(1, int(img_size[0] * scale)), max(1, int(img_size[1] * scale))))
+    img = reader.read()
+    if img.isNull():
+        return None, img_size
+
+    img = img.convertToFormat(QImage.Format_Grayscale8)
+    width, height, stride = img.width(), img.height(), img.bytesPerLine()
+    gray = np.frombuffer(img.constBits(), dtype=np.uint8, count=stride * height).reshape((height, stride))
+    return gray[:, :width].copy(), img_size
+
+
+class MainWindow(QWidget):
+    def __init__(self, parent=None, project_file=None, concurrent=False):
         QtWidgets.QWidget.__init__(self, parent)
 
         # 界面配置
         self.setWindowTitle('文字识别标注工具')
-        self.setFixedSize(1200, 800)
+        self.setFixedSize(1200 + THUMB_SIZE + 30, 800)
         self.move_to_center()
 
+        self.filmstrip = FilmStripView(self)
+
         #
         self.label_img = ImageLabel(self)
         self.label_img.setAlignment(Qt.AlignCenter)
@@ -552,6 +1781,23 @@ class MainWindow(QWidget):
         self.label_status_running2.setText('张')
         self.label_status_running2.hide()
 
+        # 打开性能统计时在状态栏显示主要操作的 p95 耗时
+        self.label_status_progress = QLabel(self)
+        self.label_status_progress.setAlignment(Qt.AlignRight)
+
+        self.label_status_lease = QLabel(self)
+        self.label_status_lease.setAlignment(Qt.AlignRight)
+        self.label_status_lease.setStyleSheet('color: red;')
+        self.label_status_lease.hide()
+
+        self.label_status_perf = QLabel(self)
+        self.label_status_perf.setAlignment(Qt.AlignRight)
+        self.label_status_perf.setVisible(perf.enabled)
+        self.timer_perf = QTimer(self)
+        self.timer_perf.setInterval(1000)
+        self.timer_perf.timeout.connect(self.update_perf_status)
+        if perf.enabled:
+            self.timer_perf.start()
 
         self.btn_select_dir = QPushButton(self)
         self.btn_select_dir.setText('选择目录...')
@@ -575,6 +1821,19 @@ class MainWindow(QWidget):
             self.btn_next_img.click
         )
 
+        self.btn_next_unlabeled = QPushButton(self)
+        self.btn_next_unlabeled.setText('下一张未标注')
+        self.btn_next_unlabeled.clicked.connect(self.on_next_unlabeled)
+        self.connect(
+            QShortcut(QKeySequence(Qt.CTRL + Qt.Key_Right), self),
+            QtCore.SIGNAL('activated()'),
+            self.btn_next_unlabeled.click
+        )
+
+        self.btn_next_empty_text = QPushButton(self)
+        self.btn_next_empty_text.setText('下一张空文本')
+        self.btn_next_empty_text.clicked.connect(self.on_next_empty_text)
+
         self.btn_del_text = QPushButton(self)
         self.btn_del_text.setText('删除')
         self.btn_del_text.clicked.connect(self.on_del_text)
@@ -588,12 +1847,82 @@ class MainWindow(QWidget):
             self.btn_nonactivate.click
         )
 
+        # 视频抽帧这类连续相似的图片, 直接沿用前一张的框和文本
+        self.btn_copy_prev = QPushButton(self)
+        self.btn_copy_prev.setText('沿用上一张')
+        self.btn_copy_prev.clicked.connect(self.on_copy_prev)
+        self.connect(
+            QShortcut(QKeySequence(Qt.CTRL + Qt.Key_D), self),
+            QtCore.SIGNAL('activated()'),
+            self.btn_copy_prev.click
+        )
+
+        self.btn_copy_next = QPushButton(self)
+        self.btn_copy_next.setText('复制到后面')
+        self.btn_copy_next.clicked.connect(self.on_copy_next)
+
+        self.spinbox_copy_count = QSpinBox(self)
+        self.spinbox_copy_count.setRange(1, 1000)
+        self.spinbox_copy_count.setValue(COPY_NEXT_COUNT)
+        self.spinbox_copy_count.setSuffix(' 张')
+
+        self.checkbox_copy_shift = QCheckBox(self)
+        self.checkbox_copy_shift.setText('跟随平移')
+        self.checkbox_copy_shift.setChecked(True)
+
+        # 扫描完成后在后台计算感知哈希找出重复图片, 翻页时可以跳过, 也可以把标注批量复制过去
+        self.checkbox_skip_duplicate = QCheckBox(self)
+        self.checkbox_skip_duplicate.setText('跳过重复图片')
+
+        self.btn_copy_duplicate = QPushButton(self)
+        self.btn_copy_duplicate.setText('复制到重复图片')
+        self.btn_copy_duplicate.clicked.connect(self.on_copy_duplicate)
+
         self.tableview_text = TextTableView(self)
 
+        # 全文搜索和批量替换
+        self.lineedit_search = QLineEdit(self)
+        self.lineedit_search.setPlaceholderText('搜索文本')
+        self.lineedit_search.returnPressed.connect(self.on_search)
+        self.connect(
+            QShortcut(QKeySequence(Qt.CTRL + Qt.Key_F), self),
+            QtCore.SIGNAL('activated()'),
+            self.lineedit_search.setFocus
+        )
+
+        self.btn_search = QPushButton(self)
+        self.btn_search.setText('搜索')
+        self.btn_search.clicked.connect(self.on_search)
+
+        self.lineedit_replace = QLineEdit(self)
+        self.lineedit_replace.setPlaceholderText('替换为')
+
+        self.btn_replace = QPushButton(self)
+        self.btn_replace.setText('全部替换')
+        self.btn_replace.clicked.connect(self.on_replace)
+
+        self.search_model = SearchResultModel(self)
+        self.tableview_search = QTableView(self)
+        self.tableview_search.setModel(self.search_model)
+        self.tableview_search.setSelectionMode(QTableView.SingleSelection)
+        self.tableview_search.setSelectionBehavior(QTableView.SelectRows)
+        self.tableview_search.setColumnWidth(0, 200)
+        self.tableview_search.clicked.connect(self.on_search_result_click)
+
+        self.label_search_status = QLabel(self)
+
+        # 搜索结果分块读取, 每读一块回到事件循环一次, 界面不会卡住
+        self.search_iter = None
+        self.search_start_time = 0
+        self.timer_search = QTimer(self)
+        self.timer_search.setInterval(SEARCH_CHUNK_INTERVAL)
+        self.timer_search.timeout.connect(self.on_search_chunk)
+
         # 布局
         layout_root = QHBoxLayout()
         layout_col1 = QVBoxLayout()
         layout_col2 = QVBoxLayout()
+        layout_root.addWidget(self.filmstrip)
         layout_root.addLayout(layout_col1)
         layout_root.addLayout(layout_col2)
 
@@ -604,6 +1933,10 @@ class MainWindow(QWidget):
         layout_col1_row2.addWidget(self.label_status_running1, 0, Qt.AlignRight)
         layout_col1_row2.addWidget(self.label_status_page_number, 0, Qt.AlignRight)
         layout_col1_row2.addWidget(self.label_status_running2, 0, Qt.AlignRight)
+        layout_col1_row2.addStretch(1)
+        layout_col1_row2.addWidget(self.label_status_progress, 0, Qt.AlignRight)
+        layout_col1_row2.addWidget(self.label_status_lease, 0, Qt.AlignRight)
+        layout_col1_row2.addWidget(self.label_status_perf, 0, Qt.AlignRight)
 
         layout_col1.addLayout(layout_col1_row2)
 
@@ -614,24 +1947,167 @@ class MainWindow(QWidget):
         layout_col2_row2.addWidget(self.btn_prev_img)
         layout_col2_row2.addWidget(self.btn_next_img)
 
+        layout_col2_row2_next = QHBoxLayout()
+        layout_col2_row2_next.addWidget(self.btn_next_unlabeled)
+        layout_col2_row2_next.addWidget(self.btn_next_empty_text)
+
         layout_col2_row3 = QHBoxLayout()
         layout_col2_row3.addWidget(self.btn_del_text)
         layout_col2_row3.addWidget(self.btn_nonactivate)
 
         layout_col2.addLayout(layout_col2_row1)
         layout_col2.addLayout(layout_col2_row2)
+        layout_col2.addLayout(layout_col2_row2_next)
+        layout_col2_row_copy = QHBoxLayout()
+        layout_col2_row_copy.addWidget(self.btn_copy_prev)
+        layout_col2_row_copy.addWidget(self.btn_copy_next)
+        layout_col2_row_copy.addWidget(self.spinbox_copy_count)
+        layout_col2_row_copy.addWidget(self.checkbox_copy_shift)
+
+        layout_col2_row_duplicate = QHBoxLayout()
+        layout_col2_row_duplicate.addWidget(self.checkbox_skip_duplicate)
+        layout_col2_row_duplicate.addWidget(self.btn_copy_duplicate)
+
         layout_col2.addLayout(layout_col2_row3)
-        layout_col2.addWidget(self.tableview_text)
+        layout_col2.addLayout(layout_col2_row_copy)
+        layout_col2.addLayout(layout_col2_row_duplicate)
+        layout_col2.addWidget(self.tableview_text, 3)
+
+        layout_col2_row_search = QHBoxLayout()
+        layout_col2_row_search.addWidget(self.lineedit_search)
+        layout_col2_row_search.addWidget(self.btn_search)
+
+        layout_col2_row_replace = QHBoxLayout()
+        layout_col2_row_replace.addWidget(self.lineedit_replace)
+        layout_col2_row_replace.addWidget(self.btn_replace)
+
+        layout_col2.addLayout(layout_col2_row_search)
+        layout_col2.addLayout(layout_col2_row_replace)
+        layout_col2.addWidget(self.label_search_status)
+        layout_col2.addWidget(self.tableview_search, 2)
 
         self.setLayout(layout_root)
 
         self.directory = None
+        # 指定了工程库时所有目录的标注都写到这一个库里, 否则每个目录一个 label.sqllite3
+        self.project_file = project_file
+        # 多人同时标注同一个库
+        self.concurrent = concurrent
+        self.lease_img_name = None
+        self.lease_time = 0
         self.all_img_file = []
         self.all_img_file_index = 0
+        # img_name -> (size, mtime_ns), 来自目录扫描
+        self.img_file_stat = {}
+        self.img_scanner = None
+        self.restore_img_name = None
+        self.phash_indexer = None
+        self.phash_done_count = 0
+        self.phash_todo_count = 0
+        self.duplicate_of = {}
         self.db_label = None
+        self.label_repo = None
+        self.label_progress = None
+        self.progress_img_name = None
+        self.image_loader = ImageLoader(self, self.label_img.size())
+        self.image_loader.loaded.connect(self.on_image_loaded)
+        self.image_loader.tile_loaded.connect(self.label_img.on_tile_loaded)
+        self.img_load_generation = None
+        self.img_load_activate_idx = None
+
+        # 定时把延迟写入的修改落盘
+        self.timer_flush = QTimer(self)
+        self.timer_flush.setInterval(2000)
+        self.timer_flush.timeout.connect(self.flush_label)
+        self.timer_flush.start()
+
+        # 多人模式下定时检查别人的提交, 并续期当前图片的租约
+        self.timer_sync = QTimer(self)
+        self.timer_sync.setInterval(DB_SYNC_INTERVAL)
+        self.timer_sync.timeout.connect(self.on_sync_timer)
+        if self.concurrent:
+            self.timer_sync.start()
 
         self.update_btn_status()
 
+    def update_perf_status(self):
+        summary = perf.summary()
+        text_list = []
+        for name, title in [('show_img', '显示'), ('image_decode', '解码'), ('paintEvent', '绘制'), ('db.flush', '写库')]:
+            if name in summary:
+                text_list.append(f'{title} p95 {summary[name]["p95"] * 1000:.0f}ms')
+        self.label_status_perf.setText(' | '.join(text_list))
+
+    def closeEvent(self, event):
+        self.close_directory()
+        super(MainWindow, self).closeEvent(event)
+
+    def flush_label(self):
+        if self.label_repo is None:
+            return
+
+        try:
+            self.label_repo.flush()
+        except:
+            logging.exception('flush_label exception')
+
+        if self.concurrent:
+            self.on_write_conflict()
+
+    def on_write_conflict(self):
+        # 自己的修改因为别人先改了而被放弃, 重新读这些图片
+        conflict_list = self.db_label.pop_conflicts()
+        if not conflict_list:
+            return
+
+        img_name_set = {img_name for img_name, _ in conflict_list}
+        for img_name in img_name_set:
+            self.label_repo.invalidate(img_name)
+        self.label_status_lease.setText(f'{len(conflict_list)} 个框已被其他人修改, 你的修改没有保存')
+        self.label_status_lease.show()
+        if self.all_img_file and self.all_img_file[self.all_img_file_index] in img_name_set:
+            self.update_progress(self.all_img_file[self.all_img_file_index])
+            self.show_img(self.label_img.img_activate_idx)
+
+    def update_lease(self, img_name):
+        try:
+            if self.lease_img_name is not None and self.lease_img_name != img_name:
+                self.db_label.release_lease(self.lease_img_name)
+            self.lease_img_name = img_name
+            self.lease_time = time.time()
+            owner = self.db_label.acquire_lease(img_name)
+        except:
+            logging.exception('update_lease exception')
+            return
+
+        if owner:
+            self.label_status_lease.setText(f'{owner} 正在标注这张图片')
+            self.label_status_lease.show()
+        else:
+            self.label_status_lease.hide()
+
+    def on_sync_timer(self):
+        # 拖动或画框时不刷新, 等松开鼠标后的下一次检查
+        if self.label_repo is None or not self.all_img_file or QApplication.mouseButtons() != Qt.NoButton:
+            return
+
+        try:
+            img_name = self.all_img_file[self.all_img_file_index]
+            if time.time() - self.lease_time > label_db.DB_LEASE_SECONDS / 3:
+                self.update_lease(img_name)
+
+            if not self.db_label.data_changed():
+                return
+
+            self.flush_label()
+            if self.label_repo.sync(img_name):
+                logging.info(f'{img_name} modified by others, reload')
+                self.update_progress(img_name)
+                self.show_img(self.label_img.img_activate_idx)
+                self.update_btn_status()
+        except:
+            logging.exception('on_sync_timer exception')
+
     def move_to_center(self):
         screen = QDesktopWidget().screenGeometry()
         size = self.geometry()
@@ -642,13 +2118,22 @@ class MainWindow(QWidget):
             self.label_status_page_number.setEnabled(False)
             self.btn_prev_img.setEnabled(False)
             self.btn_next_img.setEnabled(False)
+            self.btn_next_unlabeled.setEnabled(False)
+            self.btn_next_empty_text.setEnabled(False)
+            self.btn_search.setEnabled(self.label_repo is not None)
+            self.btn_replace.setEnabled(self.label_repo is not None)
             self.btn_del_text.setEnabled(False)
             self.btn_nonactivate.setEnabled(False)
+            self.btn_copy_prev.setEnabled(False)
+            self.btn_copy_next.setEnabled(False)
+            self.checkbox_skip_duplicate.setEnabled(bool(self.duplicate_of))
+            self.btn_copy_duplicate.setEnabled(bool(self.duplicate_of))
 
             if not self.all_img_file:
                 self.label_status_running1.setText('请选择需要标注的目录')
                 self.label_status_page_number.hide()
                 self.label_status_running2.hide()
+                self.label_status_progress.hide()
             else:
                 img_name = self.all_img_file[self.all_img_file_index]
 
@@ -656,7 +2141,12 @@ class MainWindow(QWidget):
                 self.label_status_running2.show()
                 self.label_status_page_number_validator.setRange(1, len(self.all_img_file))
                 self.label_status_page_number.setText(f'{self.all_img_file_index+1}')
-                self.label_status_running1.setText( f'当前图片: {img_name} ({self.all_img_file_index + 1}/{len(self.all_img_file)}) 跳转到')
+                scan_text = ' 扫描中...' if self.img_scanner is not None else ''
+                if self.phash_indexer is not None and self.phash_todo_count:
+                    scan_text += f' 查重中 {self.phash_done_count}/{self.phash_todo_count}...'
+                elif self.phash_indexer is not None:
+                    scan_text += ' 查重中...'
+                self.label_status_running1.setText( f'当前图片: {img_name} ({self.all_img_file_index + 1}/{len(self.all_img_file)}{scan_text}) 跳转到')
                 self.label_status_running2.setText(f'张')
                 self.label_status_page_number.setEnabled(True)
 
@@ -670,22 +2160,125 @@ class MainWindow(QWidget):
                 else:
                     self.btn_next_img.setEnabled(True)
 
+                self.update_progress_status()
+                self.label_status_progress.show()
+                self.filmstrip.select_row(self.all_img_file_index)
+
                 self.btn_del_text.setEnabled(True)
                 self.btn_nonactivate.setEnabled(True)
+                self.btn_copy_prev.setEnabled(self.all_img_file_index > 0)
+                self.btn_copy_next.setEnabled(self.all_img_file_index < len(self.all_img_file) - 1)
         except:
             logging.exception('update_btn_status exception')
 
     def on_select_diectory(self):
         try:
-            self.all_img_file = []
-            self.all_img_file_index = 0
-            self.db_label = None
-            self.label_img.show_activate_img(None, [], None)
+            self.close_directory()
+            directory = QFileDialog.getExistingDirectory(self, '选择目录')
+            if directory:
+                self.open_directory(directory)
+        finally:
+            self.update_btn_status()
 
-            self.directory = QFileDialog.getExistingDirectory(self, '选择目录')
-            self.setWindowTitle(f'文字识别标注工具: {self.directory}')
+    def restore_state(self):
+        # 启动时重新打开上次的目录和图片, 工程库不同时不恢复
+        try:
+            state = load_state()
+            directory = state.get('directory')
+            if not directory or state.get('project_file') != self.project_file or not os.path.isdir(directory):
+                return
+            self.open_directory(directory, state.get('img_name'))
+        except:
+            logging.exception('restore_state exception')
+        finally:
+            self.update_btn_status()
 
-            self.get_all_img_file()
+    def open_directory(self, directory, restore_img_name=None):
+        self.directory = directory
+        self.setWindowTitle(f'文字识别标注工具: {self.directory}')
+        # 扫描到这张图片时跳过去
+        self.restore_img_name = restore_img_name
+        self.read_label_file()
+        self.get_all_img_file()
+
+    def close_directory(self):
+        if self.all_img_file:
+            try:
+                save_state({
+                    'directory': self.directory,
+                    'img_name': self.all_img_file[self.all_img_file_index],
+                    'project_file': self.project_file,
+                })
+            except:
+                logging.exception('save_state exception')
+
+        self.flush_label()
+        self.stop_scan()
+        self.stop_phash()
+        self.duplicate_of = {}
+        self.all_img_file = []
+        self.all_img_file_index = 0
+        self.img_file_stat = {}
+        self.stop_search()
+        self.search_model.clear()
+        self.label_search_status.clear()
+        self.filmstrip.model.reset(None, None)
+        if self.db_label is not None:
+            # 显式关闭: 延迟写入的修改写进库, 释放自己占用的图片, 不等垃圾回收
+            try:
+                self.db_label.close()
+            except:
+                logging.exception('close_directory exception')
+        self.db_label = None
+        self.label_repo = None
+        self.label_progress = None
+        self.progress_img_name = None
+        self.lease_img_name = None
+        self.label_status_lease.hide()
+        self.image_loader.clear()
+        self.img_load_generation = None
+        self.label_img.show_activate_img(None, [], None)
+
+    def get_all_img_file(self):
+        # 后台递归扫描, 找到第一张图片就显示, 剩下的陆续追加到 all_img_file
+        self.all_img_file_index = 0
+        self.all_img_file = []
+        self.img_file_stat = {}
+        self.img_scanner = ImageScanner(self.directory, self)
+        self.img_scanner.found.connect(self.on_scan_found)
+        self.img_scanner.finished.connect(self.on_scan_finished)
+        self.img_scanner.start()
+
+    def stop_scan(self):
+        if self.img_scanner is None:
+            return
+
+        self.img_scanner.found.disconnect(self.on_scan_found)
+        self.img_scanner.finished.disconnect(self.on_scan_finished)
+        self.img_scanner.stop()
+        self.img_scanner = None
+
+    def on_scan_found(self, img_name_list, stat_list):
+        try:
+            self.img_file_stat.update(zip(img_name_list, stat_list))
+            show_first = not self.all_img_file
+            if self.restore_img_name in img_name_list:
+                self.all_img_file_index = len(self.all_img_file) + img_name_list.index(self.restore_img_name)
+                self.restore_img_name = None
+                show_first = True
+            self.all_img_file.extend(img_name_list)
+            self.label_progress.extend(img_name_list)
+            self.filmstrip.model.extend(img_name_list)
+            if show_first:
+                self.flush_label()
+                self.show_img()
+        finally:
+            self.update_btn_status()
+
+    def on_scan_finished(self):
+        try:
+            self.img_scanner = None
+            self.restore_img_name = None
             if len(self.all_img_file) <= 0:
                 QMessageBox.information(
                     self,
@@ -693,38 +2286,97 @@ class MainWindow(QWidget):
                     f'{self.directory}\n目录下没有找到图片文件',
                     QMessageBox.Ok
                 )
-                return
+            else:
+                self.start_phash()
+        finally:
+            self.update_btn_status()
 
-            self.read_label_file()
-            self.show_img()
+    def start_phash(self):
+        self.phash_done_count = 0
+        self.phash_todo_count = 0
+        self.phash_indexer = PhashIndexer(
+            self.directory, list(self.all_img_file), self.db_label.get_all_phash(), dict(self.img_file_stat), self
+        )
+        self.phash_indexer.hashed.connect(self.on_phash_hashed)
+        self.phash_indexer.indexed.connect(self.on_phash_indexed)
+        self.phash_indexer.start()
+
+    def stop_phash(self):
+        if self.phash_indexer is None:
+            return
+
+        self.phash_indexer.hashed.disconnect(self.on_phash_hashed)
+        self.phash_indexer.indexed.disconnect(self.on_phash_indexed)
+        self.phash_indexer.stop()
+        self.phash_indexer = None
+
+    def on_phash_hashed(self, phash_rows, todo_count):
+        try:
+            self.db_label.save_phash(phash_rows)
+            self.phash_done_count += len(phash_rows)
+            self.phash_todo_count = todo_count
+        except:
+            logging.exception('on_phash_hashed exception')
         finally:
             self.update_btn_status()
 
-    def get_all_img_file(self):
-        self.all_img_file_index = 0
-        self.all_img_file = sorted([str(x.name) for x in Path(self.directory).iterdir(
-        ) if x.is_file() and x.suffix.upper() in ['.JPG', '.JPEG', '.BMP', '.PNG']])
+    def on_phash_indexed(self, duplicate_of):
+        try:
+            self.phash_indexer = None
+            self.duplicate_of = duplicate_of
+        finally:
+            self.update_btn_status()
 
     def read_label_file(self):
-        label_file = Path(self.directory).joinpath('label.sqllite3')
-        self.db_label = DBLabelText(str(label_file))
+        import_heavy_modules()
+        self.db_label = label_db.open_label_db(self.directory, self.project_file, self.concurrent)
+        self.label_repo = LabelRepository(self.db_label)
+        self.label_progress = LabelProgress(self.db_label.get_all_progress())
+        self.filmstrip.model.reset(self.directory, self.label_progress)
 
     def on_next_img(self):
         try:
-            self.all_img_file_index += 1
-            self.show_img()
+            self.flush_label()
+            img_index = self.step_img_index(1)
+            if img_index is not None:
+                self.all_img_file_index = img_index
+                self.show_img()
         finally:
             self.update_btn_status()
 
     def on_prev_img(self):
         try:
-            self.all_img_file_index -= 1
-            self.show_img()
+            self.flush_label()
+            img_index = self.step_img_index(-1)
+            if img_index is not None:
+                self.all_img_file_index = img_index
+                self.show_img()
         finally:
             self.update_btn_status()
 
+    def step_img_index(self, step):
+        # 勾选跳过重复图片时只停在每组的代表图片上, 那个方向没有了就不动
+        img_index = self.all_img_file_index + step
+        if self.checkbox_skip_duplicate.isChecked():
+            while 0 <= img_index < len(self.all_img_file) and img_index in self.duplicate_of:
+                img_index += step
+        return img_index if 0 <= img_index < len(self.all_img_file) else None
+
+    def next_not_duplicate(self, next_func):
+        img_index = next_func(self.all_img_file_index)
+        if not self.checkbox_skip_duplicate.isChecked():
+            return img_index
+
+        first = img_index
+        while img_index is not None and img_index in self.duplicate_of:
+            img_index = next_func(img_index)
+            if img_index == first:
+                return None
+        return img_index
+
     def on_page_jump(self):
         try:
+            self.flush_label()
             page_num = int(self.label_status_page_number.text())
             if page_num >= 1 and page_num <= len(self.all_img_file):
                 self.all_img_file_index = page_num - 1
@@ -733,6 +2385,303 @@ class MainWindow(QWidget):
         finally:
             self.update_btn_status()
 
+    def jump_to(self, img_index, message):
+        try:
+            self.flush_label()
+            if img_index is None or img_index == self.all_img_file_index:
+                QMessageBox.information(self, '<提示>', message, QMessageBox.Ok)
+                return
+            self.all_img_file_index = img_index
+            self.show_img()
+        finally:
+            self.update_btn_status()
+
+    def on_filmstrip_click(self, row):
+        try:
+            self.flush_label()
+            self.all_img_file_index = row
+            self.show_img()
+        finally:
+            self.update_btn_status()
+
+    def on_next_unlabeled(self):
+        self.jump_to(self.next_not_duplicate(self.label_progress.next_unlabeled), '没有其他未标注的图片')
+
+    def on_next_empty_text(self):
+        self.jump_to(self.next_not_duplicate(self.label_progress.next_empty_text), '没有其他有空文本的图片')
+
+    def on_search(self):
+        try:
+            self.stop_search()
+            self.search_model.clear()
+            self.label_search_status.clear()
+            text = self.lineedit_search.text()
+            if self.db_label is None or not text:
+                return
+
+            self.flush_label()
+            self.search_iter = self.db_label.search_text(text)
+            self.search_start_time = time.perf_counter()
+            self.timer_search.start()
+        except:
+            logging.exception('on_search exception')
+
+    def on_search_chunk(self):
+        try:
+            row_list = next(self.search_iter, None)
+        except:
+            logging.exception('on_search_chunk exception')
+            row_list = None
+
+        if row_list:
+            if not self.search_model.rowCount():
+                logging.info(f'search first chunk in {(time.perf_counter() - self.search_start_time) * 1000:.1f} ms')
+            self.search_model.append_rows(row_list)
+            self.label_search_status.setText(f'找到 {self.search_model.rowCount()} 个框, 搜索中...')
+            return
+
+        self.stop_search()
+        self.label_search_status.setText(
+            f'找到 {self.search_model.rowCount()} 个框, 用时 {time.perf_counter() - self.search_start_time:.2f} 秒'
+        )
+
+    def stop_search(self):
+        self.timer_search.stop()
+        if self.search_iter is not None:
+            self.search_iter.close()
+            self.search_iter = None
+
+    def on_search_result_click(self, index):
+        try:
+            row = index.row()
+            img_name = self.search_model.img_names[row]
+            activate_idx = self.search_model.ids[row]
+            img_index = self.label_progress.img_index.get(img_name)
+            if img_index is None:
+                QMessageBox.information(self, '<提示>', f'{img_name}\n图片不在当前目录的扫描结果里', QMessageBox.Ok)
+                return
+
+            self.flush_label()
+            self.all_img_file_index = img_index
+            self.show_img(activate_idx)
+            self.tableview_text.select_text(activate_idx)
+        except:
+            logging.exception('on_search_result_click exception')
+        finally:
+            self.update_btn_status()
+
+    def on_replace(self):
+        try:
+            old_text = self.lineedit_search.text()
+            new_text = self.lineedit_replace.text()
+            if self.db_label is None or not old_text:
+                return
+
+            if QMessageBox.question(
+                self,
+                '<提示>',
+                f'把所有框文本里的 "{old_text}" 替换为 "{new_text}" ?',
+                QMessageBox.Yes | QMessageBox.No
+            ) != QMessageBox.Yes:
+                return
+
+            self.stop_search()
+            self.flush_label()
+            count = self.db_label.replace_text(old_text, new_text)
+            # 改动可能涉及任何图片, 缓存和进度都重新读
+            self.label_repo.invalidate()
+            self.label_progress = LabelProgress(self.db_label.get_all_progress())
+            self.label_progress.extend(self.all_img_file)
+            self.progress_img_name = None
+            self.filmstrip.model.set_progress(self.label_progress)
+            if self.all_img_file:
+                self.show_img(self.label_img.img_activate_idx)
+            self.search_model.clear()
+            self.label_search_status.setText(f'替换了 {count} 个框')
+        except:
+            logging.exception('on_replace exception')
+        finally:
+            self.update_btn_status()
+
+    def on_copy_prev(self):
+        try:
+            if self.all_img_file_index <= 0:
+                return
+
+            prev_img_name = self.all_img_file[self.all_img_file_index - 1]
+            if len(self.label_repo.get(prev_img_name)) == 0:
+                QMessageBox.information(self, '<提示>', '上一张图片没有框', QMessageBox.Ok)
+                return
+
+            img_name = self.all_img_file[self.all_img_file_index]
+            box_count = len(self.label_repo.get(img_name))
+            if box_count > 0 and QMessageBox.question(
+                self,
+                '<提示>',
+                f'当前图片已经有 {box_count} 个框, 替换成上一张的框?',
+                QMessageBox.Yes | QMessageBox.No
+            ) != QMessageBox.Yes:
+                return
+
+            self.copy_text(self.all_img_file_index - 1, [self.all_img_file_index], replace=True)
+        except:
+            logging.exception('on_copy_prev exception')
+        finally:
+            self.update_btn_status()
+
+    def on_copy_next(self):
+        try:
+            first = self.all_img_file_index + 1
+            last = min(self.all_img_file_index + self.spinbox_copy_count.value(), len(self.all_img_file) - 1)
+            if first > last:
+                return
+
+            # 已经有框的图片跳过, 不覆盖别人标好的
+            copied_dict = self.copy_text(self.all_img_file_index, list(range(first, last + 1)), replace=False)
+            QMessageBox.information(
+                self,
+                '<提示>',
+                f'复制到 {len(copied_dict)} 张图片, 跳过 {last - first + 1 - len(copied_dict)} 张已经有框的图片',
+                QMessageBox.Ok
+            )
+        except:
+            logging.exception('on_copy_next exception')
+        finally:
+            self.update_btn_status()
+
+    def frame_shift_list(self, index_list):
+        # 相邻两张之间的平移累加起来, 得到后面每一张相对第一张的平移; 估计不出来的一步当作没有移动
+        gray, img_size = read_small_gray(Path(self.directory).joinpath(self.all_img_file[index_list[0]]))
+        shift_x, shift_y = 0, 0
+        shift_list = []
+        for idx in index_list[1:]:
+            next_gray, next_size = read_small_gray(Path(self.directory).joinpath(self.all_img_file[idx]))
+            if gray is not None and next_gray is not None and next_size == img_size and gray.shape == next_gray.shape:
+                dx, dy, score = geometry.estimate_translation(gray, next_gray)
+                if score >= COPY_SHIFT_MIN_SCORE:
+                    shift_x += int(round(dx * img_size[0] / gray.shape[1]))
+                    shift_y += int(round(dy * img_size[1] / gray.shape[0]))
+            shift_list.append(((1, 1, shift_x, shift_y), next_size))
+            gray, img_size = next_gray, next_size
+        return shift_list
+
+    def copy_text(self, src_index, dst_index_list, replace):
+        # 一个事务写库, 写完只刷新一次界面
+        self.flush_label()
+        start = time.perf_counter()
+        if self.checkbox_copy_shift.isChecked():
+            shift_list = self.frame_shift_list([src_index] + dst_index_list)
+        else:
+            shift_list = [((1, 1, 0, 0), None)] * len(dst_index_list)
+        dst_list = [
+            (self.all_img_file[idx], shift, size)
+            for idx, (shift, size) in zip(dst_index_list, shift_list)
+        ]
+        copied_dict = self.label_repo.copy_text(self.all_img_file[src_index], dst_list, replace)
+        logging.info(
+            f'copy {self.all_img_file[src_index]} to {len(copied_dict)}/{len(dst_list)} images '
+            f'in {(time.perf_counter() - start) * 1000:.1f} ms'
+        )
+        self.on_text_copied(copied_dict)
+        return copied_dict
+
+    def on_text_copied(self, copied_dict):
+        for img_name, (box_count, empty_count) in copied_dict.items():
+            self.label_progress.update(img_name, box_count, empty_count)
+            self.filmstrip.model.update_row(self.label_progress.img_index.get(img_name))
+        if self.all_img_file[self.all_img_file_index] in copied_dict:
+            self.show_img()
+
+    def on_copy_duplicate(self):
+        try:
+            # 每组重复图片里找一张有框的作为来源(优先代表图片), 复制到同组还没有框的图片; 图片大小不同时按比例缩放
+            group_dict = {}
+            for img_index, rep_index in sorted(self.duplicate_of.items()):
+                group_dict.setdefault(rep_index, [rep_index]).append(img_index)
+
+            progress_dict = self.label_progress.progress_dict
+            group_list = []
+            for member_list in group_dict.values():
+                img_name_list = [self.all_img_file[idx] for idx in member_list]
+                labeled_list = [img_name for img_name in img_name_list if progress_dict.get(img_name, (0, 0))[0] > 0]
+                unlabeled_list = [img_name for img_name in img_name_list if progress_dict.get(img_name, (0, 0))[0] == 0]
+                if labeled_list and unlabeled_list:
+                    group_list.append((labeled_list[0], unlabeled_list))
+            if not group_list:
+                QMessageBox.information(self, '<提示>', '没有需要复制的重复图片', QMessageBox.Ok)
+                return
+
+            dst_count = sum(len(unlabeled_list) for _, unlabeled_list in group_list)
+            if QMessageBox.question(
+                self,
+                '<提示>',
+                f'把 {len(group_list)} 组重复图片里已标注的框复制到同组 {dst_count} 张没有框的图片?',
+                QMessageBox.Yes | QMessageBox.No
+            ) != QMessageBox.Yes:
+                return
+
+            self.flush_label()
+            start = time.perf_counter()
+            copy_list = []
+            for src_img_name, unlabeled_list in group_list:
+                src_size = self.read_img_size(src_img_name)
+                dst_list = []
+                for img_name in unlabeled_list:
+                    size = self.read_img_size(img_name)
+                    if src_size and size:
+                        dst_list.append((img_name, (size[0] / src_size[0], size[1] / src_size[1], 0, 0), size))
+                    else:
+                        dst_list.append((img_name, (1, 1, 0, 0), size))
+                copy_list.append((src_img_name, dst_list))
+            copied_dict = self.label_repo.copy_text_groups(copy_list)
+            logging.info(f'copy to {len(copied_dict)} duplicates in {(time.perf_counter() - start) * 1000:.1f} ms')
+            self.on_text_copied(copied_dict)
+            QMessageBox.information(self, '<提示>', f'复制到 {len(copied_dict)} 张重复图片', QMessageBox.Ok)
+        except:
+            logging.exception('on_copy_duplicate exception')
+        finally:
+            self.update_btn_status()
+
+    def read_img_size(self, img_name):
+        # 只读文件头
+        size = QImageReader(str(Path(self.directory).joinpath(img_name))).size()
+        return (size.width(), size.height()) if size.isValid() else None
+
+    def update_progress_status(self):
+        progress = self.label_progress.stats()
+        duplicate_text = f', {len(self.duplicate_of)} 张重复' if self.duplicate_of else ''
+        self.label_status_progress.setText(
+            f'已标注 {progress["labeled_count"]}/{progress["img_count"]} 张, '
+            f'{progress["box_count"]} 个框, {progress["empty_count"]} 个空文本{duplicate_text}'
+        )
+        self.btn_next_unlabeled.setEnabled(bool(self.label_progress.unlabeled))
+        self.btn_next_empty_text.setEnabled(bool(self.label_progress.empty_text))
+
+    def update_progress(self, img_name):
+        # 用内存里的标注重新统计当前图片, 和 label_progress 触发器的口径一致
+        annotation = self.label_repo.get(img_name)
+        empty_count = sum(1 for img_text in annotation.texts if not img_text.strip(' '))
+        self.label_progress.update(img_name, len(annotation), empty_count)
+        self.progress_img_name = img_name
+        self.filmstrip.model.update_row(self.label_progress.img_index.get(img_name))
+
+    def update_progress_text(self, img_name, old_text, new_text):
+        # 改一个框的文本只可能让空文本数加一或减一, 不用重新统计整张图片
+        if old_text is None:
+            self.update_progress(img_name)
+            self.update_progress_status()
+            return
+
+        old_empty = not old_text.strip(' ')
+        new_empty = not new_text.strip(' ')
+        if old_empty == new_empty:
+            return
+
+        box_count, empty_count = self.label_progress.progress_dict.get(img_name, (0, 0))
+        self.label_progress.update(img_name, box_count, empty_count + (1 if new_empty else -1))
+        self.filmstrip.model.update_row(self.label_progress.img_index.get(img_name))
+        self.update_progress_status()
+
     def add_text(self, point_list):
         try:
             if not self.all_img_file:
@@ -740,8 +2689,11 @@ class MainWindow(QWidget):
 
             img_name = self.all_img_file[self.all_img_file_index]
             img_text = ''
-            activate_idx = self.db_label.add_text(img_name, point_list, img_text)
-            self.show_img(activate_idx)
+            activate_idx = self.label_repo.add_text(img_name, point_list, img_text)
+            self.update_progress(img_name)
+            self.tableview_text.insert_text(activate_idx, img_text)
+            self.show_img(activate_idx, table_update=False)
+            self.tableview_text.select_text(activate_idx)
         finally:
             self.update_btn_status()
 
@@ -750,51 +2702,114 @@ class MainWindow(QWidget):
             img_idx = self.tableview_text.remove_selected_row()
             if img_idx is not None:
                 img_name = self.all_img_file[self.all_img_file_index]
-                activate_idx = self.db_label.del_text(img_name, img_idx)
-                self.show_img(activate_idx)
+                activate_idx = self.label_repo.del_text(img_name, img_idx)
+                self.update_progress(img_name)
+                self.show_img(activate_idx, table_update=False)
         finally:
             self.update_btn_status()
 
     def on_nonactivate(self):
         try:
-            self.show_img(activate_idx=None)
+            self.show_img(activate_idx=None, table_update=False)
+            self.tableview_text.select_text(None)
         finally:
             self.update_btn_status()
 
+    @perf.timed('show_img')
     def show_img(self, activate_idx=None, img_update=True, table_update=True):
         img_name = self.all_img_file[self.all_img_file_index]
+        if self.concurrent and img_name != self.lease_img_name:
+            self.update_lease(img_name)
 
-        all_text = self.db_label.get_all_text(img_name)
+        all_text = self.label_repo.get_all_text(img_name)
+        if img_name != self.progress_img_name:
+            # 换图片时按内存里的标注统计一次, 之后改文本时增量更新
+            self.update_progress(img_name)
 
         if img_update:
             img_path = Path(self.directory).joinpath(img_name)
-            img = QPixmap(str(img_path))
+            pyramid = self.image_loader.request(img_path)
 
-            self.label_img.show_activate_img(img, all_text, activate_idx)
+            if pyramid is None and self.image_loader.request_key is not None:
+                # 图片还在后台解码, 先更新表格和状态栏, 解码完成后在 on_image_loaded 里绘制
+                self.img_load_generation = self.image_loader.generation
+                self.img_load_activate_idx = activate_idx
+                self.label_img.show_activate_img(None, [], None)
+            else:
+                self.img_load_generation = None
+                self.label_img.show_activate_img(pyramid, all_text, activate_idx)
+            self.image_loader.prefetch(self.get_neighbour_img_path())
 
         if table_update:
             self.tableview_text.show_activate_img(all_text, activate_idx)
 
+    def on_image_loaded(self, generation, pyramid):
+        if generation != self.img_load_generation:
+            return
+
+        try:
+            self.img_load_generation = None
+            img_name = self.all_img_file[self.all_img_file_index]
+            all_text = self.label_repo.get_all_text(img_name)
+            self.label_img.show_activate_img(pyramid, all_text, self.img_load_activate_idx)
+        except:
+            logging.exception('on_image_loaded exception')
+
+    def get_neighbour_img_path(self):
+        index_list = [self.all_img_file_index + i for i in range(1, IMAGE_PREFETCH_NEXT + 1)]
+        index_list += [self.all_img_file_index - i for i in range(1, IMAGE_PREFETCH_PREV + 1)]
+        return [
+            Path(self.directory).joinpath(self.all_img_file[idx])
+            for idx in index_list if 0 <= idx < len(self.all_img_file)
+        ]
+
     def update_points(self, activate_idx, point_list):
         if self.all_img_file:
             img_name = self.all_img_file[self.all_img_file_index]
-            self.db_label.update_points(img_name, activate_idx, point_list)
+            self.label_repo.update_points(img_name, activate_idx, point_list)
+
+    def hit_test(self, x, y):
+        if not self.all_img_file:
+            return None
+        return self.label_repo.hit_test(self.all_img_file[self.all_img_file_index], x, y)
 
     def on_activate_idx_change(self, activate_idx):
         self.show_img(activate_idx, table_update=False)
 
+    def on_imglabel_select(self, activate_idx):
+        self.show_img(activate_idx, table_update=False)
+        self.tableview_text.select_text(activate_idx)
+
     def on_tableview_text_change(self, activate_idx, new_text):
         img_name = self.all_img_file[self.all_img_file_index]
-        self.db_label.update_text(img_name, activate_idx, new_text)
-        self.show_img(activate_idx, img_update=True, table_update=False)
+        old_text = self.label_repo.update_text(img_name, activate_idx, new_text)
+        self.update_progress_text(img_name, old_text, new_text)
+        self.label_img.update_text(activate_idx, new_text)
 
     def on_imglabel_text_change(self, activate_idx, new_text):
         img_name = self.all_img_file[self.all_img_file_index]
-        self.db_label.update_text(img_name, activate_idx, new_text)
-        self.show_img(activate_idx, img_update=False, table_update=True)
+        old_text = self.label_repo.update_text(img_name, activate_idx, new_text)
+        self.update_progress_text(img_name, old_text, new_text)
+        self.tableview_text.update_text(activate_idx, new_text)
 
 if __name__ == '__main__':
+    # 打包成 exe 后查重用的进程池需要
+    multiprocessing.freeze_support()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    # 加 --perf 参数或者设置环境变量 TEXT_LABEL_PERF=1 打开性能统计, 超过阈值的操作记录到 ~/.text_label_tool/perf.log
+    if '--perf' in sys.argv or os.environ.get('TEXT_LABEL_PERF') == '1':
+        perf.enable(slow_threshold=float(os.environ.get('TEXT_LABEL_PERF_SLOW_MS', PERF_SLOW_THRESHOLD * 1000)) / 1000)
+    # 加 --project 工程库路径 参数进入工程模式, 加 --concurrent 参数进入多人模式
+    project_file = None
+    if '--project' in sys.argv[:-1]:
+        project_file = sys.argv[sys.argv.index('--project') + 1]
     app = QApplication(sys.argv)
-    widget = MainWindow()
+    widget = MainWindow(project_file=project_file, concurrent='--concurrent' in sys.argv)
     widget.show()
-    sys.exit(app.exec_())
+    # 窗口画出来以后再打开上次的目录, 加 --no-restore 参数不恢复
+    if '--no-restore' not in sys.argv:
+        QTimer.singleShot(0, widget.restore_state)
+    exit_code = app.exec_()
+    if perf.enabled:
+        perf.dump()
+    sys.exit(exit_code)
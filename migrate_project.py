@@ -0,0 +1,226 @@
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from image_scanner import IMAGE_MANIFEST_FILE
+from image_scanner import IMAGE_MANIFEST_VERSION
+from label_db import DBProjectLabelText
+from label_db import project_root
+
+
+LABEL_FILE_NAME = 'label.sqllite3'
+
+
+def find_label_dirs(directory_list, recursive=False):
+    # recursive 时在每个目录下找所有带 label.sqllite3 的子目录(一个批次一个目录)
+    for directory in directory_list:
+        if not recursive:
+            if Path(directory).joinpath(LABEL_FILE_NAME).is_file():
+                yield directory
+            else:
+                logging.warning(f'{directory} has no {LABEL_FILE_NAME}')
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(directory):
+            dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+            if LABEL_FILE_NAME in file_names:
+                yield dir_path
+
+
+def read_manifest(directory):
+    # 目录扫描时留下的清单里有所有图片的 [文件名, 大小, 修改时间], 不用再遍历目录
+    # 清单可能是上次打开目录时留下的, fill_image_stat 还会再 stat 一遍
+    try:
+        with open(os.path.join(directory, IMAGE_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != IMAGE_MANIFEST_VERSION:
+            return []
+        manifest = manifest['dirs']
+    except FileNotFoundError:
+        return []
+    except:
+        logging.exception('read_manifest exception')
+        return []
+
+    file_list = []
+    for rel_dir, entry in manifest.items():
+        prefix = rel_dir + '/' if rel_dir else ''
+        for name, size, mtime in entry['files']:
+            file_list.append((prefix + name, size, mtime))
+    return file_list
+
+
+class ProjectMigrator:
+    def __init__(self, project_file):
+        self.db_label = DBProjectLabelText(project_file)
+        self.db_label.create_import_table()
+        self.conn = self.db_label.conn
+        self.cursor = self.db_label.cursor
+        self.cursor.execute(r'''
+        CREATE TABLE IF NOT EXISTS project_source (
+            root TEXT NOT NULL PRIMARY KEY, --已合并的图片根目录
+            image_count INTEGER NOT NULL, --图片数
+            box_count INTEGER NOT NULL, --框数
+            tsp INTEGER NOT NULL --合并的时间戳
+        );
+        ''')
+        self.conn.commit()
+
+    def delete_root(self, root):
+        # 不单独提交, 和重新合并的插入在同一个事务里, 合并失败时原来的标注还在
+        self.cursor.execute(r'''
+        DELETE FROM label_box WHERE image_id IN (SELECT id FROM images WHERE root=?)
+        ''', (root,))
+        self.cursor.execute(r'''
+        DELETE FROM label_import WHERE image_id IN (SELECT id FROM images WHERE root=?)
+        ''', (root,))
+        self.cursor.execute(r'''
+        DELETE FROM project_source WHERE root=?
+        ''', (root,))
+
+    def fill_image_stat(self, root):
+        # 逐个 stat 这个根目录下的所有图片, 已经登记过的图片也更新, 找不到的文件保留原来的值(新登记的为 0)
+        row_list = self.cursor.execute(r'''
+        SELECT id, rel_path FROM images WHERE root=?
+        ''', (root,)).fetchall()
+        update_rows = []
+        for id, rel_path in row_list:
+            try:
+                st = os.stat(os.path.join(root, rel_path))
+                update_rows.append((st.st_size, st.st_mtime_ns, id))
+            except OSError:
+                pass
+        self.cursor.executemany(r'''
+        UPDATE images SET size=?, mtime=? WHERE id=?
+        ''', update_rows)
+
+    def migrate(self, directory, replace=False):
+        # 整个目录的库 ATTACH 进来, 用 INSERT ... SELECT 一次搬过去, 一个目录一个事务
+        root = project_root(directory)
+        migrated = self.cursor.execute('SELECT 1 FROM project_source WHERE root=?', (root,)).fetchone()
+        if migrated and not replace:
+            return None
+
+        manifest_rows = [(root, rel_path, size, mtime) for rel_path, size, mtime in read_manifest(directory)]
+        # ATTACH/DETACH 不能在事务里执行
+        self.cursor.execute('ATTACH DATABASE ? AS src', (str(Path(directory).joinpath(LABEL_FILE_NAME)),))
+        try:
+            has_label = self.cursor.execute(r'''
+            SELECT 1 FROM src.sqlite_master WHERE type='table' AND name='label_text'
+            ''').fetchone()
+            has_import = self.cursor.execute(r'''
+            SELECT 1 FROM src.sqlite_master WHERE type='table' AND name='label_import'
+            ''').fetchone()
+
+            with self.conn:
+                if migrated:
+                    self.delete_root(root)
+                self.cursor.executemany(r'''
+                INSERT OR IGNORE INTO images (root,rel_path,size,mtime) VALUES (?,?,?,?)
+                ''', manifest_rows)
+
+                box_count = 0
+                if has_label:
+                    self.cursor.execute(r'''
+                    INSERT OR IGNORE INTO images (root,rel_path,size,mtime)
+                    SELECT DISTINCT ?, img_name, 0, 0 FROM src.label_text
+                    ''', (root,))
+
+                    self.cursor.execute(r'''
+                    INSERT INTO label_box (image_id,x1,y1,x2,y2,x3,y3,x4,y4,img_text,tsp)
+                    SELECT images.id,t.x1,t.y1,t.x2,t.y2,t.x3,t.y3,t.x4,t.y4,t.img_text,t.tsp
+                    FROM src.label_text AS t JOIN images ON images.root = ? AND images.rel_path = t.img_name
+                    ORDER BY t.id
+                    ''', (root,))
+                    box_count = self.cursor.rowcount
+
+                self.fill_image_stat(root)
+
+                if has_import:
+                    self.cursor.execute(r'''
+                    INSERT OR REPLACE INTO label_import (image_id,box_count,tsp)
+                    SELECT images.id,i.box_count,i.tsp
+                    FROM src.label_import AS i JOIN images ON images.root = ? AND images.rel_path = i.img_name
+                    ''', (root,))
+
+                image_count = self.cursor.execute(r'''
+                SELECT COUNT(*) FROM images WHERE root=?
+                ''', (root,)).fetchone()[0]
+                self.cursor.execute(r'''
+                INSERT INTO project_source (root,image_count,box_count,tsp) VALUES (?,?,?,?)
+                ''', (root, image_count, box_count, int(time.time())))
+        finally:
+            self.cursor.execute('DETACH DATABASE src')
+
+        return {'image_count': image_count, 'box_count': box_count}
+
+    def migrate_all(self, directory_list, replace=False, drop_index=True):
+        stat = {'dir_count': 0, 'image_count': 0, 'box_count': 0, 'skip_count': 0, 'error_count': 0}
+        start = time.perf_counter()
+        if drop_index:
+            # 合并期间不维护 (image_id, id) 索引, 全部合并完再建
+            self.cursor.execute(f'DROP INDEX IF EXISTS `{self.db_label.IMAGE_INDEX}`')
+            self.conn.commit()
+        try:
+            for directory in directory_list:
+                try:
+                    result = self.migrate(directory, replace)
+                except:
+                    logging.exception(f'migrate {directory} exception')
+                    stat['error_count'] += 1
+                    continue
+
+                if result is None:
+                    stat['skip_count'] += 1
+                    continue
+                stat['dir_count'] += 1
+                stat['image_count'] += result['image_count']
+                stat['box_count'] += result['box_count']
+                logging.info(
+                    f'migrated {stat["dir_count"]} directories, {stat["image_count"]} images, '
+                    f'{stat["box_count"]} boxes, last {directory}'
+                )
+        finally:
+            if drop_index:
+                self.db_label.create_index()
+                self.conn.commit()
+
+        stat['time'] = time.perf_counter() - start
+        return stat
+
+    def close(self):
+        self.db_label.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把各个目录下的 label.sqllite3 合并到一个工程库')
+    parser.add_argument('project', help='工程库路径, 不存在时新建')
+    parser.add_argument('directory', nargs='+', help='被标注的目录, 下面有 label.sqllite3')
+    parser.add_argument('--recursive', action='store_true', help='在目录下递归查找所有带 label.sqllite3 的子目录')
+    parser.add_argument('--replace', action='store_true', help='重新合并已经合并过的目录, 默认跳过')
+    parser.add_argument('--keep-index', action='store_true', help='合并时不删除重建 image_id 索引')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    migrator = ProjectMigrator(args.project)
+    try:
+        stat = migrator.migrate_all(
+            find_label_dirs(args.directory, args.recursive),
+            replace=args.replace,
+            drop_index=not args.keep_index
+        )
+    finally:
+        migrator.close()
+
+    logging.info(
+        f'migrate {stat["dir_count"]} directories, {stat["image_count"]} images, {stat["box_count"]} boxes '
+        f'in {stat["time"]:.1f} s, {stat["skip_count"]} already migrated, {stat["error_count"]} failed'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import functools
+import logging
+import logging.handlers
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+
+PERF_BUCKET_LIST = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5]
+PERF_SLOW_THRESHOLD = 0.1
+PERF_LOG_FILE = Path.home().joinpath('.text_label_tool', 'perf.log')
+
+
+class PerfHistogram:
+    def __init__(self):
+        # 对数分桶, 最后一个桶放超过 5 秒的
+        self.bucket_count = [0] * (len(PERF_BUCKET_LIST) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.bucket_count[bisect_left(PERF_BUCKET_LIST, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        # 返回所在桶的上界
+        rank = self.count * p
+        seen = 0
+        for idx, count in enumerate(self.bucket_count):
+            seen += count
+            if seen >= rank and count:
+                return PERF_BUCKET_LIST[idx] if idx < len(PERF_BUCKET_LIST) else self.max
+        return self.max
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class PerfMonitor:
+    def __init__(self):
+        # 默认关闭, 关闭时被 timed 装饰的函数只多一次属性判断
+        self.enabled = False
+        self.slow_threshold = PERF_SLOW_THRESHOLD
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.slow_logger = logging.getLogger('text_label_tool.slow')
+
+    def enable(self, log_file=PERF_LOG_FILE, slow_threshold=PERF_SLOW_THRESHOLD):
+        self.enabled = True
+        self.slow_threshold = slow_threshold
+
+        log_file = Path(log_file)
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(str(log_file), maxBytes=1024 * 1024, backupCount=3, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.slow_logger.addHandler(handler)
+        self.slow_logger.setLevel(logging.INFO)
+        self.slow_logger.propagate = False
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = PerfHistogram()
+            histogram.add(seconds)
+
+        if seconds >= self.slow_threshold:
+            self.slow_logger.warning(f'slow {name} {seconds * 1000:.1f} ms')
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.stats() for name, histogram in sorted(self.histograms.items())}
+
+    def dump(self):
+        lines = [f'{"name":<24} {"count":>8} {"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}']
+        for name, stats in self.summary().items():
+            lines.append(
+                f'{name:<24} {stats["count"]:>8} {stats["mean"] * 1000:>9.2f} {stats["p50"] * 1000:>9.2f} '
+                f'{stats["p95"] * 1000:>9.2f} {stats["p99"] * 1000:>9.2f} {stats["max"] * 1000:>9.2f}'
+            )
+        text = '\n'.join(lines)
+        self.slow_logger.info('summary\n' + text)
+        logging.info('perf summary\n' + text)
+        return text
+
+
+perf = PerfMonitor()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PySide2.QtCore import QCoreApplication
+from PySide2.QtGui import QImageReader
+
+import geometry
+from label_db import open_label_db
+
+
+MIN_QUAD_AREA = 16
+MIN_QUAD_SIDE = 2
+ISSUE_LIST = ['missing_image', 'unreadable_image', 'degenerate', 'out_of_bounds', 'bad_order', 'duplicate']
+
+# read_image_size 里的 QImageReader 要靠 QCoreApplication 加载图片格式插件, main 里创建后一直用到退出
+qt_app = None
+
+
+def read_image_size(img_path):
+    # 只读文件头拿宽高, 不解码; 文件不存在返回 None, 读不出来返回 (0, 0)
+    if not os.path.isfile(img_path):
+        return None
+    size = QImageReader(img_path).size()
+    if not size.isValid():
+        return (0, 0)
+    return (size.width(), size.height())
+
+
+def load_columns(db_label):
+    # 整张表读成列: 每个框对应的图片序号, id, (N,4,2) 坐标, 文本是否为空
+    img_name_list = []
+    img_index = {}
+    img_idx_parts = []
+    id_parts = []
+    point_parts = []
+    empty_parts = []
+    for img_names, ids, points, texts in db_label.iter_text_columns():
+        idx_list = []
+        for img_name in img_names:
+            idx = img_index.get(img_name)
+            if idx is None:
+                idx = img_index[img_name] = len(img_name_list)
+                img_name_list.append(img_name)
+            idx_list.append(idx)
+        img_idx_parts.append(np.array(idx_list, dtype=np.int32))
+        id_parts.append(ids)
+        point_parts.append(points)
+        empty_parts.append(np.array([not img_text.strip() for img_text in texts], dtype=bool))
+        logging.info(f'read {sum(len(part) for part in id_parts)} boxes')
+
+    if not id_parts:
+        return [], np.zeros(0, np.int32), np.zeros(0, np.int64), np.zeros((0, 4, 2), np.int32), np.zeros(0, bool)
+    return (
+        img_name_list,
+        np.concatenate(img_idx_parts),
+        np.concatenate(id_parts),
+        np.concatenate(point_parts),
+        np.concatenate(empty_parts),
+    )
+
+
+def read_all_image_size(directory, img_name_list, workers):
+    # 读文件头主要是等磁盘/网络, 用线程池并发
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        size_list = list(executor.map(
+            read_image_size,
+            [str(Path(directory).joinpath(img_name)) for img_name in img_name_list],
+            chunksize=64
+        ))
+    logging.info(f'read {len(size_list)} image headers in {time.perf_counter() - start:.1f} s')
+
+    # (M, 2) 宽高, 不存在的图片记为 -1, 读不出来的记为 0
+    img_size = np.full((len(size_list), 2), -1, dtype=np.int64)
+    for idx, size in enumerate(size_list):
+        if size is not None:
+            img_size[idx] = size
+    return img_size
+
+
+def find_duplicates(img_idx, ids, points):
+    # 同一张图片上坐标完全相同的框, 保留 id 最小的一个
+    # 先把图片序号和 8 个坐标哈希成一个 uint64 只排序一次, 再逐项比较相邻的行排除哈希碰撞
+    if len(ids) == 0:
+        return np.zeros(0, dtype=bool)
+    columns = np.concatenate([img_idx[:, None], points.reshape((-1, 8))], axis=1).astype(np.uint64)
+    multipliers = np.random.RandomState(0).randint(1, 2 ** 62, size=columns.shape[1], dtype=np.int64).astype(np.uint64) | np.uint64(1)
+    with np.errstate(over='ignore'):
+        row_hash = (columns * multipliers).sum(axis=1)
+    # 输入按图片和 id 升序, 稳定排序后相同的行里 id 最小的排在最前面
+    order = np.argsort(row_hash, kind='mergesort')
+    sorted_columns = columns[order]
+    same = (row_hash[order][1:] == row_hash[order][:-1]) & np.all(sorted_columns[1:] == sorted_columns[:-1], axis=1)
+    duplicate = np.zeros(len(ids), dtype=bool)
+    duplicate[order[1:][same]] = True
+    return duplicate
+
+
+def check(img_idx, ids, points, img_size):
+    box_size = img_size[img_idx]
+    missing_image = box_size[:, 0] < 0
+    unreadable_image = box_size[:, 0] == 0
+    has_size = box_size[:, 0] > 0
+
+    area = geometry.quad_area(points)
+    side = np.linalg.norm(points - np.roll(points, -1, axis=1), axis=2)
+    degenerate = (area < MIN_QUAD_AREA) | (side.min(axis=1) < MIN_QUAD_SIDE)
+
+    # 合法坐标范围和界面里 geometry.to_image 一致: [0, 宽-1], [0, 高-1]
+    high = (box_size - 1)[:, None, :]
+    out_of_bounds = has_size & np.any((points < 0) | (points > high), axis=(1, 2))
+
+    bad_order = np.any(geometry.order_points(points) != points, axis=(1, 2)) if len(ids) else np.zeros(0, bool)
+
+    issue_dict = {
+        'missing_image': missing_image,
+        'unreadable_image': unreadable_image,
+        'degenerate': degenerate,
+        'out_of_bounds': out_of_bounds,
+        'bad_order': bad_order,
+        'duplicate': find_duplicates(img_idx, ids, points),
+    }
+    return issue_dict, area
+
+
+def percentile_dict(values):
+    if len(values) == 0:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+    return {'min': float(values.min()), 'p50': p50, 'p95': p95, 'p99': p99, 'max': float(values.max())}
+
+
+def build_report(directory, img_name_list, img_idx, ids, empty, img_size, issue_dict, area):
+    box_count = np.bincount(img_idx, minlength=len(img_name_list))
+    report = {
+        'directory': str(directory),
+        'summary': {
+            'image_count': len(img_name_list),
+            'box_count': int(len(ids)),
+            'empty_text_count': int(empty.sum()),
+        },
+        'stats': {
+            'boxes_per_image': percentile_dict(box_count),
+            'box_area': percentile_dict(area),
+            'image_width': percentile_dict(img_size[img_size[:, 0] > 0, 0]),
+            'image_height': percentile_dict(img_size[img_size[:, 0] > 0, 1]),
+        },
+        'issues': {},
+    }
+    for name in ISSUE_LIST:
+        mask = issue_dict[name]
+        report['summary'][f'{name}_count'] = int(mask.sum())
+        report['issues'][name] = ids[mask].tolist()
+    report['missing_images'] = [img_name_list[i] for i in np.flatnonzero(img_size[:, 0] < 0).tolist()]
+    report['unreadable_images'] = [img_name_list[i] for i in np.flatnonzero(img_size[:, 0] == 0).tolist()]
+    return report
+
+
+def build_fixes(img_idx, ids, points, img_size, issue_dict, delete_missing=False):
+    # 删除退化的框和重复框(可选删除图片已不存在的框), 越界的坐标限制到图片内, 角点重新排序
+    delete = issue_dict['degenerate'] | issue_dict['duplicate']
+    if delete_missing:
+        delete |= issue_dict['missing_image']
+
+    fixed = points.copy()
+    out_of_bounds = issue_dict['out_of_bounds']
+    if out_of_bounds.any():
+        high = (img_size[img_idx[out_of_bounds]] - 1)[:, None, :]
+        fixed[out_of_bounds] = np.clip(fixed[out_of_bounds], 0, high)
+    if len(fixed):
+        fixed = geometry.order_points(fixed).astype(np.int32)
+
+    update = ~delete & np.any(fixed != points, axis=(1, 2))
+    # 限制到图片内后变得太小的框也删掉
+    shrunk = update & (geometry.quad_area(fixed) < MIN_QUAD_AREA)
+    delete |= shrunk
+    update &= ~shrunk
+    return ids[delete].tolist(), list(zip(ids[update].tolist(), fixed[update]))
+
+
+def validate(directory, report_file, workers=16, fix=False, delete_missing=False, project_file=None):
+    start = time.perf_counter()
+    db_label = open_label_db(directory, project_file)
+    try:
+        img_name_list, img_idx, ids, points, empty = load_columns(db_label)
+        img_size = read_all_image_size(directory, img_name_list, workers)
+        issue_dict, area = check(img_idx, ids, points, img_size)
+        report = build_report(directory, img_name_list, img_idx, ids, empty, img_size, issue_dict, area)
+
+        if fix:
+            delete_ids, point_rows = build_fixes(img_idx, ids, points, img_size, issue_dict, delete_missing)
+            db_label.apply_fixes(delete_ids, point_rows)
+            report['fix'] = {'delete_count': len(delete_ids), 'update_count': len(point_rows)}
+            logging.info(f'fix: delete {len(delete_ids)} boxes, update {len(point_rows)} boxes')
+    finally:
+        db_label.close()
+
+    report['time'] = time.perf_counter() - start
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查标注数据并输出统计报告')
+    parser.add_argument('directory', help='被标注的目录, 下面有 label.sqllite3')
+    parser.add_argument('--report', default='validate_report.json', help='json 报告输出路径')
+    parser.add_argument('--workers', type=int, default=16, help='读取图片文件头的线程数')
+    parser.add_argument('--fix', action='store_true', help='在一个事务里删除退化/重复的框, 修正越界坐标和角点顺序')
+    parser.add_argument('--delete-missing', action='store_true', help='和 --fix 一起使用, 删除图片已不存在的框')
+    parser.add_argument('--project', default=None, help='工程库路径, 检查工程库里这个目录的标注')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    global qt_app
+    qt_app = QCoreApplication.instance() or QCoreApplication([sys.argv[0]])
+
+    report = validate(args.directory, args.report, args.workers, args.fix, args.delete_missing, args.project)
+    logging.info(
+        ', '.join(f'{name} {value}' for name, value in report['summary'].items()) +
+        f' in {report["time"]:.1f} s'
+    )
+
+
+if __name__ == '__main__':
+    main()